@@ -9,41 +9,42 @@ date: 2019-1-9
 
 import datetime
 
+from timeutil import to_epoch_ns, to_datetime
+
 class Bar(object):
     """
     Bar数据类型，在一段时间内的开盘价，收盘价，最高，最低价，成交量等信息。
+    时间保存为int64的epoch纳秒(time属性)，dt和strtime在读取时才创建。
     """
-    def __init__(self, symbol, dt, open, high, low, close, volume):
+    def __init__(self, symbol, dt, open, high, low, close, volume, check=True):
         """
         Parameter:
         symbol - 标的代码
         dt - 日期时间, 可以形如'%Y-%m-%d %H:%M:%S'的字符串，
-            可以是datetime.datetime类型的数据。
+            可以是datetime.datetime类型的数据，也可以是int类型的epoch纳秒。
         open - 开盘价
         high - 最高价
         low - 最低价
         close - 收盘价
         volume - 成交量
+        check - 是否检查最高/最低价的一致性，数据在载入时已经检查过的可以关闭。
         """
         self.symbol = symbol
 
         if isinstance(dt, str):
             try:
-                self.dt = datetime.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
+                dt = datetime.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
             except ValueError:
                 raise ValueError("{} and '%Y-%m-%d %H:%M:%S' can’t be parsed by time.strptime()".format(dt))
 
-            self.strtime = dt
-
-        if isinstance(dt, datetime.datetime):
-            self.dt = dt
-            self.strtime = self.dt.strftime("%Y-%m-%d %H:%M:%S")
+        self.time = to_epoch_ns(dt)
 
-        if high < max(open, high, low, close):
-            raise ValueError("Error: high should be the maximum of open, high, low, close")
+        if check:
+            if high < max(open, high, low, close):
+                raise ValueError("Error: high should be the maximum of open, high, low, close")
 
-        if low > min(open, high, low, close):
-            raise ValueError("Error: low should be the minimum of open, high, low, close")
+            if low > min(open, high, low, close):
+                raise ValueError("Error: low should be the minimum of open, high, low, close")
 
         self.open = open
         self.high = high
@@ -51,11 +52,19 @@ class Bar(object):
         self.close = close
         self.volume = volume
 
+    @property
+    def dt(self):
+        return to_datetime(self.time)
+
+    @property
+    def strtime(self):
+        return self.dt.strftime("%Y-%m-%d %H:%M:%S")
+
     def __repr__(self):
         items = ['symbol', 'strtime', 'open', 'high', 'low', 'close', 'volume']
         s = ""
         for item in items:
-            s += "{key}:{value}  ".format(key=item, value=self.__dict__[item])
+            s += "{key}:{value}  ".format(key=item, value=getattr(self, item))
         return s
 
 
@@ -8,14 +8,28 @@ author: lvbj
 date: 201-1-5
 """
 
-from datetime import datetime
+import hashlib
 import os, os.path
-import pandas as pd
+import warnings
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 from abc import ABCMeta, abstractmethod
 
 from event import MarketEvent
 from bar import Bar
+from timeutil import parse_epoch_ns
+
+
+class MissingBarWarning(UserWarning):
+    """
+    推送的bar数据中有价格为NaN的行，这些行被跳过。
+    """
+    pass
+
 
 class DataHandler(object):
     """
@@ -49,7 +63,208 @@ class DataHandler(object):
         raise NotImplementedError("Should implement update_bars()")
 
 
-class HistoricCSVDataHandler(DataHandler):
+class DataFrameDataHandler(DataHandler):
+    """
+    DataFrameDataHandler 从已经载入内存的bar数据(pd.DataFrame)中逐个推送bar，
+    提供与实盘交易相同的获取最新bar数据的接口。
+
+    同一份数据可以构造多个DataFrameDataHandler，避免每次回测都重新读取和转换csv文件。
+
+    除了逐个标的的get_latest_bars，还可以通过get_latest_panel以对齐的numpy矩阵
+    一次取得所有标的最近N个bar的数据，供截面策略(PanelStrategy)使用。
+
+    载入时所有的时间被一次性解析成int64的epoch纳秒，推送bar时不再解析时间。
+    """
+
+    PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+    # 基准的标的代码和bar数据，基准不在symbol_list中时由子类载入benchmark_data
+    benchmark_symbol = None
+    benchmark_data = None
+
+    def __init__(self, backtester, symbol_data, check_bars=True):
+        """
+        Parameter:
+        backtester - BackTester object
+        symbol_data - dict, symbol -> 已对齐的bar数据DataFrame，
+                    包含datetime, open, high, low, close, volume列。
+        check_bars - 是否逐个检查bar的最高/最低价，
+                    数据已经通过DataValidator检查时可以关闭。
+        """
+        self.backtester = backtester
+        self.symbol_list = list(symbol_data.keys())
+        self.check_bars = check_bars
+
+        self.symbol_data = {}
+        self.latest_symbol_data = {}
+        self.continue_backtest = True
+
+        self._set_symbol_data(symbol_data)
+
+    def _set_symbol_data(self, symbol_data):
+        """
+        设置要推送的bar数据，并把时间和各个字段排列成(bar数, 标的数)的矩阵。
+        有标的的价格或成交量为NaN的行(如按交易日历对齐时交易时段开始的缺失bar)
+        不会推送给策略和组合，这些行被去掉并以MissingBarWarning报告数量。
+        """
+        self.times = np.column_stack([parse_epoch_ns(symbol_data[s]['datetime'])
+                                      for s in self.symbol_list])
+        self.panel = {}
+        for field in self.PANEL_FIELDS:
+            self.panel[field] = np.column_stack([symbol_data[s][field].values.astype('float64')
+                                                 for s in self.symbol_list])
+        missing = np.zeros(len(self.times), dtype=bool)
+        for field in self.PANEL_FIELDS:
+            missing |= np.isnan(self.panel[field]).any(axis=1)
+        if missing.any():
+            keep = ~missing
+            warnings.warn("{} of {} bars have missing prices for some symbols and were "
+                          "skipped".format(int(missing.sum()), len(missing)), MissingBarWarning)
+            self.times = self.times[keep]
+            for field in self.PANEL_FIELDS:
+                self.panel[field] = self.panel[field][keep]
+            symbol_data = dict((s, symbol_data[s][keep].reset_index(drop=True))
+                               for s in self.symbol_list)
+        self.times.flags.writeable = False
+        for matrix in self.panel.values():
+            matrix.flags.writeable = False
+        self.n_bars = len(self.times)
+        self.cursor = 0
+
+        for s in self.symbol_list:
+            self.symbol_data[s] = symbol_data[s]
+            self.latest_symbol_data[s] = []
+        self.symbol_index = dict((s, j) for j, s in enumerate(self.symbol_list))
+        self.features = {}
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """
+        推送的bar数据的指纹(sha1)，由标的、时间和各个字段的矩阵计算，
+        数据不变时指纹不变。矩阵是只读的，指纹只计算一次。
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha1()
+            h.update(repr(self.symbol_list).encode('utf-8'))
+            h.update(self.times.tobytes())
+            for field in self.PANEL_FIELDS:
+                h.update(field.encode('utf-8'))
+                h.update(self.panel[field].tobytes())
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+                
+
+    def get_benchmark(self):
+        """
+        返回基准的收盘价序列(pd.Series, 以datetime64为索引)，没有基准时返回None。
+        """
+        if self.benchmark_data is not None:
+            df = self.benchmark_data
+        elif self.benchmark_symbol in self.symbol_data:
+            df = self.symbol_data[self.benchmark_symbol]
+        else:
+            return None
+        index = pd.DatetimeIndex(parse_epoch_ns(df['datetime']).view('datetime64[ns]'))
+        return pd.Series(df['close'].values.astype('float64'), index=index,
+                         name=self.benchmark_symbol)
+
+
+    def get_latest_bars(self, symbol, N=1):
+        """ 
+        Returns the last N bars from the latest_symbol list,
+        or N-k if less available.
+        """
+        try:
+            bars_list = self.latest_symbol_data[symbol]
+        except KeyError:
+            print("That symbol is not available in the historical data set.")
+        else:
+            return bars_list[-N:]
+
+
+    def get_latest_panel(self, N=1, fields=None):
+        """
+        Returns the last N bars of all symbols as read-only matrices
+        of shape (N, len(symbol_list)), or fewer rows if less bars are
+        available. The columns follow the order of symbol_list and the
+        matrices are views, no data is copied.
+
+        Parameter:
+        N - 最近的bar数。
+        fields - 需要的字段，默认为PANEL_FIELDS，也可以是add_feature注册的特征。
+
+        Returns:
+        dict, field -> np.ndarray
+        """
+        if fields is None:
+            fields = self.PANEL_FIELDS
+        start = max(self.cursor - N, 0)
+        return dict((f, (self.panel[f] if f in self.panel else self.features[f])[start:self.cursor])
+                    for f in fields)
+
+
+    def add_feature(self, column, values):
+        """
+        注册一个与bar对齐的特征矩阵，如FeatureStore计算的指标。
+        第t行的值必须只由第t个及之前的bar计算，读取时只返回已推送的bar对应的行。
+
+        Parameter:
+        column - 特征的名字，不能与PANEL_FIELDS重复。
+        values - 形状为(bar数, 标的数)的矩阵，列的顺序与symbol_list相同。
+        """
+        if column in self.panel:
+            raise ValueError("{} is a bar field".format(column))
+        values = np.array(values, dtype='float64')
+        if values.shape != self.times.shape:
+            raise ValueError("Feature {} has shape {}, expected {}".format(
+                column, values.shape, self.times.shape))
+        values.flags.writeable = False
+        self.features[column] = values
+
+
+    def get_latest_prices(self, field='close'):
+        """
+        Returns the latest values of field for all symbols as a read-only
+        row of the panel, in the order of symbol_list. The row is a view,
+        no data is copied.
+        """
+        return self.panel[field][self.cursor - 1]
+
+
+    def get_latest_feature(self, symbol, column, N=1):
+        """
+        Returns the last N values of a feature registered by add_feature
+        for symbol, up to and including the latest bar.
+        """
+        start = max(self.cursor - N, 0)
+        return self.features[column][start:self.cursor, self.symbol_index[symbol]]
+
+
+    def update_bars(self):
+        """
+        Pushes the latest bar to the latest_symbol_data structure for
+        all symbols in the symbol list.
+        """
+        i = self.cursor
+        if i >= self.n_bars:
+            self.continue_backtest = False
+        else:
+            times = self.times[i].tolist()
+            opens = self.panel['open'][i].tolist()
+            highs = self.panel['high'][i].tolist()
+            lows = self.panel['low'][i].tolist()
+            closes = self.panel['close'][i].tolist()
+            volumes = self.panel['volume'][i].tolist()
+            for j, s in enumerate(self.symbol_list):
+                bar = Bar(s, times[j], opens[j], highs[j], lows[j], closes[j], volumes[j],
+                          self.check_bars)
+                self.latest_symbol_data[s].append(bar)
+            self.cursor += 1
+        e = MarketEvent()
+        self.backtester.send_event(e)
+
+
+class HistoricCSVDataHandler(DataFrameDataHandler):
     """
     HistoricCSVDataHandler is designed to read CSV files for
     each requested symbol from disk and provide an interface
@@ -57,7 +272,8 @@ class HistoricCSVDataHandler(DataHandler):
     trading interface. 
     """
 
-    def __init__(self, backtester, csv_dir, symbol_list):
+    def __init__(self, backtester, csv_dir, symbol_list, validator=None,
+                 calendar=None, freq='1D', fill='session', label='start'):
         """
         Initialises the historic data handler by requesting
         the location of the CSV files and a list of symbols.
@@ -69,10 +285,33 @@ class HistoricCSVDataHandler(DataHandler):
         backtester - The Backtester.
         csv_dir - Absolute directory path to the CSV files.
         symbol_list - A list of symbol strings.
+        validator - An optional validation.DataValidator applied to
+            each file when it is loaded.
+        calendar - An optional tradingcalendar.TradingCalendar, or True to
+            look it up by exchange_id in the securities master. The bars
+            are then aligned to the trading sessions instead of padding
+            the union of all dates.
+        freq - The bar interval of the files, used with calendar.
+        fill - How missing bars are filled when aligning to the calendar:
+            'session' pads only within a trading session (the same as 'pad'
+            for daily bars, where suspended days keep the last close),
+            'pad' also pads across nights and weekends, None leaves them NaN.
+            Bars that are still NaN are skipped, see MissingBarWarning.
+        label - Whether the file times are the 'start' or the 'end' of
+            each bar, used with an intraday freq.
         """
         self.backtester = backtester
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
+        self.validator = validator
+        if calendar is True:
+            from tradingcalendar import calendar_for
+            calendar = calendar_for(symbol_list)
+        self.calendar = calendar
+        self.freq = freq
+        self.fill = fill
+        self.label = label
+        self.check_bars = validator is None or not validator.checks_bars
 
         self.symbol_data = {}
         self.latest_symbol_data = {}
@@ -89,84 +328,68 @@ class HistoricCSVDataHandler(DataHandler):
         For this handler it will be assumed that the data is
         taken from DTN IQFeed. Thus its format will be respected.
         """
+        symbol_data = {}
         comb_index = None
         for s in self.symbol_list:
             # Load the CSV file with no header information, indexed on date
-            self.symbol_data[s] = pd.io.parsers.read_csv(
-                                      os.path.join(self.csv_dir, '%s.csv' % s),
-                                      header=0, index_col=0, 
-                                      names=['datetime','open','low','high','close','volume','oi'],
-                                  )
+            df = pd.io.parsers.read_csv(
+                     os.path.join(self.csv_dir, '%s.csv' % s),
+                     header=0, index_col=0, 
+                     names=['datetime','open','low','high','close','volume','oi'],
+                 )
+            # Parse all the datetimes at once
+            df.index = pd.to_datetime(df.index)
+            df.index.name = 'datetime'
+            if self.validator is not None:
+                df = self.validator.validate(df.reset_index(), s).set_index('datetime')
+            symbol_data[s] = df
+            if self.calendar is not None:
+                continue
 
             # Combine the index to pad forward values
             if comb_index is None:
-                comb_index = self.symbol_data[s].index
+                comb_index = symbol_data[s].index
             else:
-                comb_index.union(self.symbol_data[s].index)
+                comb_index.union(symbol_data[s].index)
 
-            # Set the latest symbol_data to None
-            self.latest_symbol_data[s] = []
+        if self.calendar is not None:
+            symbol_data = self.calendar.align(
+                dict((s, symbol_data[s].reset_index()) for s in self.symbol_list),
+                self.freq, self.fill, self.label)
+            self._set_symbol_data(symbol_data)
+            return
 
         # Reindex the dataframes
         for s in self.symbol_list:
-            self.symbol_data[s] = self.symbol_data[s].reindex(index=comb_index, method='pad').iterrows()
-
-
-    def _get_new_bar(self, symbol):
-        """
-        Returns the latest bar from the data feed as a tuple of 
-        (sybmbol, datetime, open, low, high, close, volume).
-        """
-        for b in self.symbol_data[symbol]:
-            yield tuple([symbol, datetime.datetime.strptime(b[0], '%Y-%m-%d %H:%M:%S'), 
-                        b[1][0], b[1][1], b[1][2], b[1][3], b[1][4]])
+            symbol_data[s] = symbol_data[s].reindex(index=comb_index, method='pad').reset_index()
+        self._set_symbol_data(symbol_data)
 
 
-    def get_latest_bars(self, symbol, N=1):
-        """
-        Returns the last N bars from the latest_symbol list,
-        or N-k if less available.
-        """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-        else:
-            return bars_list[-N:]
-
-
-    def update_bars(self):
-        """
-        Pushes the latest bar to the latest_symbol_data structure
-        for all symbols in the symbol list.
-        """
-        for s in self.symbol_list:
-            try:
-                bar = next(self._get_new_bar(s))
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[s].append(bar)
-        self.backtester.send_event(MarketEvent())
-
-
-class CoinDataHandler(DataHandler):
+class CoinDataHandler(DataFrameDataHandler):
     """
     CoinDataHandler 读取数字货币的tick数据的csv文件，提供一个获取最新的bar数据的接口，
     与实盘交易相同的方式。
     """
-    def __init__(self, backtester, symbol_list, benchmark_symbol="okcoinUSD"):
+    def __init__(self, backtester, symbol_list, benchmark_symbol="okcoinUSD",
+                 validator=None, archive=None, start_date=None, end_date=None):
         """
         Parameter:
         backtester - BackTester object
         symbol_list - list of digital coin symbols, the symbol equal to data
                     filename without '.csv'.
         benchmark_symbol - symbol of benchmark.
+        validator - validation.DataValidator, 载入数据时检查并清洗bar数据。
+        archive - tickarchive.TickArchive或存档目录，给定时从tick存档而不是csv文件读取数据。
+        start_date, end_date - 从存档读取的日期区间(包含两端)，只解压这些天的数据。
         """
         self.backtester = backtester
         self.symbol_list = symbol_list
         self.benchmark_symbol = benchmark_symbol
+        self.validator = validator
+        self.archive = archive
+        self.start_date = start_date
+        self.end_date = end_date
+        self.check_bars = validator is None or not validator.checks_bars
 
         self.symbol_data = {}
 
@@ -176,116 +399,113 @@ class CoinDataHandler(DataHandler):
 
         self.continue_backtest = True
         self.current_datetime = None
-        self.__benchmarks = []
 
         self._open_convert_csv_files()
 
     @staticmethod
-    def _tick2bar(df):
+    def _tick2bar(ns, price, volume):
         """
-        将pd.DataFrame类型的tick文件，转换成bar数据类型的DataFrame类型。
+        将tick数据转换成bar数据类型的DataFrame类型。
         即，把(timestamp, price, volume)类型的数据转换成
         (datetime, open, high, low, close, volume)的数据。
+
+        tick按时间顺序排列，ns为int64的UTC epoch纳秒，每分钟的tick合成一个bar，
+        datetime列为datetime64[ns]类型的分钟起始时间。
         """
+        if len(ns) == 0:
+            return pd.DataFrame(columns=['datetime', 'open', 'high', 'low', 'close', 'volume'])
+
+        # 每个bar的第一个tick的位置
+        minute = ns // (60 * 10**9)
+        starts = np.r_[0, np.flatnonzero(np.diff(minute)) + 1]
+        ends = np.r_[starts[1:], len(ns)]
+
+        return pd.DataFrame({
+            'datetime': (minute[starts] * (60 * 10**9)).view('datetime64[ns]'),
+            'open': price[starts],
+            'high': np.maximum.reduceat(price, starts),
+            'low': np.minimum.reduceat(price, starts),
+            'close': price[ends - 1],
+            'volume': np.add.reduceat(volume, starts)})
+
+    @staticmethod
+    def _read_csv_ticks(symbol):
+        """
+        读取datas/<symbol>.csv中的tick，返回(epoch纳秒, price, volume)数组。
+        """
+        filename = "datas/{}.csv".format(symbol)
+        coin_df = pd.read_csv(filename, names=['timestamp', 'price', 'volume'],
+                    header=0, nrows=100000)
+        ns = np.round(coin_df['timestamp'].values.astype('float64') * 1e9).astype('int64')
+        return (ns, coin_df['price'].values.astype('float64'),
+                coin_df['volume'].values.astype('float64'))
     
-        df['dt'] = df['timestamp'].map(datetime.fromtimestamp)
-        
-        p_list = []
-        v_list = []
-        bar_df = pd.DataFrame()
-
-        dt = df.loc[0, 'dt']
-        for i in range(len(df)):
-            tick = df.iloc[i, :]
-            if dt.minute != tick['dt'].minute:
-                if len(p_list) != 0 and len(v_list) != 0:
-                    open_ = p_list[0]
-                    hi = max(p_list)
-                    lo = min(p_list)
-                    clos = p_list[-1]
-                    vol = sum(v_list)
-
-                    p_list.clear()
-                    v_list.clear()
-                    bar_df = bar_df.append(
-                        {'datetime': dt,
-                         'open': open_,
-                         'high': hi,
-                         'low': lo,
-                         'close': clos,
-                         'volume': vol},
-                         ignore_index=True
-                    )
-                    dt = tick['dt']
-            p_list.append(tick.price)
-            v_list.append(tick.volume)
-
-        converter = lambda dt: dt.strftime("%Y-%m-%d %H:%M:00")
-        bar_df['datetime'] = bar_df['datetime'].map(converter)
-        return bar_df
-    
-    def _open_convert_csv_files(self):
+    @classmethod
+    def load_symbol_data(cls, symbol_list, validator=None, archive=None,
+                         start_date=None, end_date=None, calendar=None, fill='session'):
         """
-        打开tick数据的csv文件，并将其转换成bar数据类型。
-        i.e. 把(timestamp, price, volume)类型的数据转换成
-        (datetime, open, high, low, close, volume)的数据。
+        打开tick数据的csv文件，并将其转换成对齐的bar数据，
+        返回dict, symbol -> bar数据DataFrame。
+        载入的数据可以交给DataFrameDataHandler重复使用。
+
+        Parameter:
+        symbol_list - list of digital coin symbols.
+        validator - validation.DataValidator, 在对齐之前检查并清洗每个标的的bar数据，
+                    检查结果记录在validator.report中。
+        archive - tickarchive.TickArchive或存档目录，给定时从tick存档读取数据。
+        start_date, end_date - 从存档读取的日期区间(包含两端)。
+        calendar - tradingcalendar.TradingCalendar，给定时按日历的分钟bar对齐
+                    (如全天交易的tradingcalendar.CRYPTO)，缺失的分钟以收盘价填充。
+        fill - 按日历对齐时缺失的分钟的填充方式，'session'只在同一个交易时段内填充
+                    (全天交易的CRYPTO没有休市，与'pad'相同，0点的缺失分钟也被填充)，
+                    'pad'跨越休市时段填充，None不填充，见tradingcalendar.SessionIndex.align。
         """
+        if isinstance(archive, str):
+            from tickarchive import TickArchive
+            archive = TickArchive(archive)
+
+        symbol_data = {}
         comb_index = None
-        for s in self.symbol_list:
-            filename = "datas/{}.csv".format(s)
-            coin_df = pd.read_csv(filename, names=['timestamp', 'price', 'volume'],
-                        header=0, nrows=100000)
-            bar_df = self._tick2bar(coin_df)
-            self.symbol_data[s] = bar_df
+        for s in symbol_list:
+            if archive is not None:
+                ticks = archive.read(s, start_date, end_date)
+            else:
+                ticks = cls._read_csv_ticks(s)
+            symbol_data[s] = cls._tick2bar(*ticks)
+            if validator is not None:
+                symbol_data[s] = validator.validate(symbol_data[s], s)
+            if calendar is not None:
+                continue
 
             if comb_index is None:
-                comb_index = self.symbol_data[s].index
+                comb_index = symbol_data[s].index
             else:
-                comb_index.union(self.symbol_data[s].index)
-
-            self.latest_symbol_data[s] = []
+                comb_index.union(symbol_data[s].index)
 
-        for s in self.symbol_list:
-            self.symbol_data[s] = self.symbol_data[s].reindex(index=comb_index, method='pad').iterrows()
+        if calendar is not None:
+            return calendar.align(symbol_data, '1min', fill)
 
+        for s in symbol_list:
+            symbol_data[s] = symbol_data[s].reindex(index=comb_index, method='pad')
+        return symbol_data
 
-    def _get_new_bar(self, symbol):
-        """
-        Returns the latest bar from the data feed as a Bar object.
-        (sybmbol, datetime, open, low, high, close, volume).
+    def _open_convert_csv_files(self):
         """
-        for b in self.symbol_data[symbol]:
-            args = {'symbol': symbol, 'dt': b[1]['datetime'], 'open': b[1]['open'],
-                    'high': b[1]['high'], 'low': b[1]['low'], 'close': b[1]['close'],
-                    'volume': b[1]['volume']}
-            yield(Bar(**args))
-                
-
-    def get_latest_bars(self, symbol, N=1):
-        """ 
-        Returns the last N bars from the latest_symbol list,
-        or N-k if less available.
+        打开tick数据的csv文件，并将其转换成bar数据类型。
+        i.e. 把(timestamp, price, volume)类型的数据转换成
+        (datetime, open, high, low, close, volume)的数据。
         """
-        try:
-            bars_list = self.latest_symbol_data[symbol]
-        except KeyError:
-            print("That symbol is not available in the historical data set.")
-        else:
-            return bars_list[-N:]
-
+        self._set_symbol_data(self.load_symbol_data(self.symbol_list, self.validator,
+                                                    self.archive, self.start_date,
+                                                    self.end_date))
 
-    def update_bars(self):
-        """
-        Pushes the latest bar to the latest_symbol_data structure for
-        all symbols in the symbol list.
-        """
-        for s in self.symbol_list:
+        # 基准不在symbol_list中时单独载入，不参与对齐和推送
+        b = self.benchmark_symbol
+        if b is not None and b not in self.symbol_list:
             try:
-                bar = next(self._get_new_bar(s))
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[s].append(bar)
-        e = MarketEvent()
-        self.backtester.send_event(e)
+                self.benchmark_data = self.load_symbol_data(
+                    [b], self.validator, self.archive, self.start_date, self.end_date)[b]
+            except IOError:
+                print("Benchmark {} can't be loaded, benchmark statistics "
+                      "will not be calculated.".format(b))
+                self.benchmark_data = None
@@ -0,0 +1,293 @@
+#encoding=utf-8
+
+"""
+证券主数据和成份股历史行情的批量下载。
+BulkDownloader 通过共用连接池的HTTP会话并发地下载沪深300成份股列表和每只股票的日线数据，
+失败的请求按指数退避重试，所有的请求经过同一个限速器。
+响应直接在内存中解析，不写临时文件，结果写入数据组件读取的目录:
+    成份股列表 -> datas/securities_master/symbol.csv
+    日线数据   -> datas/daily/<ticker>.csv (HistoricCSVDataHandler的格式)
+
+下载地址可以在构造时替换，例如指向本地的测试HTTP服务。
+
+使用:
+    python downloader.py 2018-01-01 2018-12-31
+
+author: lvbj
+date: 2019-3-25
+"""
+
+import datetime
+import io
+import os, os.path
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lazyimport import lazy_import
+
+pd = lazy_import('pandas')
+requests = lazy_import('requests')
+
+
+HS300_URL = "http://www.csindex.com.cn/uploads/file/autofile/cons/000300cons.xls"
+
+# 网易财经的历史日线数据，code为市场代码加股票代码
+NETEASE_URL = ("http://quotes.money.163.com/service/chddata.html?code={code}"
+               "&start={start}&end={end}&fields=TCLOSE;HIGH;LOW;TOPEN;VOTURNOVER")
+NETEASE_MARKETS = {'SHH': '0', 'SHE': '1'}
+
+# 网易财经日线数据的列名
+NETEASE_COLUMNS = {u'日期': 'datetime', u'开盘价': 'open', u'最高价': 'high',
+                   u'最低价': 'low', u'收盘价': 'close', u'成交量': 'volume'}
+
+# HistoricCSVDataHandler读取的列
+BAR_COLUMNS = ['datetime', 'open', 'low', 'high', 'close', 'volume', 'oi']
+
+# 这些状态码表示服务器暂时不可用，可以重试
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class DownloadError(IOError):
+    """
+    重试之后仍然无法下载。
+    """
+    pass
+
+
+class RateLimiter(object):
+    """
+    RateLimiter 是线程安全的令牌桶限速器，平均每秒最多rate个请求，
+    最多允许burst个请求同时发出。
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        Parameters:
+        rate - 每秒的请求数，为None时不限速。
+        burst - 令牌桶的容量。
+        """
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """
+        取得一个令牌，没有令牌时等待。
+        """
+        if self.rate is None:
+            return
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__last) * self.rate)
+                self.__last = now
+                if self.__tokens >= 1.0:
+                    self.__tokens -= 1.0
+                    return
+                wait = (1.0 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+def parse_constituents(content, now=None):
+    """
+    在内存中解析中证指数公司的成份股列表(xls)，
+    返回与insert_symbols.obtain_hs300相同格式的DataFrame。
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    symbols = pd.read_excel(io.BytesIO(content), usecols=[0, 4, 5, 7],
+                            names=["last_updated_date", "ticker", "name", "exchange_id"])
+    symbols["instrument"] = "stock"
+    symbols["currency"] = "RMB"
+    symbols["created"] = now.strftime("%Y-%m-%d")
+
+    # change ticker datetype to str and pad with "0" to length of 6
+    symbols["ticker"] = symbols.ticker.astype("str", copy=True)
+    symbols["ticker"] = symbols.ticker.str.pad(6, side="left", fillchar="0")
+    return symbols
+
+
+def parse_daily_bars(content):
+    """
+    在内存中解析网易财经的日线数据(GBK编码的csv)，
+    返回按日期升序排列、列为BAR_COLUMNS的DataFrame。
+    停牌日的价格为0，这些行被删除。
+    """
+    df = pd.read_csv(io.BytesIO(content), encoding='gbk')
+    df = df.rename(columns=NETEASE_COLUMNS)
+    missing = [c for c in NETEASE_COLUMNS.values() if c not in df.columns]
+    if missing:
+        raise ValueError("Daily bars are missing columns {}".format(missing))
+    df = df[df['close'] > 0].copy()
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df['oi'] = 0
+    return df.sort_values('datetime')[BAR_COLUMNS].reset_index(drop=True)
+
+
+def write_csv(df, path):
+    """
+    把DataFrame写入csv文件，先写临时文件再改名，读取的一方不会读到不完整的文件。
+    """
+    directory = os.path.dirname(path) or '.'
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            df.to_csv(f, index=False)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class BulkDownloader(object):
+    """
+    BulkDownloader 并发地下载成份股列表和日线数据并写入数据目录。
+    """
+
+    def __init__(self, data_dir="datas/daily",
+                 master_path="datas/securities_master/symbol.csv",
+                 constituents_url=HS300_URL, bars_url=NETEASE_URL,
+                 max_workers=8, rate=10.0, retries=3, backoff=0.5, timeout=10.0,
+                 session=None):
+        """
+        Parameters:
+        data_dir - 日线数据的目录，每只股票一个<ticker>.csv文件。
+        master_path - 证券主数据(成份股列表)的文件。
+        constituents_url - 成份股列表的地址。
+        bars_url - 日线数据的地址模板，可以使用{ticker}, {exchange_id}, {code},
+            {start}, {end}(形如'%Y%m%d')。
+        max_workers - 并发下载的线程数，也是连接池的大小。
+        rate - 每秒最多的请求数，为None时不限速。
+        retries - 连接失败、超时或RETRY_STATUS状态码时的重试次数。
+        backoff - 第一次重试之前等待的秒数，之后每次加倍。
+        timeout - 每个请求的超时秒数。
+        session - requests.Session，默认创建一个新的会话。
+        """
+        self.data_dir = data_dir
+        self.master_path = master_path
+        self.constituents_url = constituents_url
+        self.bars_url = bars_url
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate, burst=max_workers)
+
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+    def fetch(self, url):
+        """
+        下载url的内容，失败时按指数退避重试。
+
+        Returns:
+        响应的bytes。
+        """
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            self.limiter.acquire()
+            try:
+                res = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+                continue
+            if res.status_code in RETRY_STATUS:
+                error = "HTTP {}".format(res.status_code)
+                continue
+            if res.status_code != 200:
+                raise DownloadError("{}: HTTP {}".format(url, res.status_code))
+            return res.content
+        raise DownloadError("{}: failed after {} attempts ({})".format(
+            url, self.retries + 1, error))
+
+    def fetch_constituents(self):
+        """
+        下载并解析成份股列表。
+        """
+        return parse_constituents(self.fetch(self.constituents_url))
+
+    def bars_url_for(self, ticker, exchange_id, start, end):
+        """
+        返回一只股票的日线数据地址。
+        """
+        return self.bars_url.format(ticker=ticker, exchange_id=exchange_id,
+                                    code=NETEASE_MARKETS.get(exchange_id, '') + ticker,
+                                    start=start.strftime("%Y%m%d"),
+                                    end=end.strftime("%Y%m%d"))
+
+    def fetch_bars(self, ticker, exchange_id, start, end):
+        """
+        下载并解析一只股票的日线数据。
+        """
+        return parse_daily_bars(self.fetch(self.bars_url_for(ticker, exchange_id, start, end)))
+
+    def download_bars(self, symbols, start_date, end_date):
+        """
+        并发地下载多只股票的日线数据，每下载完一只就写入data_dir。
+
+        Parameters:
+        symbols - 包含ticker和exchange_id列的DataFrame(如成份股列表)，
+            或(ticker, exchange_id)的列表。
+        start_date, end_date - 日期区间，形如'%Y-%m-%d'的字符串或datetime。
+
+        Returns:
+        dict - written(写入的股票和行数), failed(下载失败的股票和原因)
+        """
+        if isinstance(symbols, pd.DataFrame):
+            symbols = list(zip(symbols['ticker'], symbols['exchange_id']))
+        start = pd.Timestamp(start_date)
+        end = pd.Timestamp(end_date)
+
+        written, failed = {}, {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = dict((pool.submit(self.fetch_bars, ticker, exchange_id, start, end), ticker)
+                           for ticker, exchange_id in symbols)
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    bars = future.result()
+                except (DownloadError, ValueError) as e:
+                    failed[ticker] = str(e)
+                    continue
+                write_csv(bars, os.path.join(self.data_dir, "{}.csv".format(ticker)))
+                written[ticker] = len(bars)
+        return {'written': written, 'failed': failed}
+
+    def run(self, start_date, end_date):
+        """
+        下载成份股列表并写入master_path，然后下载所有成份股的日线数据。
+        """
+        symbols = self.fetch_constituents()
+        # 与insert_symbols.store_hs300_symbols的格式相同
+        directory = os.path.dirname(self.master_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        symbols.to_csv(self.master_path, encoding="utf-8")
+        report = self.download_bars(symbols, start_date, end_date)
+        report['symbols'] = len(symbols)
+        return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python downloader.py START_DATE END_DATE")
+        sys.exit(1)
+    report = BulkDownloader().run(sys.argv[1], sys.argv[2])
+    print("{} symbols, {} downloaded, {} failed.".format(
+        report['symbols'], len(report['written']), len(report['failed'])))
+    for ticker, reason in sorted(report['failed'].items()):
+        print("  {}: {}".format(ticker, reason))
@@ -6,6 +6,10 @@ author: lvbj
 date: 201-1-5
 """
 
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+
 
 class Event(object):
     """
@@ -35,20 +39,23 @@ class SignalEvent(Event):
     This is received by a Portfolio object and acted upon.
     """
     
-    def __init__(self, symbol, datetime, signal_type):
+    def __init__(self, symbol, datetime, signal_type, strength=1.0):
         """
         Initialises the SignalEvent.
 
         Parameters:
         symbol - The ticker symbol, e.g. 'GOOG'.
         datetime - The timestamp at which the signal was generated.
-        signal_type - 'LONG' or 'SHORT'.
+        signal_type - 'LONG', 'SHORT' or 'EXIT'.
+        strength - A non-negative scaling factor of the signal, used by
+            the portfolio for position sizing.
         """
         
         self.kind = 'SIGNAL'
         self.symbol = symbol
         self.datetime = datetime
         self.signal_type = signal_type
+        self.strength = strength
 
 
 class OrderEvent(Event):
@@ -86,6 +93,41 @@ class OrderEvent(Event):
             self.symbol, self.order_type, self.quantity, self.direction)
 
 
+class BasketOrderEvent(Event):
+    """
+    Handles the event of sending the orders of a rebalance of many
+    symbols at once. The legs are kept as arrays so that an execution
+    handler can price and fill all of them in one vectorized call.
+    """
+
+    def __init__(self, symbols, order_type, quantities, sides):
+        """
+        Initialises the basket.
+
+        Parameters:
+        symbols - The instruments to trade, one per leg.
+        order_type - 'MKT' or 'LMT' for Market or Limit, for all legs.
+        quantities - Non-negative quantities of the legs.
+        sides - 1 (BUY) or -1 (SELL) for each leg.
+        """
+        self.kind = 'BASKET_ORDER'
+        self.symbols = list(symbols)
+        self.order_type = order_type
+        self.quantities = np.asarray(quantities, dtype='float64')
+        self.sides = np.asarray(sides, dtype='int8')
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def orders(self):
+        """
+        Splits the basket into one OrderEvent per leg.
+        """
+        return [OrderEvent(s, self.order_type, q, 'BUY' if side > 0 else 'SELL')
+                for s, q, side in zip(self.symbols, self.quantities.tolist(),
+                                      self.sides.tolist())]
+
+
 class FillEvent(Event):
     """
     Encapsulates the notion of a Filled Order, as returned
@@ -145,4 +187,60 @@ class FillEvent(Event):
         else: # Greater than 500
             full_cost = max(1.3, 0.008 * self.quantity)
         full_cost = min(full_cost, 0.5 / 100.0 * self.quantity * self.fill_cost)
-        return full_cost
\ No newline at end of file
+        return full_cost
+
+
+def ib_commission(quantity, fill_cost):
+    """
+    Vectorized version of FillEvent.calculate_ib_commission for arrays
+    of quantities and fill costs.
+    """
+    quantity = np.asarray(quantity, dtype='float64')
+    full_cost = np.where(quantity <= 500, 0.013 * quantity, 0.008 * quantity)
+    full_cost = np.maximum(1.3, full_cost)
+    return np.minimum(full_cost, 0.5 / 100.0 * quantity * np.asarray(fill_cost))
+
+
+class BasketFillEvent(Event):
+    """
+    Encapsulates the fills of all legs of a BasketOrderEvent, so that
+    the portfolio can apply them in bulk.
+    """
+
+    def __init__(self, timeindex, exchange, symbols, quantities, sides,
+                 fill_costs, commissions=None):
+        """
+        Parameters:
+        timeindex - The bar-resolution when the basket was filled.
+        exchange - The exchange where the basket was filled.
+        symbols - The instruments which were filled, one per leg.
+        quantities - The filled quantities.
+        sides - 1 (BUY) or -1 (SELL) for each leg.
+        fill_costs - The fill prices of the legs.
+        commissions - The commissions of the legs, calculated with
+            ib_commission if not provided.
+        """
+        self.kind = 'BASKET_FILL'
+        self.timeindex = timeindex
+        self.exchange = exchange
+        self.symbols = list(symbols)
+        self.quantities = np.asarray(quantities, dtype='float64')
+        self.sides = np.asarray(sides, dtype='int8')
+        self.fill_costs = np.asarray(fill_costs, dtype='float64')
+        if commissions is None:
+            self.commissions = ib_commission(self.quantities, self.fill_costs)
+        else:
+            self.commissions = np.asarray(commissions, dtype='float64')
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def fills(self):
+        """
+        Splits the basket fill into one FillEvent per leg.
+        """
+        return [FillEvent(self.timeindex, s, self.exchange, q,
+                          'BUY' if side > 0 else 'SELL', cost, commission)
+                for s, q, side, cost, commission in zip(
+                    self.symbols, self.quantities.tolist(), self.sides.tolist(),
+                    self.fill_costs.tolist(), self.commissions.tolist())]
@@ -14,7 +14,7 @@ import datetime
 
 from abc import ABCMeta, abstractmethod
 
-from event import FillEvent, OrderEvent
+from event import BasketFillEvent, FillEvent, OrderEvent
 
 
 class ExecutionHandler(object):
@@ -43,6 +43,19 @@ class ExecutionHandler(object):
         """
         raise NotImplementedError("Should implement execute_order()")
 
+    def execute_basket(self, event):
+        """
+        Takes a BasketOrder event and executes it. By default every leg
+        is executed on its own with execute_order, handlers that can
+        fill a whole basket at once should override it.
+
+        Parameters:
+        event - Contains an Event object with the basket information.
+        """
+        if event.kind == 'BASKET_ORDER':
+            for order in event.orders():
+                self.execute_order(order)
+
 
 class SimulatedExecutionHandler(ExecutionHandler):
     """
@@ -80,3 +93,22 @@ class SimulatedExecutionHandler(ExecutionHandler):
             fill_event = FillEvent(datetime.datetime.utcnow(), event.symbol,
                                    'ARCA', event.quantity, event.direction, fill_cost)
             self.backtester.send_event(fill_event)
+
+    def execute_basket(self, event):
+        """
+        Fills every leg of a BasketOrder at the latest close prices in
+        one vectorized call and sends a single BasketFillEvent.
+
+        Parameters:
+        event - Contains an Event object with the basket information.
+        """
+        if event.kind == 'BASKET_ORDER' and len(event) > 0:
+            bars = self.backtester.bars
+            if hasattr(bars, 'panel'):
+                columns = [bars.symbol_index[s] for s in event.symbols]
+                fill_costs = bars.panel['close'][bars.cursor - 1, columns]
+            else:
+                fill_costs = [bars.get_latest_bars(s)[0].close for s in event.symbols]
+            fill_event = BasketFillEvent(datetime.datetime.utcnow(), 'ARCA', event.symbols,
+                                         event.quantities, event.sides, fill_costs)
+            self.backtester.send_event(fill_event)
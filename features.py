@@ -0,0 +1,225 @@
+#encoding=utf-8
+
+"""
+预先计算的特征(指标、因子)的存储。
+特征在对齐的bar矩阵(bar数 x 标的数)上一次性向量化地计算，按标的保存到磁盘，
+键由标的、特征的定义(函数及其调用的模块级函数的源代码)、参数和该标的数据的指纹计算。
+之后的回测和参数扫描直接读取保存的特征，数据或特征的定义改变时自动重新计算。
+
+特征函数必须是因果的：第t行只能使用第t个及之前的bar，
+数据组件只返回游标之前的行，所以策略读取的特征不会包含未来的信息。
+
+使用:
+    store = FeatureStore("datas/features")
+    store.attach(bars, 'sma20', 'sma', window=20)
+    # 策略中:
+    self.bars.get_latest_feature('okcoinUSD', 'sma20', N=5)
+    self.bars.get_latest_panel(N=5, fields=['close', 'sma20'])
+
+自定义特征:
+    @register_feature('range')
+    def bar_range(panel):
+        return panel['high'] - panel['low']
+
+author: lvbj
+date: 2019-3-27
+"""
+
+import hashlib
+import inspect
+import os, os.path
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+# 特征名 -> 特征函数，函数以panel(dict, 字段 -> 矩阵)和参数为参数，返回同样形状的矩阵
+FEATURES = {}
+
+
+def register_feature(name):
+    """
+    注册特征函数的装饰器。
+    """
+    def decorator(func):
+        FEATURES[name] = func
+        return func
+    return decorator
+
+
+@register_feature('returns')
+def returns(panel, periods=1, field='close'):
+    """
+    periods个bar的收益率。
+    """
+    x = panel[field]
+    out = np.full(x.shape, np.nan)
+    out[periods:] = x[periods:] / x[:-periods] - 1.0
+    return out
+
+
+@register_feature('sma')
+def sma(panel, window, field='close'):
+    """
+    简单移动平均。
+    """
+    return pd.DataFrame(panel[field]).rolling(window).mean().values
+
+
+@register_feature('ema')
+def ema(panel, span, field='close'):
+    """
+    指数移动平均。
+    """
+    return pd.DataFrame(panel[field]).ewm(span=span, adjust=False).mean().values
+
+
+@register_feature('volatility')
+def volatility(panel, window, field='close'):
+    """
+    window个bar的收益率的标准差。
+    """
+    r = pd.DataFrame(returns(panel, 1, field))
+    return r.rolling(window).std().values
+
+
+@register_feature('zscore')
+def zscore(panel, window, field='close'):
+    """
+    价格相对于window个bar的均值的标准分数。
+    """
+    x = pd.DataFrame(panel[field])
+    rolling = x.rolling(window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((x - rolling.mean()) / rolling.std()).values
+
+
+def _referenced_functions(func):
+    """
+    func的代码(包括其中的lambda和嵌套函数)按名字引用的模块级函数。
+    """
+    names = set()
+    codes = [func.__code__]
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(c for c in code.co_consts if inspect.iscode(c))
+    return [func.__globals__[n] for n in sorted(names)
+            if inspect.isfunction(func.__globals__.get(n))]
+
+
+def _definition_digest(func):
+    """
+    特征函数及其引用的模块级函数(递归地)源代码的sha1，
+    特征或它调用的函数(如volatility调用的returns)的定义改变时保存的特征失效。
+    """
+    h = hashlib.sha1()
+    seen = set()
+    funcs = [func]
+    while funcs:
+        f = funcs.pop()
+        if f in seen:
+            continue
+        seen.add(f)
+        try:
+            source = inspect.getsource(f)
+        except (IOError, OSError, TypeError):
+            source = "{}.{}".format(f.__module__, f.__qualname__)
+        h.update(source.encode('utf-8'))
+        funcs.extend(_referenced_functions(f))
+    return h.hexdigest()
+
+
+def symbol_fingerprint(bars, j):
+    """
+    数据组件中第j个标的的数据(时间和各个字段)的指纹。
+    """
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(bars.times[:, j]).tobytes())
+    for field in bars.PANEL_FIELDS:
+        h.update(field.encode('utf-8'))
+        h.update(np.ascontiguousarray(bars.panel[field][:, j]).tobytes())
+    return h.hexdigest()
+
+
+class FeatureStore(object):
+    """
+    FeatureStore 计算、保存并读取与bar对齐的特征，每个标的的每个特征一个.npy文件。
+    """
+
+    def __init__(self, root="datas/features"):
+        """
+        Parameter:
+        root - 特征文件的目录。
+        """
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, symbol, name, params, fingerprint):
+        """
+        由标的、特征定义、参数和数据指纹计算的键。
+        """
+        if name not in FEATURES:
+            raise KeyError("Unknown feature: {}".format(name))
+        items = (symbol, name, _definition_digest(FEATURES[name]),
+                 sorted(params.items()), fingerprint)
+        return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+    def _path(self, name, key):
+        return os.path.join(self.root, name, "{}.npy".format(key))
+
+    def _save(self, path, values):
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, values)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def compute(self, bars, name, **params):
+        """
+        返回数据组件所有标的的特征矩阵(bar数, 标的数)。
+        已保存的标的直接读取，其余的标的在一次向量化的计算中算出并保存。
+        """
+        n_bars, n = bars.times.shape
+        values = np.empty((n_bars, n))
+        keys = [self.key(s, name, params, symbol_fingerprint(bars, j))
+                for j, s in enumerate(bars.symbol_list)]
+
+        missing = []
+        for j, key in enumerate(keys):
+            path = self._path(name, key)
+            if os.path.exists(path):
+                values[:, j] = np.load(path)
+                self.hits += 1
+            else:
+                missing.append(j)
+
+        if missing:
+            self.misses += len(missing)
+            panel = dict((f, bars.panel[f][:, missing]) for f in bars.PANEL_FIELDS)
+            computed = np.asarray(FEATURES[name](panel, **params), dtype='float64')
+            if computed.shape != (n_bars, len(missing)):
+                raise ValueError("Feature {} returned shape {}, expected {}".format(
+                    name, computed.shape, (n_bars, len(missing))))
+            for k, j in enumerate(missing):
+                values[:, j] = computed[:, k]
+                self._save(self._path(name, keys[j]), np.ascontiguousarray(computed[:, k]))
+        return values
+
+    def attach(self, bars, column, name, **params):
+        """
+        计算(或读取)特征，并以column为名注册到数据组件上，
+        之后可以通过get_latest_feature和get_latest_panel读取。
+        """
+        values = self.compute(bars, name, **params)
+        bars.add_feature(column, values)
+        return values
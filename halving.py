@@ -0,0 +1,174 @@
+#encoding=utf-8
+
+"""
+逐次减半(successive halving)的参数优化。
+网格搜索的大部分计算花在前几个月就已经明显落后的参数上。SuccessiveHalvingOptimizer
+先让所有候选参数在bar历史的一小段前缀上回测，只保留得分最高的1/eta，
+再让留下的参数在更长的前缀上继续回测，直到剩下的参数跑完全部历史。
+
+每个候选参数有自己的Backtester，进入下一阶段时从上一阶段停下的bar继续(Backtester.run_until)，
+而不是从头开始，所以留到最后的参数总共只回测一遍全部历史。
+
+使用:
+    opt = SuccessiveHalvingOptimizer(symbol_data, MomentumRankStrategy,
+                                     {'lookback': [10, 20, 40, 80], 'top': [0.1, 0.2]})
+    best_params = opt.run()
+    print(opt.history)
+
+author: lvbj
+date: 2019-4-5
+"""
+
+import math
+
+import pandas as pd
+
+from data import DataFrameDataHandler
+from execution import SimulatedExecutionHandler
+from main import Backtester
+from portfolio import NaivePortfolio, create_equity_curve
+from walkforward import expand_param_grid, total_return
+
+
+def halving_schedule(n_bars, n_candidates, eta=2, min_bars=None):
+    """
+    计算每个阶段结束时的bar数和进入该阶段的候选数。
+    最后一个阶段跑完全部n_bars，之前的每个阶段的bar数是下一阶段的1/eta。
+
+    Parameters:
+    n_bars - bar的总数。
+    n_candidates - 候选参数的数量。
+    eta - 每个阶段保留1/eta的候选参数。
+    min_bars - 第一个阶段的最少bar数，阶段数因此可能减少。
+
+    Returns:
+    list of (bars, candidates)
+    """
+    if eta < 2:
+        raise ValueError("eta should be at least 2")
+    n_stages = 1
+    if n_candidates > 1:
+        n_stages = int(math.ceil(math.log(n_candidates, eta) - 1e-9)) + 1
+    if min_bars is not None:
+        while n_stages > 1 and n_bars // eta ** (n_stages - 1) < min_bars:
+            n_stages -= 1
+
+    schedule = []
+    candidates = n_candidates
+    for k in range(n_stages):
+        bars = n_bars if k == n_stages - 1 else max(n_bars // eta ** (n_stages - 1 - k), 1)
+        schedule.append((bars, candidates))
+        candidates = max(int(math.ceil(candidates / float(eta))), 1)
+    return schedule
+
+
+class SuccessiveHalvingOptimizer(object):
+    """
+    SuccessiveHalvingOptimizer 在一份已载入内存的bar数据上逐次减半地搜索参数，
+    留下的候选参数从上一阶段停下的地方继续回测。
+    """
+
+    def __init__(self, symbol_data, strategy_cls, param_grid, eta=2, min_bars=None,
+                 objective=total_return, initial_capital=1000000.0,
+                 portfolio_cls=NaivePortfolio, portfolio_kwargs=None):
+        """
+        Parameters:
+        symbol_data - dict, symbol -> 已对齐的bar数据DataFrame,
+            如CoinDataHandler.load_symbol_data()的返回值。
+        strategy_cls - 策略类，以strategy_cls(bars, backtester, **params)的方式构造。
+        param_grid - dict, 参数名 -> 候选值列表。
+        eta - 每个阶段保留1/eta的候选参数，下一阶段的bar数是上一阶段的eta倍。
+        min_bars - 第一个阶段的最少bar数，应该足够让策略的指标完成预热。
+        objective - 以(到目前为止的)资金曲线DataFrame为参数、返回得分的函数，得分越高越好。
+        initial_capital - 初始资金。
+        portfolio_cls - portfolio类，以portfolio_cls(bars, backtester, start,
+            capital, **portfolio_kwargs)的方式构造。
+            每个阶段的得分由portfolio的all_holdings计算，所以portfolio_kwargs中不能有result_sink。
+        """
+        if (portfolio_kwargs or {}).get('result_sink') is not None:
+            raise ValueError("SuccessiveHalvingOptimizer scores the candidates from "
+                             "all_holdings, result_sink is not supported")
+        self.symbol_data = symbol_data
+        self.symbol_list = list(symbol_data.keys())
+        self.strategy_cls = strategy_cls
+        self.param_sets = expand_param_grid(param_grid)
+        self.eta = eta
+        self.objective = objective
+        self.initial_capital = initial_capital
+        self.portfolio_cls = portfolio_cls
+        self.portfolio_kwargs = portfolio_kwargs or {}
+
+        self.n_bars = len(symbol_data[self.symbol_list[0]])
+        self.schedule = halving_schedule(self.n_bars, len(self.param_sets), eta, min_bars)
+        self.start_date = symbol_data[self.symbol_list[0]]['datetime'].iloc[0]
+
+        self.history = None
+        self.best_params = None
+        self.best_score = None
+        self.bars_processed = 0
+
+    def _backtester(self, params):
+        """
+        为一组参数创建Backtester。
+        """
+        return Backtester(
+            bars=lambda bt: DataFrameDataHandler(bt, self.symbol_data),
+            strategy=lambda bt: self.strategy_cls(bt.bars, bt, **params),
+            port=lambda bt: self.portfolio_cls(bt.bars, bt, self.start_date,
+                                               self.initial_capital, **self.portfolio_kwargs),
+            broker=lambda bt: SimulatedExecutionHandler(bt))
+
+    def _score(self, tester):
+        """
+        到目前为止的资金曲线的得分，不改变回测的状态。
+        """
+        curve = create_equity_curve(pd.DataFrame(tester.port.all_holdings))
+        return self.objective(curve)
+
+    def run(self):
+        """
+        运行所有阶段，返回得分最高的参数。
+        每个阶段每个候选参数的得分记录在history中。
+        """
+        alive = list(range(len(self.param_sets)))
+        testers = {}
+        rows = []
+        self.bars_processed = 0
+
+        for stage, (stop, _) in enumerate(self.schedule):
+            scores = {}
+            for i in alive:
+                if i not in testers:
+                    testers[i] = self._backtester(self.param_sets[i])
+                tester = testers[i]
+                before = tester.bars.cursor
+                tester.run_until(stop)
+                self.bars_processed += tester.bars.cursor - before
+                scores[i] = self._score(tester)
+                rows.append(dict(self.param_sets[i], stage=stage, bars=stop, score=scores[i]))
+
+            # 得分相同时保留先出现的参数，与网格搜索的选择一致，得分为NaN的排在最后
+            ranked = sorted(alive, key=lambda i: (-scores[i] if scores[i] == scores[i]
+                                                  else float('inf'), i))
+            if stage + 1 < len(self.schedule):
+                keep = self.schedule[stage + 1][1]
+                survivors = set(ranked[:keep])
+                for i in alive:
+                    if i not in survivors:
+                        del testers[i]
+                alive = [i for i in alive if i in survivors]
+            else:
+                alive = ranked[:1]
+
+        best = alive[0]
+        self.best_params = self.param_sets[best]
+        self.best_score = scores[best]
+        self.history = pd.DataFrame(rows)
+        return self.best_params
+
+    @property
+    def compute_fraction(self):
+        """
+        处理的bar数占完整网格搜索(每组参数跑完全部历史)的比例。
+        """
+        return self.bars_processed / float(self.n_bars * len(self.param_sets))
@@ -0,0 +1,73 @@
+#encoding=utf-8
+
+"""
+模块导入时间的基准测试。
+每个模块在新的Python进程中导入若干次，取导入时间的中位数，
+并记录导入之后numpy, pandas和requests是否被加载。
+
+使用:
+    python importbench.py                 # 核心模块
+    python importbench.py main worker -n 10
+
+author: lvbj
+date: 2019-4-3
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+CORE_MODULES = ['event', 'bar', 'execution', 'strategy', 'portfolio', 'data', 'main', 'worker']
+
+HEAVY_MODULES = ['numpy', 'pandas', 'requests']
+
+_SCRIPT = """
+import sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(repr((elapsed, [m for m in {heavy!r} if m in sys.modules])))
+"""
+
+
+def measure(module, repeat=5, python=sys.executable):
+    """
+    在新的进程中导入module repeat次。
+
+    Returns:
+    (导入时间的中位数(秒), 导入之后已加载的重量级模块的列表)
+    """
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [python, '-c', _SCRIPT.format(module=module, heavy=HEAVY_MODULES)])
+        elapsed, loaded = eval(out.decode().strip().splitlines()[-1])
+        times.append(elapsed)
+    return statistics.median(times), loaded
+
+
+def run(modules, repeat=5):
+    """
+    测量各个模块的导入时间，以及直接导入numpy和pandas的时间作为对照。
+    """
+    rows = []
+    for module in list(modules) + ['numpy', 'pandas']:
+        elapsed, loaded = measure(module, repeat)
+        rows.append((module, elapsed, loaded))
+    width = max(len(r[0]) for r in rows)
+    print("{:<{w}}  {:>10}  {}".format("module", "import ms", "heavy modules loaded", w=width))
+    for module, elapsed, loaded in rows:
+        print("{:<{w}}  {:>10.1f}  {}".format(module, elapsed * 1000.0,
+                                               ", ".join(loaded) or "-", w=width))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure cold import times.")
+    parser.add_argument('modules', nargs='*', default=CORE_MODULES)
+    parser.add_argument('-n', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.modules, args.repeat)
@@ -0,0 +1,68 @@
+#encoding=utf-8
+
+"""
+重量级依赖(numpy, pandas)的延迟导入。
+核心模块(event, execution, data, portfolio, strategy等)以
+
+    np = lazy_import('numpy')
+    pd = lazy_import('pandas')
+
+代替import numpy as np，模块被导入时不加载numpy和pandas，第一次使用np.xxx时才真正导入。
+只使用事件和执行组件的实盘进程、worker进程因此可以很快地启动。
+
+第一次访问之后，真正模块的属性被复制到代理对象上，之后的访问与普通模块相同，没有额外的开销。
+
+importbench.py 比较各个模块的导入时间。
+
+author: lvbj
+date: 2019-4-3
+"""
+
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    LazyModule 是模块的代理，第一次访问属性时导入真正的模块。
+    """
+
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_lazy_loaded'] = False
+
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        self.__dict__['_lazy_loaded'] = True
+        return module
+
+    def __getattr__(self, attr):
+        # 只有代理对象上没有的属性才会调用__getattr__
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self.__dict__['_lazy_loaded'] or self.__name__ in sys.modules:
+            return repr(sys.modules[self.__name__])
+        return "<lazy module '{}'>".format(self.__name__)
+
+
+def lazy_import(name):
+    """
+    返回模块name，已经导入的模块直接返回，否则返回第一次使用时才导入的LazyModule。
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def is_loaded(name):
+    """
+    模块name是否已经真正导入。
+    """
+    return name in sys.modules
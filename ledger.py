@@ -0,0 +1,267 @@
+#encoding=utf-8
+
+"""
+成交记录(fill ledger)和逐笔交易(round trip)分析。
+
+FillLedger 以numpy数组追加保存每一笔成交的标的编号、市场时间、方向、数量、价格和手续费。
+round_trips()按先进先出(FIFO)的方式把开仓和平仓的成交配对成逐笔交易，
+trade_stats()给出胜率、平均持仓时间、盈亏比和各标的的盈亏。
+配对和统计都是向量化的计算，百万笔成交也只需要不到一秒。
+
+author: lvbj
+date: 2019-2-25
+"""
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+
+
+class FillLedger(object):
+    """
+    FillLedger 是只追加的成交记录，数据保存在按需倍增容量的numpy数组中。
+    时间以int64的epoch纳秒保存，方向以+1(BUY)、-1(SELL)保存。
+    """
+
+    FIELDS = [('symbol_id', 'int32'), ('time', 'int64'), ('side', 'int8'),
+              ('quantity', 'float64'), ('price', 'float64'), ('commission', 'float64')]
+
+    def __init__(self, symbol_list, capacity=1024):
+        """
+        Parameters:
+        symbol_list - 标的代码列表，symbol_id是标的在列表中的下标。
+        capacity - 初始容量。
+        """
+        self.symbol_list = list(symbol_list)
+        self.symbol_ids = dict((s, i) for i, s in enumerate(self.symbol_list))
+        self.size = 0
+        # 以0初始化，新建的记录的内容是确定的(ResultCache以组件的属性计算缓存键)
+        self.__data = dict((name, np.zeros(capacity, dtype=dtype))
+                           for name, dtype in self.FIELDS)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        """
+        按容量计算的内存占用(字节)。
+        """
+        return sum(arr.nbytes for arr in self.__data.values())
+
+    def __getattr__(self, name):
+        data = self.__dict__.get('_FillLedger__data')
+        if data is not None and name in data:
+            return data[name][:self.size]
+        raise AttributeError(name)
+
+    def _reserve(self, n):
+        """
+        保证至少还有n条记录的空间。
+        """
+        capacity = len(self.__data['time'])
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        for name, arr in self.__data.items():
+            grown = np.empty(capacity, dtype=arr.dtype)
+            grown[:self.size] = arr[:self.size]
+            self.__data[name] = grown
+
+    def append(self, symbol_id, time, side, quantity, price, commission):
+        """
+        追加一笔成交。
+
+        Parameters:
+        symbol_id - 标的编号。
+        time - epoch纳秒表示的市场时间。
+        side - 1为买入，-1为卖出。
+        quantity - 成交数量(非负)。
+        price - 成交价格。
+        commission - 手续费。
+        """
+        self._reserve(1)
+        i = self.size
+        self.__data['symbol_id'][i] = symbol_id
+        self.__data['time'][i] = time
+        self.__data['side'][i] = side
+        self.__data['quantity'][i] = quantity
+        self.__data['price'][i] = price
+        self.__data['commission'][i] = commission
+        self.size += 1
+
+    def extend(self, symbol_id, time, side, quantity, price, commission):
+        """
+        以数组的形式批量追加成交，参数含义同append。
+        """
+        symbol_id = np.asarray(symbol_id)
+        n = len(symbol_id)
+        self._reserve(n)
+        i = self.size
+        self.__data['symbol_id'][i:i+n] = symbol_id
+        self.__data['time'][i:i+n] = time
+        self.__data['side'][i:i+n] = side
+        self.__data['quantity'][i:i+n] = quantity
+        self.__data['price'][i:i+n] = price
+        self.__data['commission'][i:i+n] = commission
+        self.size += n
+
+    def append_fill(self, time, fill):
+        """
+        追加一个FillEvent。
+
+        Parameters:
+        time - 成交时的市场时间，epoch纳秒。
+        fill - FillEvent对象。
+        """
+        side = 1 if fill.direction == 'BUY' else -1
+        self.append(self.symbol_ids[fill.symbol], time,
+                    side, fill.quantity, fill.fill_cost, fill.commission)
+
+
+def _group_cumsum(values, groups):
+    """
+    对按groups排好序的values做分组累加。
+    """
+    cum = np.cumsum(values)
+    if len(values) == 0:
+        return cum
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    offsets = np.r_[0.0, cum[starts[1:] - 1]]
+    lengths = np.diff(np.r_[starts, len(values)])
+    return cum - np.repeat(offsets, lengths)
+
+
+def _empty_round_trips(ledger):
+    """
+    没有逐笔交易时round_trips的返回值。
+    """
+    return {'symbol_id': ledger.symbol_id[:0],
+            'side': np.empty(0, dtype='int8'),
+            'quantity': np.empty(0),
+            'entry_time': ledger.time[:0],
+            'exit_time': ledger.time[:0],
+            'entry_price': np.empty(0),
+            'exit_price': np.empty(0),
+            'pnl': np.empty(0)}
+
+
+def round_trips(ledger):
+    """
+    按标的以FIFO的方式把开仓成交和平仓成交配对成逐笔交易。
+    持仓由多翻空(或由空翻多)的成交被拆成平仓和开仓两部分。
+    未平仓的部分不计入结果。
+
+    Returns:
+    dict of arrays: symbol_id, side(1多头/-1空头), quantity, entry_time, exit_time,
+    entry_price, exit_price, pnl(已扣除按数量分摊的开平仓手续费)。
+    """
+    n = len(ledger)
+    seq = np.arange(n)
+    order = np.lexsort((seq, ledger.symbol_id))
+    sym = ledger.symbol_id[order]
+    side = ledger.side[order].astype('float64')
+    qty = ledger.quantity[order]
+
+    # 每笔成交后的持仓
+    pos_after = _group_cumsum(side * qty, sym)
+    pos_before = pos_after - side * qty
+
+    crossing = np.sign(pos_before) * np.sign(pos_after) < 0
+    opening = ~crossing & (np.abs(pos_after) > np.abs(pos_before))
+    closing = ~crossing & ~opening
+
+    # 开仓部分: (成交下标, 头寸方向, 数量)
+    open_idx = np.r_[np.flatnonzero(opening), np.flatnonzero(crossing)]
+    open_side = np.r_[side[opening], np.sign(pos_after[crossing])]
+    open_qty = np.r_[qty[opening], np.abs(pos_after[crossing])]
+    # 平仓部分
+    close_idx = np.r_[np.flatnonzero(closing), np.flatnonzero(crossing)]
+    close_side = np.r_[np.sign(pos_before[closing]), np.sign(pos_before[crossing])]
+    close_qty = np.r_[qty[closing], np.abs(pos_before[crossing])]
+
+    # 按(标的, 头寸方向)分组，组内保持成交的先后顺序
+    o = np.lexsort((open_idx, open_side, sym[open_idx]))
+    open_idx, open_side, open_qty = open_idx[o], open_side[o], open_qty[o]
+    c = np.lexsort((close_idx, close_side, sym[close_idx]))
+    close_idx, close_side, close_qty = close_idx[c], close_side[c], close_qty[c]
+
+    # 把每组开仓数量排列在同一条数轴上，FIFO配对就是开仓区间和平仓区间求交
+    open_key = sym[open_idx] * 2 + (open_side > 0)
+    close_key = sym[close_idx] * 2 + (close_side > 0)
+    open_end = np.cumsum(open_qty)
+    open_start = open_end - open_qty
+    group_keys, group_first = np.unique(open_key, return_index=True)
+    base = open_start[group_first][np.searchsorted(group_keys, close_key)]
+    close_end = base + _group_cumsum(close_qty, close_key)
+    close_start = close_end - close_qty
+    if len(close_end) == 0:
+        # 只有开仓成交，没有完成的交易
+        return _empty_round_trips(ledger)
+
+    bounds = np.unique(np.r_[open_start, open_end, close_start, close_end])
+    lo, hi = bounds[:-1], bounds[1:]
+    mid = (lo + hi) / 2.0
+    ci = np.searchsorted(close_end, mid)
+    ci = np.minimum(ci, len(close_end) - 1)
+    inside = (close_start[ci] <= mid) & (mid < close_end[ci])
+    inside &= (hi - lo) > 1e-9
+    lo, hi, mid, ci = lo[inside], hi[inside], mid[inside], ci[inside]
+    oi = np.searchsorted(open_end, mid)
+
+    seg_qty = hi - lo
+    entry = order[open_idx[oi]]
+    exit_ = order[close_idx[ci]]
+    trade_side = open_side[oi]
+
+    entry_price = ledger.price[entry]
+    exit_price = ledger.price[exit_]
+    commission = (ledger.commission[entry] * seg_qty / ledger.quantity[entry] +
+                  ledger.commission[exit_] * seg_qty / ledger.quantity[exit_])
+    pnl = trade_side * (exit_price - entry_price) * seg_qty - commission
+
+    return {'symbol_id': ledger.symbol_id[entry],
+            'side': trade_side.astype('int8'),
+            'quantity': seg_qty,
+            'entry_time': ledger.time[entry],
+            'exit_time': ledger.time[exit_],
+            'entry_price': entry_price,
+            'exit_price': exit_price,
+            'pnl': pnl}
+
+
+def trade_stats(ledger):
+    """
+    逐笔交易的统计。
+
+    Returns:
+    dict - trades(交易笔数), win_rate(胜率), avg_holding_time(平均持仓时间, np.timedelta64),
+    profit_factor(总盈利/总亏损), pnl_by_symbol(dict, symbol -> 已实现盈亏)。
+    """
+    trips = round_trips(ledger)
+    pnl = trips['pnl']
+    n = len(pnl)
+
+    gross_profit = pnl[pnl > 0].sum()
+    gross_loss = -pnl[pnl < 0].sum()
+    if gross_loss > 0:
+        profit_factor = gross_profit / gross_loss
+    else:
+        profit_factor = np.inf if gross_profit > 0 else np.nan
+
+    if n > 0:
+        win_rate = float((pnl > 0).sum()) / n
+        holding = np.mean(trips['exit_time'] - trips['entry_time'])
+        avg_holding_time = np.timedelta64(int(holding), 'ns')
+    else:
+        win_rate = np.nan
+        avg_holding_time = np.timedelta64('NaT')
+
+    by_symbol = np.bincount(trips['symbol_id'], weights=pnl,
+                            minlength=len(ledger.symbol_list))
+    return {'trades': n,
+            'win_rate': win_rate,
+            'avg_holding_time': avg_holding_time,
+            'profit_factor': profit_factor,
+            'pnl_by_symbol': dict(zip(ledger.symbol_list, by_symbol))}
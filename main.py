@@ -8,33 +8,63 @@ date: 201-1-5
 
 from queue import Queue, Empty
 from threading import Thread
+import datetime
 import time
 
 from data import CoinDataHandler
 from strategy import  BuyAndHoldStrategy
 from portfolio import NaivePortfolio
 from execution import SimulatedExecutionHandler
+from progressbar import ProgressReporter
+from timeutil import to_epoch_ns
 
 
 class Backtester:
-    def __init__(self, bars=None, strategy=None, port=None, broker=None, start_date=None, end_date=None):
-
+    def __init__(self, bars=None, strategy=None, port=None, broker=None, start_date=None, end_date=None,
+                 result_cache=None, progress=None, memory_monitor=None, signal_journal=None):
+        """
+        Parameter:
+        bars, strategy, port, broker - 回测的各个组件，可以是对象，也可以是
+            接受Backtester为参数并返回该组件的可调用对象，
+            如 lambda bt: BuyAndHoldStrategy(bt.bars, bt)。
+        start_date, end_date - 形如'%Y-%m-%d'的字符串。
+        result_cache - resultcache.ResultCache, 输入相同的回测直接返回缓存的结果。
+        progress - progressbar.ProgressReporter, 按数据组件的游标报告回测进度，
+            为True时使用默认的ProgressReporter。
+        memory_monitor - memory.MemoryMonitor, 按bar的间隔采样各个子系统的内存并检查预算。
+        signal_journal - signaljournal.SignalJournal, 把策略发出的信号记录到信号日志中，
+            之后可以用JournalReplayStrategy回放。
+        """
         if bars is None:
             bars = CoinDataHandler(self, ['okcoinUSD'])
-            
+        elif callable(bars):
+            bars = bars(self)
+        self.bars = bars
+
         if strategy is None:
             strategy = BuyAndHoldStrategy(bars, self)
+        elif callable(strategy):
+            strategy = strategy(self)
 
         if port is None:
             port = NaivePortfolio(bars, self, '2017-1-1')
+        elif callable(port):
+            port = port(self)
  
         if broker is None:
             broker = SimulatedExecutionHandler(self)
+        elif callable(broker):
+            broker = broker(self)
 
-        self.bars = bars
         self.strategy = strategy
         self.port = port
         self.broker = broker
+        self.result_cache = result_cache
+        if progress is True:
+            progress = ProgressReporter()
+        self.progress = progress
+        self.memory_monitor = memory_monitor
+        self.signal_journal = signal_journal
 
         self.__event_queue = Queue()
         self.__thread = Thread(target=self.__run)
@@ -43,11 +73,17 @@ class Backtester:
             'MARKET': [self.__filte_market_event],
             'SIGNAL': [port.update_signal],
             'ORDER': [broker.execute_order],
-            'FILL': [port.update_fill]}
+            'FILL': [port.update_fill],
+            'BASKET_ORDER': [broker.execute_basket],
+            'BASKET_FILL': [port.update_basket_fill]}
+        if signal_journal is not None:
+            self.__handlers['SIGNAL'].insert(0, self.__journal_signal)
 
+        sd = None
+        ed = None
         if start_date is not None:
             try:
-                sd = datetime.datetime.strptime(start_date+" 00:00:00", "%Y-%m-%d %H:%M:%S")
+                sd = to_epoch_ns(datetime.datetime.strptime(start_date+" 00:00:00", "%Y-%m-%d %H:%M:%S"))
             except ValueError:
                 print("Parameter start_date can't be parsed by datetime.strptime,"
                       "start_date will equal to None.")
@@ -55,7 +91,7 @@ class Backtester:
 
         if end_date is not None:
             try:
-                ed = datetime.datetime.strptime(end_date+" 00:00:00", "%Y-%m-%d %H:%M:%S")
+                ed = to_epoch_ns(datetime.datetime.strptime(end_date+" 00:00:00", "%Y-%m-%d %H:%M:%S"))
             except ValueError:
                 print("Parameter end_date can't be parsed by datetime.strptime,"
                       "end_date will equal to None.")
@@ -65,6 +101,13 @@ class Backtester:
         self.__end_date = ed
 
 
+    def __journal_signal(self, event):
+        """
+        把SignalEvent和产生它的bar的游标记录到信号日志中。
+        """
+        self.signal_journal.record(self.bars.cursor, event)
+
+
     def __filte_market_event(self, event):
         """
         过滤MarketEvent，如果MarketEvent的日期在start_date至end_date之间.
@@ -72,31 +115,99 @@ class Backtester:
         否则，则什么也不做。
         """
         if event.kind == "MARKET":
-            if (self.__start_date is not None) and (self.__end_date is not None):
-                bar = self.bars.get_latest_bars(self.bars.symbol_list[0])[0]
-                if self.__start_date <= bar.dt <= self.__end_date:
-                    self.strategy.calculate_signals(event)
-                    self.port.update_timeindex(event)
+            bar = self.bars.get_latest_bars(self.bars.symbol_list[0])[0]
+            if self.__start_date is not None and bar.time < self.__start_date:
+                return
+            if self.__end_date is not None and bar.time > self.__end_date:
+                return
+            self.strategy.calculate_signals(event)
+            self.port.update_timeindex(event)
         
         
-    def __run(self):
+    def run(self):
         """
-        Backtester运行
+        在当前线程中同步运行回测，返回output_summary_stats的统计结果。
+        回测结束后可以通过port.equity_curve获取资金曲线。
+        使用result_cache且命中缓存时不运行回测，只设置port.equity_curve。
+        记录信号日志(signal_journal)时不使用缓存。
         """
-        # 处理事件队列中的事件，直到事件队列为空
+        key = None
+        # 记录信号日志时必须真正运行策略
+        if self.result_cache is not None and self.signal_journal is None:
+            key = self.result_cache.key(self.bars, [self.strategy, self.port, self.broker],
+                                        self.__start_date, self.__end_date)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                stats, self.port.equity_curve = cached
+                return stats
+
+        progress = self.progress
+        if progress is not None:
+            progress.start(getattr(self.bars, 'n_bars', None))
+        monitor = self.memory_monitor
+        if monitor is not None:
+            monitor.start(self)
+        if self.signal_journal is not None:
+            self.signal_journal.open(self.bars)
+        events = self.__process(None, progress, monitor)
+        if progress is not None:
+            progress.finish(getattr(self.bars, 'cursor', None), events)
+        if monitor is not None:
+            monitor.finish(getattr(self.bars, 'cursor', 0))
+        if self.signal_journal is not None:
+            self.signal_journal.close()
+        self.port.create_equity_curve_dataframe()
+        stats = self.port.output_summary_stats()
+        if key is not None:
+            self.result_cache.put(key, stats, self.port.equity_curve)
+        return stats
+
+
+    def __process(self, until, progress=None, monitor=None):
+        """
+        处理事件队列中的事件，队列为空时推送下一个bar，
+        直到没有更多的bar，或已推送until个bar且它们产生的事件都已处理。
+
+        Returns:
+        处理的事件数。
+        """
+        events = 0
         while True:
             try:
                 event = self.__event_queue.get(block=False)
+                events += 1
                 if event.kind in self.__handlers:
                     for handler in self.__handlers[event.kind]:
                         handler(event)
             except Empty:
-                if self.bars.continue_backtest:
+                if self.bars.continue_backtest and (until is None or self.bars.cursor < until):
                     self.bars.update_bars()
+                    if progress is not None:
+                        progress.update(getattr(self.bars, 'cursor', 0), events)
+                    if monitor is not None:
+                        monitor.update(getattr(self.bars, 'cursor', 0))
                 else:
                     break
-        self.port.create_equity_curve_dataframe()
-        stats = self.port.output_summary_stats()
+        return events
+
+
+    def run_until(self, cursor):
+        """
+        运行回测直到数据组件推送了cursor个bar，之后可以再次调用run_until继续，
+        或调用run运行到结束。回测的状态(持仓、策略的内部状态)保留在各个组件中。
+        数据组件必须有cursor属性，如DataFrameDataHandler。
+
+        Returns:
+        处理的事件数。
+        """
+        return self.__process(cursor)
+
+
+    def __run(self):
+        """
+        Backtester运行
+        """
+        stats = self.run()
         print(stats)
 
     def start(self):
@@ -114,6 +225,14 @@ class Backtester:
         self.__active = False
 
 
+    def pending_events(self):
+        """
+        返回事件队列中等待处理的事件的列表(快照)。
+        """
+        with self.__event_queue.mutex:
+            return list(self.__event_queue.queue)
+
+
     def send_event(self, event):
         """
         向Backtester加入需要进行处理的事件
@@ -125,7 +244,6 @@ class Backtester:
 
 
 if __name__ == '__main__':
-    import datetime
     time1 = datetime.datetime.now()
     tester = Backtester(start_date="2017-8-8", end_date="2018-8-27")
 
@@ -0,0 +1,267 @@
+#encoding=utf-8
+
+"""
+回测的内存统计。
+MemoryMonitor 每隔一定数量的bar估算各个子系统占用的内存:
+    latest_symbol_data - 数据组件已推送的Bar对象
+    dataframes         - 数据组件载入的DataFrame、numpy矩阵和特征
+    all_holdings       - portfolio的持仓和市值记录(all_positions和all_holdings)
+    fill_ledger        - portfolio的成交记录
+    event_queue        - 事件队列中等待处理的事件
+    rss                - 进程的常驻内存(RSS)
+记录每个子系统的峰值，并在子系统的内存超过(或按目前的增长速度预计会超过)预算时
+发出警告或抛出MemoryBudgetExceeded，在真正耗尽内存之前停止回测。
+
+使用:
+    monitor = MemoryMonitor(interval=1000, budgets={'rss': 2 * 2**30}, action='raise')
+    tester = Backtester(..., memory_monitor=monitor)
+    tester.run()
+    print(monitor.report())
+
+各个子系统的大小是用sys.getsizeof按样本估算的，只需要遍历很少的对象。
+
+author: lvbj
+date: 2019-3-20
+"""
+
+import os
+import sys
+import warnings
+
+import pandas as pd
+
+
+SUBSYSTEMS = ['latest_symbol_data', 'dataframes', 'all_holdings',
+              'fill_ledger', 'event_queue', 'rss']
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """
+    子系统的内存超过了预算，且MemoryMonitor的action为'raise'。
+    """
+    pass
+
+
+class MemoryBudgetWarning(RuntimeWarning):
+    """
+    子系统的内存超过了预算，且MemoryMonitor的action为'warn'。
+    """
+    pass
+
+
+def object_size(obj):
+    """
+    估算一个普通对象占用的内存: 对象本身、属性字典和各个属性值(字符串除外，
+    标的代码等字符串是共用的)。
+    """
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is None and isinstance(obj, dict):
+        attrs = obj
+    elif attrs is not None:
+        size += sys.getsizeof(attrs)
+    if attrs is not None:
+        for value in attrs.values():
+            if not isinstance(value, str):
+                size += sys.getsizeof(value)
+    return size
+
+
+def list_size(items):
+    """
+    估算由同类对象组成的list占用的内存，按最后一个元素的大小估算所有元素。
+    """
+    if len(items) == 0:
+        return sys.getsizeof(items)
+    return sys.getsizeof(items) + len(items) * object_size(items[-1])
+
+
+def process_rss():
+    """
+    返回进程当前的常驻内存(字节)。不支持/proc的系统返回进程的峰值常驻内存，
+    都不支持时返回None。
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class MemoryMonitor(object):
+    """
+    MemoryMonitor 按bar的间隔采样回测各个子系统的内存，记录峰值并检查预算。
+    """
+
+    def __init__(self, interval=1000, budgets=None, action='warn', project=True):
+        """
+        Parameters:
+        interval - 每推送多少个bar采样一次。
+        budgets - dict, 子系统 -> 预算(字节)，子系统见SUBSYSTEMS，
+            'total'为除rss以外的所有子系统之和。
+        action - 超过预算时的处理方式，'warn'发出MemoryBudgetWarning，
+            'raise'抛出MemoryBudgetExceeded。
+        project - 为True时按采样以来的增长速度预计回测结束时的内存，
+            预计会超过预算时提前处理。
+        """
+        if action not in ('warn', 'raise'):
+            raise ValueError("action should be 'warn' or 'raise'")
+        for name in (budgets or {}):
+            if name not in SUBSYSTEMS and name != 'total':
+                raise ValueError("Unknown subsystem: {}".format(name))
+        self.interval = max(int(interval), 1)
+        self.budgets = dict(budgets or {})
+        self.action = action
+        self.project = project
+
+        self.backtester = None
+        self.samples = []
+        self.peaks = {}
+        self.__first = None
+        self.__next_sample = 0
+        self.__warned = set()
+        self.__static = None
+
+    def start(self, backtester):
+        """
+        开始监视一次回测。
+        """
+        self.backtester = backtester
+        self.samples = []
+        self.peaks = {}
+        self.__first = None
+        self.__next_sample = 0
+        self.__warned = set()
+        self.__static = None
+
+    def _dataframe_size(self, bars):
+        """
+        载入的数据不会改变，只计算一次。
+        """
+        if self.__static is None:
+            size = 0
+            for df in getattr(bars, 'symbol_data', {}).values():
+                size += int(df.memory_usage(index=True, deep=True).sum())
+            for matrix in getattr(bars, 'panel', {}).values():
+                size += matrix.nbytes
+            for matrix in getattr(bars, 'features', {}).values():
+                size += matrix.nbytes
+            times = getattr(bars, 'times', None)
+            if times is not None:
+                size += times.nbytes
+            self.__static = size
+        return self.__static
+
+    def measure(self):
+        """
+        估算各个子系统当前占用的内存，返回dict, 子系统 -> 字节数。
+        """
+        bt = self.backtester
+        bars, port = bt.bars, bt.port
+        sizes = {}
+        sizes['latest_symbol_data'] = sum(
+            list_size(items) for items in getattr(bars, 'latest_symbol_data', {}).values())
+        sizes['dataframes'] = self._dataframe_size(bars)
+        sizes['all_holdings'] = (list_size(getattr(port, 'all_holdings', [])) +
+                                 list_size(getattr(port, 'all_positions', [])))
+        ledger = getattr(port, 'fill_ledger', None)
+        # 按容量计算，包括预留的空间
+        sizes['fill_ledger'] = ledger.nbytes if ledger is not None else 0
+        sizes['event_queue'] = list_size(bt.pending_events())
+        sizes['rss'] = process_rss()
+        return sizes
+
+    def update(self, cursor):
+        """
+        每推送一个bar调用一次，每interval个bar采样一次。
+
+        Parameters:
+        cursor - 已推送的bar数。
+        """
+        if cursor < self.__next_sample:
+            return
+        self.__next_sample = cursor + self.interval
+        self.sample(cursor)
+
+    def sample(self, cursor):
+        """
+        采样一次，更新峰值并检查预算。
+        """
+        sizes = self.measure()
+        sizes['total'] = sum(v for k, v in sizes.items() if k != 'rss' and v is not None)
+        sizes['cursor'] = cursor
+        self.samples.append(sizes)
+        if self.__first is None:
+            self.__first = sizes
+
+        for name, value in sizes.items():
+            if name == 'cursor' or value is None:
+                continue
+            if name not in self.peaks or value > self.peaks[name][0]:
+                self.peaks[name] = (value, cursor)
+
+        for name, budget in self.budgets.items():
+            value = sizes.get(name)
+            if value is None:
+                continue
+            if value > budget:
+                self._exceeded(name, value, budget, cursor, None)
+            elif self.project:
+                projected = self._projected(name, value, cursor)
+                if projected is not None and projected > budget:
+                    self._exceeded(name, value, budget, cursor, projected)
+
+    def _projected(self, name, value, cursor):
+        """
+        按第一次采样以来的平均增长速度，预计回测结束时子系统的内存。
+        """
+        n_bars = getattr(self.backtester.bars, 'n_bars', None)
+        first = self.__first
+        if n_bars is None or cursor <= first['cursor'] or first.get(name) is None:
+            return None
+        rate = float(value - first[name]) / (cursor - first['cursor'])
+        if rate <= 0:
+            return None
+        return value + rate * (n_bars - cursor)
+
+    def _exceeded(self, name, value, budget, cursor, projected):
+        if projected is None:
+            message = "{} uses {:.1f} MB at bar {}, over its budget of {:.1f} MB".format(
+                name, value / 2.0**20, cursor, budget / 2.0**20)
+        else:
+            message = ("{} uses {:.1f} MB at bar {} and is projected to reach {:.1f} MB, "
+                       "over its budget of {:.1f} MB").format(
+                name, value / 2.0**20, cursor, projected / 2.0**20, budget / 2.0**20)
+        if self.action == 'raise':
+            raise MemoryBudgetExceeded(message)
+        if name not in self.__warned:
+            self.__warned.add(name)
+            warnings.warn(message, MemoryBudgetWarning)
+
+    def finish(self, cursor):
+        """
+        回测结束时采样最后一次。
+        """
+        if len(self.samples) == 0 or self.samples[-1]['cursor'] != cursor:
+            self.sample(cursor)
+
+    def report(self):
+        """
+        返回各个子系统的最后一次采样、峰值和达到峰值时的bar，单位为字节。
+        """
+        rows = []
+        last = self.samples[-1] if self.samples else {}
+        for name in SUBSYSTEMS + ['total']:
+            if name not in self.peaks:
+                continue
+            peak, cursor = self.peaks[name]
+            rows.append({'subsystem': name, 'last': last.get(name), 'peak': peak,
+                         'peak_bar': cursor, 'budget': self.budgets.get(name)})
+        return pd.DataFrame(rows, columns=['subsystem', 'last', 'peak', 'peak_bar', 'budget'])
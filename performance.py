@@ -1,7 +1,9 @@
 # performance.py
 
-import numpy as np
-import pandas as pd
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 def create_sharpe_ratio(returns, periods=252):
@@ -29,18 +31,134 @@ def create_drawdowns(equity_curve):
     drawdown, duration - Highest peak-to-trough drawdown and duration.
     """
 
-    # Calculate the cumulative returns curve 
-    # and set up the High Water Mark
-    # Then create the drawdown and duration series
-    hwm = [0]
-    eq_idx = equity_curve.index
-    drawdown = pd.Series(index = eq_idx)
-    duration = pd.Series(index = eq_idx)
-
-    # Loop over the index range
-    for t in range(1, len(eq_idx)):
-        cur_hwm = max(hwm[t-1], equity_curve[t])
-        hwm.append(cur_hwm)
-        drawdown[t]= hwm[t] - equity_curve[t]
-        duration[t]= 0 if drawdown[t] == 0 else duration[t-1] + 1
-    return drawdown.max(), duration.max()
+    # The High Water Mark starts at 0 and the first bar is skipped,
+    # NaN values never raise it (np.fmax)
+    eq = np.asarray(equity_curve, dtype='float64')[1:]
+    hwm = np.fmax.accumulate(np.r_[0.0, eq])[1:]
+    drawdown = hwm - eq
+
+    # The duration counts the bars since the drawdown was last zero,
+    # it is undefined before the first zero drawdown
+    t = np.arange(len(eq))
+    last_zero = np.maximum.accumulate(np.where(drawdown == 0, t, -1))
+    duration = np.where(last_zero >= 0, t - last_zero, np.nan)
+    return pd.Series(drawdown).max(), pd.Series(duration).max()
+
+
+def align_benchmark(index, benchmark):
+    """
+    Aligns a benchmark price series to the index of an equity curve,
+    using the last benchmark price at or before each time.
+
+    Parameters:
+    index - The DatetimeIndex of the equity curve.
+    benchmark - A pandas Series of benchmark prices indexed by datetime.
+
+    Returns:
+    A pandas Series of benchmark returns on the given index.
+    """
+    benchmark = benchmark[~benchmark.index.duplicated(keep='last')].sort_index()
+    prices = benchmark.reindex(index, method='ffill')
+    return prices.pct_change()
+
+
+def rolling_sum(x, window):
+    """
+    The sums of every window of consecutive values of x, computed
+    from one cumulative sum in O(n). The first window-1 values are NaN.
+
+    Parameters:
+    x - A numpy array.
+    window - The number of values in each window.
+    """
+    cum = np.cumsum(np.r_[0.0, x])
+    out = np.full(len(x), np.nan)
+    if window <= len(x):
+        out[window-1:] = cum[window:] - cum[:-window]
+    return out
+
+
+def _benchmark_moments(r, b, window=None):
+    """
+    The means, variances and covariance of the strategy returns r and
+    the benchmark returns b, over all values or over rolling windows.
+    The variances and the covariance are sample estimates (ddof=1),
+    the same as pandas var(), cov() and std().
+    The returns are centred first, so the rolling sums keep their
+    precision on long series.
+    """
+    cr, cb = r.mean(), b.mean()
+    x, y = r - cr, b - cb
+    if window is None:
+        n = float(len(r))
+        sx, sy = x.sum(), y.sum()
+        sxx, syy, sxy = (x * x).sum(), (y * y).sum(), (x * y).sum()
+    else:
+        n = float(window)
+        sx, sy = rolling_sum(x, window), rolling_sum(y, window)
+        sxx, syy, sxy = rolling_sum(x * x, window), rolling_sum(y * y, window), rolling_sum(x * y, window)
+    mx, my = sx / n, sy / n
+    var_x = (sxx - n * mx * mx) / (n - 1.0)
+    var_y = (syy - n * my * my) / (n - 1.0)
+    cov = (sxy - n * mx * my) / (n - 1.0)
+    return mx + cr, my + cb, var_x, var_y, cov
+
+
+def _benchmark_ratios(mr, mb, var_r, var_b, cov, periods):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = cov / var_b
+        alpha = (mr - beta * mb) * periods
+        # Var(r - b) = Var(r) - 2Cov(r, b) + Var(b)
+        te = np.sqrt(np.maximum(var_r - 2.0 * cov + var_b, 0.0))
+        ir = np.sqrt(periods) * (mr - mb) / te
+    return alpha, beta, te * np.sqrt(periods), ir
+
+
+def create_benchmark_stats(returns, benchmark_returns, periods=252):
+    """
+    Alpha, beta, tracking error and information ratio of the strategy
+    relative to a benchmark. Alpha, tracking error and information
+    ratio are annualised. Periods where either return is missing are
+    ignored.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns.
+    benchmark_returns - The benchmark returns on the same index.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+
+    Returns:
+    alpha, beta, tracking_error, information_ratio
+    """
+    r = np.asarray(returns, dtype='float64')
+    b = np.asarray(benchmark_returns, dtype='float64')
+    valid = np.isfinite(r) & np.isfinite(b)
+    r, b = r[valid], b[valid]
+    if len(r) < 2:
+        return np.nan, np.nan, np.nan, np.nan
+    return tuple(float(v) for v in _benchmark_ratios(*_benchmark_moments(r, b) + (periods,)))
+
+
+def create_rolling_benchmark_stats(returns, benchmark_returns, window, periods=252):
+    """
+    Rolling alpha, beta, tracking error and information ratio over
+    windows of the given number of periods. All four are computed from
+    five rolling sums in O(n) regardless of the window, instead of one
+    regression per window. Missing returns count as zero.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns.
+    benchmark_returns - The benchmark returns on the same index.
+    window - The number of periods in each window.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+
+    Returns:
+    A pandas DataFrame with the columns alpha, beta, tracking_error and
+    information_ratio on the index of returns, NaN for the first window-1 rows.
+    """
+    r = np.nan_to_num(np.asarray(returns, dtype='float64'))
+    b = np.nan_to_num(np.asarray(benchmark_returns, dtype='float64'))
+    alpha, beta, te, ir = _benchmark_ratios(*_benchmark_moments(r, b, window) + (periods,))
+    return pd.DataFrame({'alpha': alpha, 'beta': beta, 'tracking_error': te,
+                         'information_ratio': ir},
+                        index=getattr(returns, 'index', None),
+                        columns=['alpha', 'beta', 'tracking_error', 'information_ratio'])
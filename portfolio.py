@@ -12,14 +12,79 @@ date: 2019-1-6
 """
 
 import datetime
-import numpy as np
-import pandas as pd
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 from abc import ABCMeta, abstractmethod
 from math import floor
 
-from event import FillEvent, OrderEvent
-from performance import create_sharpe_ratio, create_drawdowns
+from event import BasketOrderEvent, FillEvent, OrderEvent
+from ledger import FillLedger
+from performance import (create_sharpe_ratio, create_drawdowns, align_benchmark,
+                         create_benchmark_stats, create_rolling_benchmark_stats)
+from risk import EWCovariance, volatility_target_weights, min_variance_weights
+from timeutil import to_epoch_ns
+
+
+def create_equity_curve(holdings):
+    """
+    Creates the equity curve DataFrame from a DataFrame of holdings
+    records (one row per bar, with an epoch nanosecond 'datetime'
+    column and a 'total' column), adding the returns and the
+    equity curve.
+    """
+    curve = holdings
+    curve['datetime'] = curve['datetime'].values.astype('int64').view('datetime64[ns]')
+    curve.set_index('datetime', inplace=True)
+    curve['returns'] = curve['total'].pct_change()
+    curve['equity_curve'] = (1.0+curve['returns']).cumprod()
+    return curve
+
+
+def add_benchmark(equity_curve, benchmark):
+    """
+    Adds the benchmark returns aligned to the equity curve and the
+    benchmark's own equity curve as the columns 'benchmark_returns'
+    and 'benchmark_curve'.
+
+    Parameters:
+    equity_curve - The DataFrame from create_equity_curve.
+    benchmark - A pandas Series of benchmark prices indexed by datetime.
+    """
+    returns = align_benchmark(equity_curve.index, benchmark)
+    equity_curve['benchmark_returns'] = returns.values
+    equity_curve['benchmark_curve'] = (1.0+returns.fillna(0.0)).cumprod().values
+    return equity_curve
+
+
+def summary_stats(equity_curve):
+    """
+    Creates a list of summary statistics of an equity curve such
+    as Sharpe Ratio and drawdown information, and the benchmark
+    relative statistics if the curve has benchmark returns.
+    """
+    total_return = equity_curve['equity_curve'][-1]
+    returns = equity_curve['returns']
+    pnl = equity_curve['equity_curve']
+
+    sharpe_ratio = create_sharpe_ratio(returns)
+    max_dd, dd_duration = create_drawdowns(pnl)
+
+    stats = [("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
+             ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
+             ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
+             ("Drawdown Duration", "%d" % dd_duration)]
+
+    if 'benchmark_returns' in equity_curve:
+        alpha, beta, te, ir = create_benchmark_stats(returns, equity_curve['benchmark_returns'])
+        stats += [("Alpha", "%0.2f%%" % (alpha * 100.0)),
+                  ("Beta", "%0.2f" % beta),
+                  ("Tracking Error", "%0.2f%%" % (te * 100.0)),
+                  ("Information Ratio", "%0.2f" % ir)]
+    return stats
 
 
 class Portfolio(object):
@@ -47,6 +112,15 @@ class Portfolio(object):
         """
         raise NotImplementedError("Should implement update_fill()")
 
+    def update_basket_fill(self, event):
+        """
+        Updates the portfolio from a BasketFillEvent. By default every
+        leg is applied on its own with update_fill.
+        """
+        if event.kind == 'BASKET_FILL':
+            for fill in event.fills():
+                self.update_fill(fill)
+
 
 class NaivePortfolio(Portfolio):
     """
@@ -56,7 +130,8 @@ class NaivePortfolio(Portfolio):
     used to test simpler strategies such as BuyAndHoldStrategy.
     """
     
-    def __init__(self, bars, backtester, start_date, initial_capital=1000000.0):
+    def __init__(self, bars, backtester, start_date, initial_capital=1000000.0,
+                 result_sink=None):
         """
         Initialises the portfolio with bars and an backtester. 
         Also includes a starting datetime index and initial capital 
@@ -65,21 +140,33 @@ class NaivePortfolio(Portfolio):
         Parameters:
         bars - The DataHandler object with current market data.
         backtester - The Backtester object.
-        start_date - The start date (bar) of the portfolio.
+        start_date - The start date (bar) of the portfolio, a string,
+            datetime or epoch nanoseconds.
         initial_capital - The starting capital in USD.
+        result_sink - An optional resultsink.ResultSink. If given, the
+            positions, holdings and fills are streamed to disk instead
+            of being kept in all_positions and all_holdings.
         """
         self.bars = bars
         self.backtester = backtester
         self.symbol_list = self.bars.symbol_list
         self.start_date = start_date
+        self.start_time = to_epoch_ns(start_date)
         self.initial_capital = initial_capital
+        self.result_sink = result_sink
         
-        self.all_positions = self.construct_all_positions()
+        self.all_positions = []
         self.current_positions = dict( (k,v) for k, v in [(s, 0) for s in self.symbol_list] )
 
-        self.all_holdings = self.construct_all_holdings()
+        self.all_holdings = []
         self.current_holdings = self.construct_current_holdings()
 
+        # Every fill is kept for trade-level analysis, see ledger.trade_stats
+        self.fill_ledger = FillLedger(self.symbol_list)
+
+        self.store_record(self.construct_all_positions()[0],
+                          self.construct_all_holdings()[0])
+
 
     def construct_all_positions(self):
         """
@@ -87,7 +174,7 @@ class NaivePortfolio(Portfolio):
         to determine when the time index will begin.
         """
         d = dict( (k,v) for k, v in [(s, 0) for s in self.symbol_list] )
-        d['datetime'] = self.start_date
+        d['datetime'] = self.start_time
         return [d]
 
 
@@ -97,7 +184,7 @@ class NaivePortfolio(Portfolio):
         to determine when the time index will begin.
         """
         d = dict( (k,v) for k, v in [(s, 0.0) for s in self.symbol_list] )
-        d['datetime'] = self.start_date
+        d['datetime'] = self.start_time
         d['cash'] = self.initial_capital
         d['commission'] = 0.0
         d['total'] = self.initial_capital
@@ -130,17 +217,14 @@ class NaivePortfolio(Portfolio):
 
         # Update positions
         dp = dict( (k,v) for k, v in [(s, 0) for s in self.symbol_list] )
-        dp['datetime'] = bars[self.symbol_list[0]][0].dt
+        dp['datetime'] = bars[self.symbol_list[0]][0].time
 
         for s in self.symbol_list:
             dp[s] = self.current_positions[s]
 
-        # Append the current positions
-        self.all_positions.append(dp)
-
         # Update holdings
         dh = dict( (k,v) for k, v in [(s, 0) for s in self.symbol_list] )
-        dh['datetime'] = bars[self.symbol_list[0]][0].dt
+        dh['datetime'] = bars[self.symbol_list[0]][0].time
         dh['cash'] = self.current_holdings['cash']
         dh['commission'] = self.current_holdings['commission']
         dh['total'] = self.current_holdings['cash']
@@ -151,8 +235,21 @@ class NaivePortfolio(Portfolio):
             dh[s] = market_value
             dh['total'] += market_value
 
-        # Append the current holdings
-        self.all_holdings.append(dh)
+        # Append the current positions and holdings
+        self.store_record(dp, dh)
+
+
+    def store_record(self, positions, holdings):
+        """
+        Stores one row of the positions and holdings matrices, either
+        in memory or in the result sink if one is set.
+        """
+        if self.result_sink is None:
+            self.all_positions.append(positions)
+            self.all_holdings.append(holdings)
+        else:
+            self.result_sink.record_positions(positions)
+            self.result_sink.record_holdings(holdings)
 
 
     def update_positions_from_fill(self, fill):
@@ -198,6 +295,15 @@ class NaivePortfolio(Portfolio):
         self.current_holdings['total'] -= (cost + fill.commission)
 
 
+    def _add_position(self, symbol, quantity, cost):
+        """
+        Adds a signed quantity and its cost to the position and the
+        holdings of symbol.
+        """
+        self.current_positions[symbol] += quantity
+        self.current_holdings[symbol] += cost
+
+
     def update_fill(self, event):
         """
         Updates the portfolio current positions and holdings 
@@ -207,6 +313,57 @@ class NaivePortfolio(Portfolio):
             self.update_positions_from_fill(event)
             self.update_holdings_from_fill(event)
 
+            time = self.bars.get_latest_bars(event.symbol)[0].time
+            self.fill_ledger.append_fill(time, event)
+            if self.result_sink is not None:
+                self.result_sink.record_fill(time, event)
+
+
+    def latest_legs(self, symbols):
+        """
+        Returns the times and close prices of the latest bars of symbols
+        as arrays, read from the aligned matrices of the data handler
+        when it has them.
+        """
+        bars = self.bars
+        if hasattr(bars, 'panel'):
+            columns = [bars.symbol_index[s] for s in symbols]
+            row = bars.cursor - 1
+            return bars.times[row, columns], bars.panel['close'][row, columns]
+        latest = [bars.get_latest_bars(s)[0] for s in symbols]
+        return (np.array([b.time for b in latest], dtype='int64'),
+                np.array([b.close for b in latest], dtype='float64'))
+
+
+    def update_basket_fill(self, event):
+        """
+        Updates the positions and holdings from all legs of a
+        BasketFillEvent at once, the costs and commissions are computed
+        as arrays and the fills are appended to the ledger in bulk.
+        The cash is debited leg by leg in the order of the legs, so the
+        result is identical to sending the legs as single fills.
+        """
+        if event.kind == 'BASKET_FILL' and len(event) > 0:
+            times, closes = self.latest_legs(event.symbols)
+            sides = event.sides.astype('float64')
+            deltas = sides * event.quantities
+            costs = sides * closes * event.quantities
+
+            holdings = self.current_holdings
+            for s, delta, cost, commission in zip(event.symbols, deltas.tolist(), costs.tolist(),
+                                                  event.commissions.tolist()):
+                self._add_position(s, delta, cost)
+                holdings['commission'] += commission
+                holdings['cash'] -= (cost + commission)
+                holdings['total'] -= (cost + commission)
+
+            ids = [self.fill_ledger.symbol_ids[s] for s in event.symbols]
+            self.fill_ledger.extend(ids, times, event.sides, event.quantities,
+                                    event.fill_costs, event.commissions)
+            if self.result_sink is not None:
+                for time, fill in zip(times.tolist(), event.fills()):
+                    self.result_sink.record_fill(time, fill)
+
 
     def generate_naive_order(self, signal):
         """
@@ -214,6 +371,11 @@ class NaivePortfolio(Portfolio):
         sizing of the signal object, without risk management or
         position sizing considerations.
 
+        The strength of the signal is a multiple of a 100 unit lot,
+        entries are floor(100 * strength) units. A LONG or SHORT signal
+        whose strength is below 0.01, such as a small target weight,
+        rounds down to zero units and sends no order.
+
         Parameters:
         signal - The SignalEvent signal information.
         """
@@ -221,12 +383,15 @@ class NaivePortfolio(Portfolio):
 
         symbol = signal.symbol
         direction = signal.signal_type
-        strength = 1
+        strength = signal.strength
 
         mkt_quantity = floor(100 * strength)
-        cur_quantity = self.current_positions[symbol]
+        cur_quantity = self.current_positions.get(symbol, 0)
         order_type = 'MKT'
 
+        if mkt_quantity <= 0 and direction in ('LONG', 'SHORT'):
+            return None
+
         if direction == 'LONG' and cur_quantity == 0:
             order = OrderEvent(symbol, order_type, mkt_quantity, 'BUY')
         if direction == 'SHORT' and cur_quantity == 0:
@@ -246,19 +411,26 @@ class NaivePortfolio(Portfolio):
         """
         if event.kind == 'SIGNAL':
             order_event = self.generate_naive_order(event)
-            self.backtester.send_event(order_event)
+            if order_event is not None:
+                self.backtester.send_event(order_event)
 
 
     def create_equity_curve_dataframe(self):
         """
         Creates a pandas DataFrame from the all_holdings
-        list of dictionaries.
+        list of dictionaries, or from the result sink's files.
         """
-        curve = pd.DataFrame(self.all_holdings)
-        curve.set_index('datetime', inplace=True)
-        curve['returns'] = curve['total'].pct_change()
-        curve['equity_curve'] = (1.0+curve['returns']).cumprod()
-        self.equity_curve = curve
+        if self.result_sink is not None:
+            self.result_sink.close()
+            self.equity_curve = self.result_sink.load_equity_curve()
+        else:
+            self.equity_curve = create_equity_curve(pd.DataFrame(self.all_holdings))
+
+        benchmark = None
+        if hasattr(self.bars, 'get_benchmark'):
+            benchmark = self.bars.get_benchmark()
+        if benchmark is not None:
+            add_benchmark(self.equity_curve, benchmark)
 
 
     def output_summary_stats(self):
@@ -266,15 +438,284 @@ class NaivePortfolio(Portfolio):
         Creates a list of summary statistics for the portfolio such
         as Sharpe Ratio and drawdown information.
         """
-        total_return = self.equity_curve['equity_curve'][-1]
-        returns = self.equity_curve['returns']
-        pnl = self.equity_curve['equity_curve']
+        return summary_stats(self.equity_curve)
+
+
+    def rolling_benchmark_stats(self, window, periods=252):
+        """
+        Rolling alpha, beta, tracking error and information ratio of
+        the equity curve relative to the benchmark of the data handler,
+        see performance.create_rolling_benchmark_stats.
+
+        Parameters:
+        window - The number of bars in each window.
+        periods - Bars per year, used to annualise the statistics.
+        """
+        if 'benchmark_returns' not in self.equity_curve:
+            raise ValueError("The data handler has no benchmark")
+        return create_rolling_benchmark_stats(self.equity_curve['returns'],
+                                              self.equity_curve['benchmark_returns'],
+                                              window, periods)
+
+
+class SparsePortfolio(NaivePortfolio):
+    """
+    SparsePortfolio trades like NaivePortfolio but only keeps the open
+    positions. current_positions and current_holdings hold the symbols
+    with a non-zero position only, and the positions and holdings
+    records of each bar contain only those symbols.
+
+    On every bar the open positions are revalued from the row of
+    latest close prices shared by the data handler, so the cost of a
+    bar grows with the number of open positions rather than with the
+    size of the universe. The data handler should provide
+    get_latest_prices, like DataFrameDataHandler.
+
+    A result sink stores a column for every symbol, so with one the
+    rows are filled out with zeros before they are written.
+    """
+
+    def __init__(self, bars, backtester, start_date, initial_capital=1000000.0,
+                 result_sink=None):
+        """
+        Parameters:
+        bars, backtester, start_date, initial_capital, result_sink - see NaivePortfolio.
+        """
+        # The first record is stored by NaivePortfolio.__init__
+        self.empty_positions = dict((s, 0) for s in bars.symbol_list)
+        self.empty_holdings = dict((s, 0.0) for s in bars.symbol_list)
+        NaivePortfolio.__init__(self, bars, backtester, start_date,
+                                initial_capital, result_sink)
+        self.current_positions = {}
+        self.symbol_index = dict((s, i) for i, s in enumerate(self.symbol_list))
+
+
+    def construct_all_positions(self):
+        return [{'datetime': self.start_time}]
+
+
+    def construct_all_holdings(self):
+        return [{'datetime': self.start_time, 'cash': self.initial_capital,
+                 'commission': 0.0, 'total': self.initial_capital}]
+
+
+    def construct_current_holdings(self):
+        return {'cash': self.initial_capital, 'commission': 0.0,
+                'total': self.initial_capital}
+
+
+    def update_timeindex(self, event):
+        """
+        Adds a new record with the open positions and their market
+        values at the latest close prices.
+        """
+        bars = self.bars
+        prices = bars.get_latest_prices()
+        time = int(bars.times[bars.cursor - 1, 0])
+
+        dp = {'datetime': time}
+        dp.update(self.current_positions)
+
+        cash = self.current_holdings['cash']
+        dh = {'datetime': time, 'cash': cash,
+              'commission': self.current_holdings['commission'], 'total': cash}
+        index = self.symbol_index
+        total = cash
+        for s, quantity in self.current_positions.items():
+            # Approximation to the real value
+            market_value = quantity * float(prices[index[s]])
+            dh[s] = market_value
+            total += market_value
+        dh['total'] = total
 
-        sharpe_ratio = create_sharpe_ratio(returns)
-        max_dd, dd_duration = create_drawdowns(pnl)
+        self.store_record(dp, dh)
+
+
+    def store_record(self, positions, holdings):
+        """
+        Stores the sparse records in memory. The result sink writes a
+        column for every symbol, so the symbols without a position are
+        written as zeros.
+        """
+        if self.result_sink is not None:
+            positions = dict(self.empty_positions, **positions)
+            holdings = dict(self.empty_holdings, **holdings)
+        NaivePortfolio.store_record(self, positions, holdings)
+
+
+    def _add_position(self, symbol, quantity, cost):
+        """
+        Adds a signed quantity and its cost to the position and the
+        holding of symbol, like NaivePortfolio, and removes the symbol
+        from the positions and holdings once it is closed. The records
+        are valued from the positions, so a cost booked on a symbol that
+        is flat at that moment is dropped without changing the results.
+        """
+        position = self.current_positions.get(symbol, 0) + quantity
+        if position == 0:
+            self.current_positions.pop(symbol, None)
+            self.current_holdings.pop(symbol, None)
+        else:
+            self.current_positions[symbol] = position
+            self.current_holdings[symbol] = self.current_holdings.get(symbol, 0.0) + cost
 
-        stats = [("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
-                 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
-                 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
-                 ("Drawdown Duration", "%d" % dd_duration)]
-        return stats
\ No newline at end of file
+
+    def update_positions_from_fill(self, fill):
+        """
+        Adds the filled quantity to the position of the symbol.
+        """
+        fill_dir = 1 if fill.direction == 'BUY' else -1
+        self._add_position(fill.symbol, fill_dir * fill.quantity, 0.0)
+
+
+    def update_holdings_from_fill(self, fill):
+        """
+        Books the cost of the fill, at the latest close price, on the
+        holding of the filled symbol and the cash.
+        """
+        fill_dir = 1 if fill.direction == 'BUY' else -1
+        close = float(self.bars.get_latest_prices()[self.symbol_index[fill.symbol]])
+        cost = fill_dir * close * fill.quantity
+        self._add_position(fill.symbol, 0, cost)
+        self.current_holdings['commission'] += fill.commission
+        self.current_holdings['cash'] -= (cost + fill.commission)
+        self.current_holdings['total'] -= (cost + fill.commission)
+
+
+    def create_equity_curve_dataframe(self):
+        """
+        Creates the equity curve, the market value of a symbol is zero
+        on the bars where it had no position.
+        """
+        NaivePortfolio.create_equity_curve_dataframe(self)
+        held = [s for s in self.equity_curve.columns if s in self.symbol_index]
+        self.equity_curve[held] = self.equity_curve[held].fillna(0.0)
+
+
+class RiskSizedPortfolio(NaivePortfolio):
+    """
+    RiskSizedPortfolio sizes its positions with a risk model instead
+    of trading a constant quantity. It maintains an exponentially
+    weighted covariance of the bar returns of the whole universe,
+    updated once per bar, and rebalances towards volatility targeting
+    or minimum variance weights in the directions given by the signals.
+
+    Signals of a bar are collected and the universe is rebalanced once
+    on the following bar, so a rebalance of many symbols costs a few
+    vectorized operations rather than one sizing pass per signal.
+    """
+
+    def __init__(self, bars, backtester, start_date, initial_capital=1000000.0,
+                 result_sink=None, method='vol_target', target_vol=0.15,
+                 periods=252, halflife=60, max_leverage=1.0, lot_size=1,
+                 basket_orders=True):
+        """
+        Parameters:
+        bars, backtester, start_date, initial_capital, result_sink - see NaivePortfolio.
+        method - 'vol_target' or 'min_variance'.
+        target_vol - The annualised target volatility of the portfolio.
+        periods - Bars per year, used to annualise the volatility.
+        halflife - The halflife (in bars) of the covariance estimate.
+        max_leverage - The maximum sum of absolute weights.
+        lot_size - Order quantities are rounded down to multiples of it.
+        basket_orders - Send the orders of a rebalance as one BasketOrderEvent
+            instead of one OrderEvent per symbol.
+        """
+        if method not in ('vol_target', 'min_variance'):
+            raise ValueError("method should be 'vol_target' or 'min_variance'")
+
+        NaivePortfolio.__init__(self, bars, backtester, start_date,
+                                initial_capital, result_sink)
+        self.method = method
+        self.target_vol = target_vol / np.sqrt(periods)
+        self.max_leverage = max_leverage
+        self.lot_size = lot_size
+        self.basket_orders = basket_orders
+
+        n = len(self.symbol_list)
+        self.symbol_index = dict((s, i) for i, s in enumerate(self.symbol_list))
+        self.covariance = EWCovariance(n, halflife)
+        self.signals = np.zeros(n)
+        self.prices = None
+        self.pending_rebalance = False
+
+
+    def update_timeindex(self, event):
+        """
+        Marks the portfolio to market, updates the covariance estimate
+        with the returns of the latest bar and rebalances if signals
+        arrived since the last bar. The close prices are read as one
+        row of the panel when the data handler has one.
+        """
+        NaivePortfolio.update_timeindex(self, event)
+
+        if hasattr(self.bars, 'panel'):
+            prices = self.bars.get_latest_prices()
+        else:
+            prices = np.array([self.bars.get_latest_bars(s)[0].close
+                               for s in self.symbol_list], dtype='float64')
+        if self.prices is not None:
+            self.covariance.update(prices / self.prices - 1.0)
+        self.prices = prices
+
+        if self.pending_rebalance and self.covariance.ready:
+            self.rebalance()
+            self.pending_rebalance = False
+
+
+    def target_weights(self):
+        """
+        The target weights of all symbols for the current signals.
+        """
+        cov = self.covariance.cov
+        if self.method == 'min_variance':
+            return min_variance_weights(self.signals, cov, self.target_vol,
+                                        self.max_leverage)
+        return volatility_target_weights(self.signals, cov, self.target_vol,
+                                         self.max_leverage)
+
+
+    def rebalance(self):
+        """
+        Sends the orders that move the current positions to the target
+        weights, valued at the latest close prices.
+        """
+        positions = np.array([self.current_positions[s] for s in self.symbol_list],
+                             dtype='float64')
+        equity = self.current_holdings['cash'] + positions.dot(self.prices)
+
+        target_value = self.target_weights() * equity
+        target = np.zeros_like(positions)
+        valid = self.prices > 0
+        target[valid] = np.trunc(target_value[valid] / self.prices[valid] /
+                                 self.lot_size) * self.lot_size
+        delta = target - positions
+
+        legs = np.flatnonzero(delta)
+        if self.basket_orders:
+            if len(legs) > 0:
+                order = BasketOrderEvent([self.symbol_list[i] for i in legs], 'MKT',
+                                         np.abs(delta[legs]), np.sign(delta[legs]))
+                self.backtester.send_event(order)
+            return
+
+        for i in legs:
+            direction = 'BUY' if delta[i] > 0 else 'SELL'
+            order = OrderEvent(self.symbol_list[i], 'MKT', int(abs(delta[i])), direction)
+            self.backtester.send_event(order)
+
+
+    def update_signal(self, event):
+        """
+        Records the direction and strength of a SignalEvent, the orders
+        are sent at the next rebalance.
+        """
+        if event.kind == 'SIGNAL':
+            i = self.symbol_index[event.symbol]
+            if event.signal_type == 'LONG':
+                self.signals[i] = event.strength
+            elif event.signal_type == 'SHORT':
+                self.signals[i] = -event.strength
+            elif event.signal_type == 'EXIT':
+                self.signals[i] = 0.0
+            self.pending_rebalance = True
@@ -1,15 +1,241 @@
+#encoding=utf-8
+
+"""
+回测进度的显示。
+ProgressReporter 由数据组件的游标(已推送的bar数)驱动，显示bars/s、events/s、
+已用时间和预计剩余时间(ETA)。刷新按时间限频，每个bar的开销只是一次时钟读取。
+
+多个进程同时回测时，每个进程的ProgressReporter把进度发送到同一个队列，
+由主进程的ProgressMonitor合并成一行显示:
+    queue = multiprocessing.Queue()
+    monitor = ProgressMonitor(queue)
+    monitor.start()
+    # 子进程中: Backtester(..., progress=ProgressReporter(name='shard-0', queue=queue))
+    monitor.stop()
+
+author: lvbj
+date: 2019-3-15
+"""
+
 import sys
 import time
+import threading
+from queue import Empty
+
+
+def format_duration(seconds):
+    """
+    把秒数格式化成h:mm:ss。
+    """
+    if seconds is None or seconds != seconds or seconds == float('inf'):
+        return "--:--:--"
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def format_progress(position, total, events, elapsed):
+    """
+    返回进度的文字说明: 已推送的bar数、bars/s、events/s、已用时间和ETA。
+    """
+    bar_rate = position / elapsed if elapsed > 0 else 0.0
+    event_rate = events / elapsed if elapsed > 0 else 0.0
+    eta = None
+    if total is not None and bar_rate > 0:
+        eta = (total - position) / bar_rate
+    count = "{}/{}".format(position, total) if total is not None else str(position)
+    return "{} bars, {:.0f} bars/s, {:.0f} events/s, elapsed {}, ETA {}".format(
+        count, bar_rate, event_rate, format_duration(elapsed), format_duration(eta))
+
 
 class TextProgressBar(object):
-    def __init__(self, width=50, style="*."):
-        self.width = 50
+    def __init__(self, width=50, style="*.", stream=None):
+        self.width = width
         self.style = style
+        self.stream = stream if stream is not None else sys.stdout
 
-    def show(self, percent):
+    def show(self, percent, text=""):
+        """
+        显示进度条。
+
+        Parameters:
+        percent - 完成的比例，0至1。
+        text - 显示在进度条后面的说明。
+        """
+        percent = min(max(percent, 0.0), 1.0)
         a = self.style[0] * int(self.width * percent)
         b = self.style[1] * (self.width - int(self.width * percent))
-        sys.stdout.write("\r[{0}{1}] {2:.0f}%% completed.".format(a, b, percent*100))
+        self.stream.write("\r[{0}{1}] {2:.0f}% completed. {3}".format(a, b, percent*100, text))
+        self.stream.flush()
+
+
+class ProgressReporter(object):
+    """
+    ProgressReporter 报告一次回测的进度。
+    给定queue时把进度发送到队列(由ProgressMonitor显示)，否则直接显示进度条。
+    """
+
+    def __init__(self, total=None, interval=0.5, name=None, queue=None, stream=None):
+        """
+        Parameters:
+        total - bar的总数，默认由Backtester取数据组件的n_bars。
+            为None时不显示百分比和ETA。
+        interval - 两次刷新之间的最短时间(秒)。
+        name - 回测的名字，多个进程的进度按名字区分。
+        queue - 进程间的队列(如multiprocessing.Queue)，为None时直接显示。
+        stream - 显示的输出流，默认为sys.stdout。
+        """
+        self.total = total
+        self.interval = interval
+        self.name = name
+        self.queue = queue
+        self.bar = TextProgressBar(stream=stream)
+        self.position = 0
+        self.events = 0
+        self.start_time = None
+        self.__next_report = 0.0
+
+    def start(self, total=None):
+        """
+        开始计时。
+        """
+        if total is not None and self.total is None:
+            self.total = total
+        self.position = 0
+        self.events = 0
+        self.start_time = time.perf_counter()
+        self.__next_report = self.start_time
+
+    def update(self, position, events=0):
+        """
+        更新进度，每推送一个bar调用一次，只有距离上次刷新超过interval时才刷新。
+
+        Parameters:
+        position - 已推送的bar数(数据组件的游标)。
+        events - 已处理的事件数。
+        """
+        now = time.perf_counter()
+        if now < self.__next_report:
+            return
+        self.position = position
+        self.events = events
+        self.__next_report = now + self.interval
+        self._report(now - self.start_time, False)
+
+    def finish(self, position=None, events=None):
+        """
+        回测结束时刷新最后的进度。
+        """
+        if position is not None:
+            self.position = position
+        if events is not None:
+            self.events = events
+        self._report(time.perf_counter() - self.start_time, True)
+
+    def _report(self, elapsed, done):
+        if self.queue is not None:
+            try:
+                self.queue.put_nowait((self.name, self.position, self.total,
+                                       self.events, elapsed, done))
+            except Exception:
+                # 队列已满时丢弃这一次的进度
+                pass
+            return
+
+        text = format_progress(self.position, self.total, self.events, elapsed)
+        if self.name is not None:
+            text = "{}: {}".format(self.name, text)
+        percent = float(self.position) / self.total if self.total else 0.0
+        self.bar.show(1.0 if done else percent, text)
+        if done:
+            self.bar.stream.write("\n")
+            self.bar.stream.flush()
+
+
+class ProgressMonitor(object):
+    """
+    ProgressMonitor 在主进程中读取各个进程发送到队列的进度，合并成一行显示。
+    """
+
+    def __init__(self, queue, interval=0.5, stream=None):
+        """
+        Parameters:
+        queue - 各个ProgressReporter共用的队列。
+        interval - 两次刷新之间的最短时间(秒)。
+        stream - 显示的输出流，默认为sys.stdout。
+        """
+        self.queue = queue
+        self.interval = interval
+        self.bar = TextProgressBar(stream=stream)
+        self.progress = {}
+        self.start_time = None
+        self.__next_show = 0.0
+        self.__active = False
+        self.__thread = None
+
+    def receive(self, timeout=None):
+        """
+        读取队列中所有的进度，返回是否读到了进度。
+        """
+        received = False
+        try:
+            while True:
+                name, position, total, events, elapsed, done = self.queue.get(
+                    block=timeout is not None and not received, timeout=timeout)
+                self.progress[name] = (position, total, events, elapsed, done)
+                received = True
+        except Empty:
+            pass
+        return received
+
+    def show(self):
+        """
+        显示合并后的进度: bar数和事件数为各个进程的和，
+        速率按监视开始以来的时间计算。
+        """
+        if len(self.progress) == 0:
+            return
+        values = list(self.progress.values())
+        position = sum(v[0] for v in values)
+        events = sum(v[2] for v in values)
+        total = None
+        if all(v[1] is not None for v in values):
+            total = sum(v[1] for v in values)
+        elapsed = max(time.perf_counter() - self.start_time, max(v[3] for v in values))
+        done = sum(1 for v in values if v[4])
+
+        text = "{} ({}/{} done)".format(format_progress(position, total, events, elapsed),
+                                        done, len(values))
+        percent = float(position) / total if total else 0.0
+        self.bar.show(percent, text)
+
+    def _run(self):
+        while self.__active:
+            if self.receive(timeout=self.interval) and time.perf_counter() >= self.__next_show:
+                self.__next_show = time.perf_counter() + self.interval
+                self.show()
+        self.receive()
+        self.show()
+        self.bar.stream.write("\n")
+        self.bar.stream.flush()
+
+    def start(self):
+        """
+        在后台线程中持续显示进度。
+        """
+        self.start_time = time.perf_counter()
+        self.__active = True
+        self.__thread = threading.Thread(target=self._run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        停止显示，并显示最后的进度。
+        """
+        self.__active = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
 
 
 if __name__ == '__main__':
@@ -17,4 +243,4 @@ if __name__ == '__main__':
     for i in range(99):
         bar.show(i/99)
         time.sleep(0.2)
-    print()
\ No newline at end of file
+    print()
@@ -0,0 +1,224 @@
+#encoding=utf-8
+
+"""
+回测结果的缓存。
+以回测的全部输入计算缓存的键：bar数据的指纹、策略/portfolio/执行等组件所在模块的源代码、
+组件的参数和配置，以及回测的日期区间。输入完全相同的回测直接返回缓存的统计结果和资金曲线，
+任何一项输入改变都会得到不同的键。
+
+缓存保存在本地目录中，每个结果一个文件，总大小超过上限时删除最久没有使用的结果(LRU)。
+
+使用:
+    cache = ResultCache("cache/results")
+    tester = Backtester(..., result_cache=cache)
+    stats = tester.run()
+
+注意：组件的参数取自组件对象的属性，使用了不固定种子的随机数的策略不应该使用缓存。
+
+author: lvbj
+date: 2019-3-13
+"""
+
+import datetime
+import hashlib
+import inspect
+import numbers
+import os, os.path
+import pickle
+import sys
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# (源文件, 修改时间, 大小) -> 源代码的sha1
+_SOURCE_DIGESTS = {}
+
+
+def source_digest(cls):
+    """
+    返回类及其所有基类所在模块的源代码的sha1，
+    模块中任何代码(包括策略调用的辅助函数)的改变都会使缓存失效。
+    """
+    h = hashlib.sha1()
+    for klass in inspect.getmro(cls):
+        module = sys.modules.get(klass.__module__)
+        if module is None or module.__name__ == 'builtins':
+            continue
+        h.update(klass.__module__.encode('utf-8'))
+        h.update(klass.__qualname__.encode('utf-8'))
+        try:
+            path = inspect.getsourcefile(module)
+        except TypeError:
+            path = None
+        if path is None:
+            continue
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key not in _SOURCE_DIGESTS:
+            with open(path, 'rb') as f:
+                _SOURCE_DIGESTS[key] = hashlib.sha1(f.read()).hexdigest()
+        h.update(_SOURCE_DIGESTS[key].encode('utf-8'))
+    return h.hexdigest()
+
+
+def _config(value, skip, seen):
+    """
+    把组件的配置转换成可以稳定地repr的嵌套元组。
+    基本类型原样保留，容器和普通对象的属性递归展开，
+    numpy数组记录类型、形状和内容的哈希值，pandas对象记录内容的哈希值，
+    skip中的对象(bar数据、Backtester等)、线程和已经访问过的对象只记录类型。
+    """
+    if value is None or isinstance(value, (bool, str, bytes)):
+        return value
+    if isinstance(value, np.generic):
+        return (type(value).__name__, repr(value.item()))
+    if isinstance(value, (numbers.Number, datetime.date, datetime.time, datetime.timedelta)):
+        return (type(value).__name__, repr(value))
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return ('ndarray', value.shape, _config(value.tolist(), skip, seen))
+        digest = hashlib.sha1(np.ascontiguousarray(value).tobytes())
+        return ('ndarray', str(value.dtype), value.shape, digest.hexdigest())
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        digest = hashlib.sha1(pd.util.hash_pandas_object(value).values.tobytes())
+        return (type(value).__name__, digest.hexdigest())
+    if id(value) in skip or id(value) in seen or isinstance(value, threading.Thread):
+        return ('ref', type(value).__name__)
+    if inspect.isclass(value) or inspect.isroutine(value):
+        return ('code', getattr(value, '__module__', None),
+                getattr(value, '__qualname__', repr(value)))
+
+    seen = seen | set([id(value)])
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_config(v, skip, seen) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return (type(value).__name__,) + tuple(sorted(repr(_config(v, skip, seen))
+                                                      for v in value))
+    if isinstance(value, dict):
+        return ('dict',) + tuple(sorted((repr(k), _config(v, skip, seen))
+                                        for k, v in value.items()))
+    if hasattr(value, '__dict__'):
+        return (type(value).__module__, type(value).__qualname__,
+                _config(vars(value), skip, seen))
+    # 锁、文件等对象的repr包含内存地址，只记录类型
+    return ('object', type(value).__name__)
+
+
+class ResultCache(object):
+    """
+    ResultCache 把回测的统计结果和资金曲线按输入的哈希值保存在本地目录中。
+    """
+
+    def __init__(self, cache_dir, max_bytes=256 * 2**20):
+        """
+        Parameters:
+        cache_dir - 缓存目录，不存在时自动创建。
+        max_bytes - 缓存文件的总大小上限，超过时删除最久没有使用的结果。
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, bars, components, start_date=None, end_date=None):
+        """
+        计算一次回测的缓存键。
+
+        Parameters:
+        bars - 数据组件，必须提供fingerprint()方法，如DataFrameDataHandler。
+        components - 其余的组件，如[strategy, port, broker]，
+            键包含每个组件的类、所在模块的源代码和对象的属性。
+        start_date, end_date - 回测的日期区间。
+        """
+        if not hasattr(bars, 'fingerprint'):
+            raise TypeError("{} has no fingerprint(), its results can't be cached"
+                            .format(type(bars).__name__))
+        skip = set(id(c) for c in components)
+        skip.add(id(bars))
+        skip.add(id(getattr(bars, 'backtester', None)))
+
+        items = [bars.fingerprint(), start_date, end_date]
+        # 注册到数据组件上的特征(FeatureStore)也是回测的输入
+        features = getattr(bars, 'features', None) or {}
+        items.append(sorted((name, hashlib.sha1(values.tobytes()).hexdigest())
+                            for name, values in features.items()))
+        for c in components:
+            items.append(source_digest(type(c)))
+            items.append(_config(c, skip - set([id(c)]), set()))
+        return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "{}.pkl".format(key))
+
+    def get(self, key):
+        """
+        返回缓存的(stats, equity_curve)，没有缓存时返回None。
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        # 更新修改时间，用于LRU淘汰
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return result['stats'], result['equity_curve']
+
+    def put(self, key, stats, equity_curve):
+        """
+        保存一次回测的结果，然后按LRU把缓存的总大小限制在max_bytes以内。
+        文件先写入临时文件再改名，多个进程同时写入时不会读到不完整的结果。
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'stats': stats, 'equity_curve': equity_curve}, f,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        删除最久没有使用的结果，直到缓存的总大小不超过max_bytes。
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pkl'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        删除所有缓存的结果。
+        """
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,252 @@
+#encoding=utf-8
+
+"""
+回测结果的流式写入。
+资金(equity)、持仓(positions)和成交(fills)记录按批次由后台线程写入列式文件，
+回测过程中内存占用有上限，不再随回测长度增长。
+
+每个结果目录中，一列对应一个原始的二进制文件(<column>.bin)，schema.json记录列名和类型。
+读取时用np.memmap直接映射文件，不需要解析，也不复制数据。
+
+author: lvbj
+date: 2019-2-22
+"""
+
+import json
+import os, os.path
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+import pandas as pd
+
+from timeutil import parse_epoch_ns
+
+
+DIRECTION_CODES = {'BUY': 1, 'SELL': -1}
+
+
+class ColumnarWriter(object):
+    """
+    ColumnarWriter 把一行行的记录缓存成批，每批转换成numpy数组后交给后台线程
+    追加写入各列的文件。待写入的批次数有上限，写入跟不上时回测线程会等待，
+    因此内存占用不超过(max_pending + 1) * batch_size行。
+    """
+
+    def __init__(self, directory, columns, batch_size=10000, max_pending=4):
+        """
+        Parameters:
+        directory - 写入的目录，不存在时自动创建。
+        columns - list of (name, dtype)，dtype为'datetime64[ns]'的列以int64的epoch纳秒保存，
+            写入的值可以是epoch纳秒，也可以是能被pd.to_datetime解析的时间。
+        batch_size - 每批的行数。
+        max_pending - 等待后台线程写入的最大批次数。
+        """
+        self.directory = directory
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in columns]
+        self.batch_size = batch_size
+        self.rows = 0
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for name, _ in self.columns:
+            open(self._column_path(name), 'wb').close()
+
+        self.__buffer = []
+        self.__queue = Queue(maxsize=max_pending)
+        self.__error = None
+        self.__closed = False
+        self.__thread = Thread(target=self.__write_loop)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def _column_path(self, name):
+        return os.path.join(self.directory, "{}.bin".format(name))
+
+    def append(self, row):
+        """
+        加入一行记录。
+
+        Parameters:
+        row - tuple，与columns一一对应。
+        """
+        if self.__closed:
+            raise ValueError("append to a closed ColumnarWriter")
+        self.__buffer.append(row)
+        if len(self.__buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        把缓存的记录转换成一批交给后台线程。
+        """
+        if self.__error is not None:
+            raise self.__error
+        if len(self.__buffer) == 0:
+            return
+
+        values = list(zip(*self.__buffer))
+        batch = []
+        for (name, dtype), column in zip(self.columns, values):
+            if dtype.kind == 'M':
+                arr = np.asarray(column)
+                if arr.dtype.kind not in 'iu':
+                    arr = parse_epoch_ns(list(column))
+                arr = arr.astype('int64')
+            else:
+                arr = np.asarray(column, dtype=dtype)
+            batch.append((name, arr))
+        self.rows += len(self.__buffer)
+        self.__buffer = []
+        self.__queue.put(batch)
+
+    def __write_loop(self):
+        """
+        后台线程：把每批数据追加写到各列的文件末尾。
+        """
+        while True:
+            batch = self.__queue.get()
+            if batch is None:
+                break
+            if self.__error is not None:
+                continue
+            try:
+                for name, arr in batch:
+                    with open(self._column_path(name), 'ab') as f:
+                        f.write(arr.tobytes())
+            except Exception as e:
+                self.__error = e
+
+    def close(self):
+        """
+        写入剩余的记录，等待后台线程结束，并写入schema.json。
+        重复调用没有副作用。
+        """
+        if self.__closed:
+            return
+        self.flush()
+        self.__closed = True
+        self.__queue.put(None)
+        self.__thread.join()
+        if self.__error is not None:
+            raise self.__error
+
+        schema = {'rows': self.rows,
+                  'columns': [[name, dtype.str] for name, dtype in self.columns]}
+        with open(os.path.join(self.directory, 'schema.json'), 'w') as f:
+            json.dump(schema, f)
+
+
+def read_columns(directory):
+    """
+    以np.memmap映射结果目录中的各列，不复制数据。
+    datetime列以datetime64[ns]的视图返回。
+
+    Returns:
+    dict, name -> np.ndarray (memmap)
+    """
+    with open(os.path.join(directory, 'schema.json')) as f:
+        schema = json.load(f)
+
+    columns = {}
+    for name, dtype in schema['columns']:
+        dtype = np.dtype(dtype)
+        store = np.dtype('int64') if dtype.kind == 'M' else dtype
+        path = os.path.join(directory, "{}.bin".format(name))
+        if schema['rows'] == 0:
+            arr = np.empty(0, dtype=store)
+        else:
+            arr = np.memmap(path, dtype=store, mode='r', shape=(schema['rows'],))
+        if dtype.kind == 'M':
+            arr = arr.view('datetime64[ns]')
+        columns[name] = arr
+    return columns
+
+
+def load_equity_curve(directory):
+    """
+    读取资金记录，返回与NaivePortfolio.create_equity_curve_dataframe相同格式的DataFrame。
+    """
+    columns = read_columns(directory)
+    curve = pd.DataFrame(columns, copy=False)
+    curve.set_index('datetime', inplace=True)
+    curve['returns'] = curve['total'].pct_change()
+    curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
+    return curve
+
+
+class ResultSink(object):
+    """
+    ResultSink 在回测过程中把资金、持仓和成交记录流式写入directory下的
+    equity, positions, fills三个子目录。
+    """
+
+    def __init__(self, directory, symbol_list, batch_size=10000, max_pending=4):
+        """
+        Parameters:
+        directory - 结果目录。
+        symbol_list - 标的代码列表，成交记录中以其下标作为symbol_id。
+        batch_size, max_pending - 参见ColumnarWriter。
+        """
+        self.directory = directory
+        self.symbol_list = list(symbol_list)
+        self.symbol_ids = dict((s, i) for i, s in enumerate(self.symbol_list))
+
+        self.equity = ColumnarWriter(
+            os.path.join(directory, 'equity'),
+            [('datetime', 'datetime64[ns]')] + [(s, 'float64') for s in self.symbol_list] +
+            [('cash', 'float64'), ('commission', 'float64'), ('total', 'float64')],
+            batch_size, max_pending)
+        self.positions = ColumnarWriter(
+            os.path.join(directory, 'positions'),
+            [('datetime', 'datetime64[ns]')] + [(s, 'int64') for s in self.symbol_list],
+            batch_size, max_pending)
+        self.fills = ColumnarWriter(
+            os.path.join(directory, 'fills'),
+            [('datetime', 'datetime64[ns]'), ('symbol_id', 'int32'), ('direction', 'int8'),
+             ('quantity', 'float64'), ('fill_cost', 'float64'), ('commission', 'float64')],
+            batch_size, max_pending)
+
+    def record_holdings(self, holdings):
+        """
+        写入一行资金记录，holdings的格式与NaivePortfolio.all_holdings中的元素相同。
+        """
+        self.equity.append(tuple([holdings['datetime']] +
+                                 [holdings[s] for s in self.symbol_list] +
+                                 [holdings['cash'], holdings['commission'], holdings['total']]))
+
+    def record_positions(self, positions):
+        """
+        写入一行持仓记录，positions的格式与NaivePortfolio.all_positions中的元素相同。
+        """
+        self.positions.append(tuple([positions['datetime']] +
+                                    [positions[s] for s in self.symbol_list]))
+
+    def record_fill(self, time, fill):
+        """
+        写入一条成交记录。
+
+        Parameters:
+        time - 成交时的市场时间，epoch纳秒。
+        fill - FillEvent对象。
+        """
+        self.fills.append((time, self.symbol_ids[fill.symbol],
+                           DIRECTION_CODES.get(fill.direction, 0),
+                           fill.quantity, fill.fill_cost, fill.commission))
+
+    def close(self):
+        """
+        写入所有剩余的记录。
+        """
+        self.equity.close()
+        self.positions.close()
+        self.fills.close()
+
+    def load_equity_curve(self):
+        return load_equity_curve(self.equity.directory)
+
+    def read_positions(self):
+        return read_columns(self.positions.directory)
+
+    def read_fills(self):
+        return read_columns(self.fills.directory)
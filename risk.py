@@ -0,0 +1,128 @@
+#encoding=utf-8
+
+"""
+风险模型。
+EWCovariance 用指数加权的方式增量地估计收益率的协方差矩阵，每个bar只做一次O(n^2)的秩一更新，
+不必每个bar都从头计算整个协方差矩阵。
+volatility_target_weights, min_variance_weights 根据协方差矩阵计算目标权重。
+
+author: lvbj
+date: 2019-2-27
+"""
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+
+
+class EWCovariance(object):
+    """
+    指数加权的收益率均值和协方差，递推公式为：
+        d = r - mean
+        mean = mean + alpha * d
+        cov = (1 - alpha) * (cov + alpha * d * d^T)
+    """
+
+    def __init__(self, n, halflife=60, min_periods=None):
+        """
+        Parameters:
+        n - 标的个数。
+        halflife - 权重的半衰期(bar数)。
+        min_periods - 至少更新多少次之后估计才被认为可用，默认等于halflife。
+        """
+        self.n = n
+        self.alpha = 1.0 - 0.5 ** (1.0 / halflife)
+        self.min_periods = halflife if min_periods is None else min_periods
+        self.count = 0
+
+        self.mean = np.zeros(n)
+        self.cov = np.zeros((n, n))
+
+    @property
+    def ready(self):
+        return self.count >= self.min_periods
+
+    def update(self, returns):
+        """
+        用一个bar的收益率向量更新估计，缺失(NaN)的收益率按0处理。
+
+        Parameters:
+        returns - 长度为n的收益率数组。
+        """
+        r = np.nan_to_num(np.asarray(returns, dtype='float64'))
+        a = self.alpha
+        d = r - self.mean
+        self.mean += a * d
+        self.cov += a * np.outer(d, d)
+        self.cov *= (1.0 - a)
+        self.count += 1
+
+    def volatility(self):
+        """
+        各标的每个bar的收益率标准差。
+        """
+        return np.sqrt(np.maximum(np.diag(self.cov), 0.0))
+
+
+def _scale_to_target(weights, cov, target_vol, max_leverage):
+    """
+    把权重等比例缩放到目标波动率，总杠杆(权重绝对值之和)不超过max_leverage。
+    """
+    port_vol = np.sqrt(max(weights.dot(cov).dot(weights), 0.0))
+    if port_vol == 0.0:
+        return np.zeros_like(weights)
+    weights = weights * (target_vol / port_vol)
+    gross = np.abs(weights).sum()
+    if gross > max_leverage:
+        weights *= max_leverage / gross
+    return weights
+
+
+def volatility_target_weights(signals, cov, target_vol, max_leverage=1.0):
+    """
+    波动率目标：每个标的的权重与其波动率成反比，再把组合缩放到目标波动率。
+
+    Parameters:
+    signals - 长度为n的数组，1做多，-1做空，0不持仓。
+    cov - 每个bar的收益率协方差矩阵。
+    target_vol - 每个bar的目标波动率。
+    max_leverage - 权重绝对值之和的上限。
+    """
+    signals = np.asarray(signals, dtype='float64')
+    vol = np.sqrt(np.maximum(np.diag(cov), 0.0))
+    active = (signals != 0) & (vol > 0)
+
+    weights = np.zeros(len(signals))
+    weights[active] = signals[active] / vol[active]
+    return _scale_to_target(weights, cov, target_vol, max_leverage)
+
+
+def min_variance_weights(signals, cov, target_vol, max_leverage=1.0, ridge=1e-8):
+    """
+    最小方差：在signals给定的方向上求方差最小的组合，
+    即 w 正比于 inv(cov_AA) * s_A，A为有信号的标的，再把组合缩放到目标波动率。
+
+    Parameters:
+    signals, cov, target_vol, max_leverage - 同volatility_target_weights。
+    ridge - 加在协方差矩阵对角线上的正则项(相对于平均方差)，保证矩阵可逆。
+    """
+    signals = np.asarray(signals, dtype='float64')
+    active = np.flatnonzero(signals)
+    weights = np.zeros(len(signals))
+    if len(active) == 0:
+        return weights
+
+    sub = cov[np.ix_(active, active)]
+    scale = np.trace(sub) / len(active)
+    if scale <= 0:
+        return weights
+    sub = sub + np.eye(len(active)) * (ridge * scale)
+    try:
+        x = np.linalg.solve(sub, signals[active])
+    except np.linalg.LinAlgError:
+        x = np.linalg.lstsq(sub, signals[active], rcond=None)[0]
+
+    # 保证每个标的的方向与信号一致
+    x = np.where(np.sign(x) == np.sign(signals[active]), x, 0.0)
+    weights[active] = x
+    return _scale_to_target(weights, cov, target_vol, max_leverage)
@@ -0,0 +1,241 @@
+#encoding=utf-8
+
+"""
+回测结果的蒙特卡洛稳健性分析。
+monte_carlo 把资金曲线的'returns'列重新抽样成成千上万条路径(循环分块自助法，或打乱收益率块的顺序)，
+给出夏普比率、最大回撤和总收益的分布。
+shuffle_trades 打乱FillLedger中逐笔交易(round_trips)的盈亏的顺序，给出最大回撤的分布，
+总收益不变。
+
+monte_carlo的路径由连续的收益率块组成。每个可能的块的统计量只计算一次，之后一批路径作为一个(路径数 x 块数)
+的NumPy矩阵计算，不重新运行回测，也没有对路径或bar的循环。
+
+author: lvbj
+date: 2019-3-4
+"""
+
+import numpy as np
+import pandas as pd
+
+from ledger import round_trips
+
+
+# The columns of the block statistics table
+SUM, SUM_SQ, SUM_LOG, MAX_CUM, MIN_CUM, INTRA_DD = range(6)
+
+
+def _block_stats(r, starts, length, max_chunk_elements):
+    """
+    Pre-computes the statistics of the blocks of consecutive returns
+    r[s:s+length] (wrapping around the end) for every s in starts.
+
+    Returns:
+    A matrix of shape (len(starts), 6), one row per block with the sums
+    of the returns, of the squared returns and of the log returns, the
+    highest and lowest cumulative log return within the block and the
+    largest drawdown (in log equity) inside the block.
+    """
+    n = len(r)
+    log_r = np.log1p(r)
+    stats = np.empty((len(starts), 6))
+
+    # The sums come from prefix sums over the returns repeated twice
+    for col, values in ((SUM, r), (SUM_SQ, r * r), (SUM_LOG, log_r)):
+        prefix = np.r_[0.0, np.cumsum(np.r_[values, values])]
+        stats[:, col] = prefix[starts + length] - prefix[starts]
+
+    chunk = max(max_chunk_elements // length, 1)
+    offsets = np.arange(length)
+    for i in range(0, len(starts), chunk):
+        cum = np.cumsum(log_r[(starts[i:i+chunk, None] + offsets) % n], axis=1)
+        stats[i:i+chunk, MAX_CUM] = cum.max(axis=1)
+        stats[i:i+chunk, MIN_CUM] = cum.min(axis=1)
+        stats[i:i+chunk, INTRA_DD] = (np.maximum.accumulate(cum, axis=1) - cum).max(axis=1)
+    return stats
+
+
+def path_statistics(blocks, n, periods=252):
+    """
+    Calculates the Sharpe ratio, maximum drawdown and total return of
+    paths made of consecutive blocks of returns, from the statistics of
+    the blocks alone. The result is exact, the cost is proportional to
+    the number of blocks rather than the number of returns.
+
+    Parameters:
+    blocks - An array of shape (n_paths, n_blocks, 6) of the block
+        statistics (see _block_stats) in path order.
+    n - The number of returns per path.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+
+    Returns:
+    sharpe, max_drawdown, total_return - arrays of length n_paths. The
+    drawdown is the largest peak-to-trough decline as a fraction of the
+    peak.
+    """
+    mean = blocks[:, :, SUM].sum(axis=1) / n
+    std = np.sqrt(np.maximum(blocks[:, :, SUM_SQ].sum(axis=1) / n - mean * mean, 0.0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = np.sqrt(periods) * mean / std
+
+    # Log equity at the end and at the start of each block
+    end = np.cumsum(blocks[:, :, SUM_LOG], axis=1)
+    start = end - blocks[:, :, SUM_LOG]
+
+    # High water mark before each block, the initial equity included
+    peak = np.maximum.accumulate(start + blocks[:, :, MAX_CUM], axis=1)
+    np.maximum(peak, 0.0, out=peak)
+    peak_before = np.empty_like(peak)
+    peak_before[:, 0] = 0.0
+    peak_before[:, 1:] = peak[:, :-1]
+
+    drawdown = np.maximum(peak_before - (start + blocks[:, :, MIN_CUM]),
+                          blocks[:, :, INTRA_DD])
+    max_drawdown = 1.0 - np.exp(-np.maximum(drawdown.max(axis=1), 0.0))
+    total_return = np.expm1(end[:, -1])
+    return sharpe, max_drawdown, total_return
+
+
+def monte_carlo(returns, n_paths=10000, method='bootstrap', block_size=None,
+                periods=252, seed=None, max_chunk_elements=2**23):
+    """
+    Resamples the returns into n_paths paths and returns the
+    distributions of their statistics.
+
+    Parameters:
+    returns - A pandas Series (or array) of period returns, such as
+        equity_curve['returns']. NaN values are dropped.
+    n_paths - The number of resampled paths.
+    method - 'bootstrap' for a circular block bootstrap, which keeps
+        short-range autocorrelation, or 'shuffle' to permute the order
+        of the blocks of period returns, which keeps the total return and
+        only changes the path. To shuffle the order of the trades
+        themselves use shuffle_trades.
+    block_size - The block length, by default n ** (1/3). With
+        method='shuffle' and block_size=1 every return is shuffled
+        individually.
+    periods - Used to annualise the Sharpe ratio.
+    seed - The seed of the random generator.
+    max_chunk_elements - Paths are processed in chunks of at most this
+        many blocks to bound the memory.
+
+    Returns:
+    A pandas DataFrame with one row per path and the columns
+    'sharpe', 'max_drawdown' and 'total_return'.
+    """
+    if method not in ('bootstrap', 'shuffle'):
+        raise ValueError("method should be 'bootstrap' or 'shuffle'")
+
+    r = np.asarray(returns, dtype='float64')
+    r = r[~np.isnan(r)]
+    n = len(r)
+    if n == 0:
+        raise ValueError("No returns to resample")
+    if block_size is None:
+        block_size = max(int(round(n ** (1.0 / 3.0))), 1)
+    block_size = min(block_size, n)
+
+    n_blocks = -(-n // block_size)
+    last = n - (n_blocks - 1) * block_size
+
+    if method == 'bootstrap':
+        # Any start is possible. The last block of a path may be shorter,
+        # its statistics are kept in the second half of the table.
+        starts = np.arange(n)
+        table = _block_stats(r, starts, block_size, max_chunk_elements)
+        if last != block_size:
+            table = np.concatenate([table, _block_stats(r, starts, last, max_chunk_elements)])
+    else:
+        # The blocks partition the returns, only their order changes
+        starts = np.arange(n_blocks) * block_size
+        table = _block_stats(r, starts, block_size, max_chunk_elements)
+        if last != block_size:
+            table[-1] = _block_stats(r, starts[-1:], last, max_chunk_elements)[0]
+
+    rng = np.random.default_rng(seed)
+    chunk = max(max_chunk_elements // n_blocks, 1)
+
+    sharpe = np.empty(n_paths)
+    max_drawdown = np.empty(n_paths)
+    total_return = np.empty(n_paths)
+    for i in range(0, n_paths, chunk):
+        m = min(chunk, n_paths - i)
+        if method == 'bootstrap':
+            ids = rng.integers(0, n, size=(m, n_blocks))
+            if last != block_size:
+                ids[:, -1] += n
+        else:
+            ids = rng.permuted(np.broadcast_to(np.arange(n_blocks), (m, n_blocks)), axis=1)
+
+        s, dd, tr = path_statistics(table[ids], n, periods)
+        sharpe[i:i+m] = s
+        max_drawdown[i:i+m] = dd
+        total_return[i:i+m] = tr
+
+    return pd.DataFrame({'sharpe': sharpe,
+                         'max_drawdown': max_drawdown,
+                         'total_return': total_return})
+
+
+def shuffle_trades(ledger, initial_capital, n_paths=10000, seed=None,
+                   max_chunk_elements=2**23):
+    """
+    Permutes the order of the round trips of a backtest and returns the
+    distribution of the maximum drawdown of the resulting equity paths.
+    Every path realises the same trades, so the total return is the same
+    on all paths; the drawdown shows how much of it depended on the
+    order in which the wins and losses came.
+
+    Parameters:
+    ledger - The FillLedger of the portfolio (portfolio.fill_ledger).
+        The trades are paired by ledger.round_trips, positions still open
+        at the end are not included.
+    initial_capital - The capital the PnL is relative to.
+    n_paths - The number of shuffled paths.
+    seed - The seed of the random generator.
+    max_chunk_elements - Paths are processed in chunks of at most this
+        many trades to bound the memory.
+
+    Returns:
+    A pandas DataFrame with one row per path and the columns
+    'max_drawdown' and 'total_return'.
+    """
+    pnl = round_trips(ledger)['pnl']
+    n = len(pnl)
+    if n == 0:
+        raise ValueError("No round trips to shuffle")
+
+    rng = np.random.default_rng(seed)
+    chunk = max(max_chunk_elements // n, 1)
+    max_drawdown = np.empty(n_paths)
+    for i in range(0, n_paths, chunk):
+        m = min(chunk, n_paths - i)
+        paths = rng.permuted(np.broadcast_to(pnl, (m, n)), axis=1)
+        equity = initial_capital + np.cumsum(paths, axis=1)
+        # The high water mark includes the initial capital
+        peak = np.maximum(np.maximum.accumulate(equity, axis=1), initial_capital)
+        max_drawdown[i:i+m] = ((peak - equity) / peak).max(axis=1)
+
+    return pd.DataFrame({'max_drawdown': max_drawdown,
+                         'total_return': np.full(n_paths, pnl.sum() / initial_capital)})
+
+
+def output_robustness_stats(distribution, quantiles=(0.05, 0.5, 0.95)):
+    """
+    Creates a list of summary statistics of the Monte Carlo
+    distributions, in the format of output_summary_stats.
+
+    Parameters:
+    distribution - The DataFrame returned by monte_carlo or shuffle_trades.
+    quantiles - The quantiles to report.
+    """
+    stats = []
+    for q in quantiles:
+        row = distribution.quantile(q)
+        label = "%d%%" % (q * 100)
+        stats.append(("Total Return " + label, "%0.2f%%" % (row['total_return'] * 100.0)))
+        if 'sharpe' in row:
+            stats.append(("Sharpe Ratio " + label, "%0.2f" % row['sharpe']))
+        stats.append(("Max Drawdown " + label, "%0.2f%%" % (row['max_drawdown'] * 100.0)))
+    stats.append(("P(Total Return < 0)", "%0.2f%%" %
+                  ((distribution['total_return'] < 0).mean() * 100.0)))
+    return stats
@@ -0,0 +1,232 @@
+#encoding=utf-8
+
+"""
+按标的分片的并行回测。
+对于标的之间没有依赖的策略(如BuyAndHoldStrategy)和按固定数量下单的portfolio(如NaivePortfolio)，
+把symbol_list分成若干片，每一片在单独的进程中运行自己的数据组件、策略和portfolio，
+初始资金按标的数量的比例分配。
+
+各个分片的持仓市值按列合并，现金和手续费则按单进程回测中成交的先后顺序
+(同一个bar内按symbol_list的顺序)重新累计，合并后的资金曲线与单进程回测的结果完全相同。
+
+author: lvbj
+date: 2019-3-18
+"""
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from data import DataFrameDataHandler
+from execution import SimulatedExecutionHandler
+from main import Backtester
+from portfolio import NaivePortfolio, create_equity_curve, summary_stats
+from progressbar import ProgressMonitor, ProgressReporter
+
+
+def partition_symbols(symbol_list, n_shards):
+    """
+    把symbol_list按顺序分成n_shards片，各片的标的数量最多相差1。
+    """
+    n_shards = max(min(n_shards, len(symbol_list)), 1)
+    size, extra = divmod(len(symbol_list), n_shards)
+    shards = []
+    start = 0
+    for i in range(n_shards):
+        stop = start + size + (1 if i < extra else 0)
+        shards.append(list(symbol_list[start:stop]))
+        start = stop
+    return shards
+
+
+def _run_shard(job):
+    """
+    在子进程中运行一个分片的回测。
+
+    Returns:
+    dict - holdings(各个bar的持仓记录DataFrame), marks(每条记录之前的成交数),
+    fills(成交记录的数组)
+    """
+    symbol_data = job['symbol_data']
+    strategy_cls = job['strategy_cls']
+    params = job['params']
+    portfolio_cls = job['portfolio_cls']
+    portfolio_kwargs = job['portfolio_kwargs']
+    progress = None
+    if job['progress_queue'] is not None:
+        progress = ProgressReporter(name=job['name'], queue=job['progress_queue'])
+
+    tester = Backtester(
+        bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+        strategy=lambda bt: strategy_cls(bt.bars, bt, **params),
+        port=lambda bt: portfolio_cls(bt.bars, bt, job['portfolio_start'],
+                                      job['initial_capital'], **portfolio_kwargs),
+        broker=lambda bt: SimulatedExecutionHandler(bt),
+        start_date=job['start_date'], end_date=job['end_date'], progress=progress)
+
+    # 记录每次update_timeindex之前的成交数，用于确定每笔成交计入哪一条记录
+    port = tester.port
+    marks = []
+    update_timeindex = port.update_timeindex
+
+    def counted_update_timeindex(event):
+        marks.append(len(port.fill_ledger))
+        update_timeindex(event)
+    port.update_timeindex = counted_update_timeindex
+
+    tester.run()
+    ledger = port.fill_ledger
+    return {'holdings': pd.DataFrame(port.all_holdings),
+            'marks': np.array(marks, dtype='int64'),
+            'fills': {'symbol': [ledger.symbol_list[i] for i in ledger.symbol_id],
+                      'side': ledger.side.copy(),
+                      'quantity': ledger.quantity.copy(),
+                      'price': ledger.price.copy(),
+                      'commission': ledger.commission.copy()}}
+
+
+def merge_shards(results, symbol_list, initial_capital):
+    """
+    把各个分片的结果合并成一个portfolio的持仓记录。
+
+    Parameters:
+    results - list of dict, _run_shard的返回值。
+    symbol_list - 全部标的，顺序与单进程回测相同。
+    initial_capital - 全部的初始资金。
+
+    Returns:
+    持仓记录的DataFrame，列与NaivePortfolio.all_holdings相同。
+    """
+    n_rows = len(results[0]['holdings'])
+    if any(len(r['holdings']) != n_rows for r in results):
+        raise ValueError("Shards recorded different numbers of bars")
+    symbol_index = dict((s, i) for i, s in enumerate(symbol_list))
+
+    # 每笔成交第一次计入的记录(第0行是初始状态)
+    rows, order, flows, commissions = [], [], [], []
+    for r in results:
+        fills = r['fills']
+        n = len(fills['side'])
+        rows.append(np.searchsorted(r['marks'], np.arange(n), side='right') + 1)
+        order.append(np.array([symbol_index[s] for s in fills['symbol']], dtype='int64'))
+        # 与update_holdings_from_fill的计算顺序相同
+        flows.append(fills['side'] * fills['price'] * fills['quantity'] + fills['commission'])
+        commissions.append(fills['commission'])
+    rows = np.concatenate(rows)
+    order = np.concatenate(order)
+    flows = np.concatenate(flows)
+    commissions = np.concatenate(commissions)
+
+    # 单进程回测中同一个bar内的成交按symbol_list的顺序发生，
+    # 稳定排序保持同一个标的的成交的先后顺序
+    sort = np.lexsort((order, rows))
+    rows, flows, commissions = rows[sort], flows[sort], commissions[sort]
+
+    # 逐笔累计，浮点运算的顺序与单进程回测相同
+    cash_after = np.subtract.accumulate(np.r_[initial_capital, flows])
+    commission_after = np.add.accumulate(np.r_[0.0, commissions])
+    n_before = np.searchsorted(rows, np.arange(n_rows), side='right')
+
+    merged = pd.DataFrame(index=np.arange(n_rows))
+    for s in symbol_list:
+        for r in results:
+            if s in r['holdings'].columns:
+                merged[s] = r['holdings'][s].values
+                break
+    merged['datetime'] = results[0]['holdings']['datetime'].values
+    merged['cash'] = cash_after[n_before]
+    merged['commission'] = commission_after[n_before]
+
+    total = merged['cash'].values.copy()
+    for s in symbol_list:
+        total = total + merged[s].values
+    total[0] = initial_capital
+    merged['total'] = total
+    return merged
+
+
+class ShardedBacktester(object):
+    """
+    ShardedBacktester 把标的分到多个进程中并行回测，再把结果合并成一条资金曲线。
+    策略必须只依赖各个标的自己的数据，portfolio的下单数量不能依赖资金和其它标的，
+    策略类和portfolio类必须定义在模块的顶层，以便传递给子进程。
+    """
+
+    def __init__(self, symbol_data, strategy_cls, params=None, n_shards=None,
+                 portfolio_cls=NaivePortfolio, portfolio_kwargs=None,
+                 initial_capital=1000000.0, start_date=None, end_date=None,
+                 portfolio_start=None, progress=False):
+        """
+        Parameters:
+        symbol_data - dict, symbol -> 已对齐的bar数据DataFrame,
+            如CoinDataHandler.load_symbol_data()的返回值。
+        strategy_cls - 策略类，以strategy_cls(bars, backtester, **params)的方式构造。
+        params - 策略的参数。
+        n_shards - 分片(进程)的数量，默认为CPU的数量。
+        portfolio_cls - portfolio类，以portfolio_cls(bars, backtester, start,
+            capital, **portfolio_kwargs)的方式构造。
+        initial_capital - 全部的初始资金，按标的数量的比例分配给各个分片。
+        start_date, end_date - Backtester的日期区间。
+        portfolio_start - portfolio的起始时间，默认为start_date或第一个bar的时间。
+        progress - 是否显示合并后的回测进度。
+        """
+        self.symbol_list = list(symbol_data.keys())
+        self.strategy_cls = strategy_cls
+        self.params = params or {}
+        self.n_shards = n_shards or multiprocessing.cpu_count()
+        self.portfolio_cls = portfolio_cls
+        self.portfolio_kwargs = portfolio_kwargs or {}
+        self.initial_capital = initial_capital
+        self.start_date = start_date
+        self.end_date = end_date
+        self.progress = progress
+
+        # 单进程回测以第一个标的的时间过滤bar和记录持仓，各个分片使用同一个时钟
+        clock = symbol_data[self.symbol_list[0]]['datetime'].values
+        self.symbol_data = dict((s, df.assign(datetime=clock))
+                                for s, df in symbol_data.items())
+        if portfolio_start is None:
+            portfolio_start = start_date if start_date is not None else pd.Timestamp(clock[0])
+        self.portfolio_start = portfolio_start
+        self.equity_curve = None
+
+    def _jobs(self, progress_queue):
+        jobs = []
+        for i, shard in enumerate(partition_symbols(self.symbol_list, self.n_shards)):
+            jobs.append({'name': "shard-{}".format(i),
+                         'symbol_data': dict((s, self.symbol_data[s]) for s in shard),
+                         'strategy_cls': self.strategy_cls,
+                         'params': self.params,
+                         'portfolio_cls': self.portfolio_cls,
+                         'portfolio_kwargs': self.portfolio_kwargs,
+                         'portfolio_start': self.portfolio_start,
+                         'initial_capital': self.initial_capital * len(shard) / len(self.symbol_list),
+                         'start_date': self.start_date,
+                         'end_date': self.end_date,
+                         'progress_queue': progress_queue})
+        return jobs
+
+    def run(self):
+        """
+        并行运行所有分片的回测，返回合并后的output_summary_stats统计结果。
+        合并后的资金曲线保存在equity_curve中。
+        """
+        manager, monitor, queue = None, None, None
+        if self.progress:
+            manager = multiprocessing.Manager()
+            queue = manager.Queue()
+            monitor = ProgressMonitor(queue)
+            monitor.start()
+        try:
+            jobs = self._jobs(queue)
+            with multiprocessing.Pool(len(jobs)) as pool:
+                results = pool.map(_run_shard, jobs)
+        finally:
+            if monitor is not None:
+                monitor.stop()
+                manager.shutdown()
+
+        holdings = merge_shards(results, self.symbol_list, self.initial_capital)
+        self.equity_curve = create_equity_curve(holdings)
+        return summary_stats(self.equity_curve)
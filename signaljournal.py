@@ -0,0 +1,199 @@
+#encoding=utf-8
+
+"""
+信号日志和信号回放。
+SignalJournal 把回测中的SignalEvent按产生时的bar游标记录到紧凑的二进制文件中，
+每个信号占用固定的27个字节。JournalReplayStrategy 读取日志，在相同的bar上重新发出
+这些信号，而不再运行原来策略的calculate_signals。信号不变时，
+测试不同的portfolio(仓位、手续费)和ExecutionHandler(滑点)的配置只需要回放日志。
+
+记录:
+    journal = SignalJournal("signals.bin")
+    Backtester(..., signal_journal=journal).run()
+
+回放:
+    Backtester(bars=...,
+               strategy=lambda bt: JournalReplayStrategy(bt.bars, bt, "signals.bin"),
+               port=..., broker=...).run()
+
+文件格式: 4字节的b'QYSJ'，4字节的头部长度(little-endian)，JSON格式的头部
+(版本、标的列表、数据指纹)，之后是RECORD_DTYPE的记录。
+
+author: lvbj
+date: 2019-3-22
+"""
+
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+from event import SignalEvent
+from strategy import Strategy
+from timeutil import to_epoch_ns, to_datetime
+
+
+MAGIC = b'QYSJ'
+VERSION = 1
+
+SIGNAL_TYPES = ['LONG', 'SHORT', 'EXIT']
+
+RECORD_DTYPE = np.dtype([('cursor', '<i8'),
+                         ('time', '<i8'),
+                         ('strength', '<f8'),
+                         ('symbol_id', '<u2'),
+                         ('signal_type', '<u1')])
+
+
+class SignalJournal(object):
+    """
+    SignalJournal 把SignalEvent写入二进制的信号日志，记录成批地写入文件。
+    """
+
+    def __init__(self, path, batch_size=4096):
+        """
+        Parameters:
+        path - 日志文件。
+        batch_size - 每积累多少条记录写入一次文件。
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.symbol_list = None
+        self.symbol_ids = None
+        self.count = 0
+        self.__pending = []
+        self.__file = None
+
+    def open(self, bars):
+        """
+        创建日志文件并写入头部。
+
+        Parameters:
+        bars - 回测的数据组件，日志记录它的标的列表和数据指纹(如果有)。
+        """
+        self.symbol_list = list(bars.symbol_list)
+        self.symbol_ids = dict((s, i) for i, s in enumerate(self.symbol_list))
+        fingerprint = bars.fingerprint() if hasattr(bars, 'fingerprint') else None
+        header = json.dumps({'version': VERSION,
+                             'symbol_list': self.symbol_list,
+                             'fingerprint': fingerprint}).encode('utf-8')
+        self.__file = open(self.path, 'wb')
+        self.__file.write(MAGIC)
+        self.__file.write(struct.pack('<I', len(header)))
+        self.__file.write(header)
+        self.__pending = []
+        self.count = 0
+
+    def record(self, cursor, event):
+        """
+        记录一个SignalEvent。
+
+        Parameters:
+        cursor - 产生信号时数据组件的游标(已推送的bar数)。
+        event - SignalEvent对象。
+        """
+        self.__pending.append((cursor, to_epoch_ns(event.datetime), event.strength,
+                               self.symbol_ids[event.symbol],
+                               SIGNAL_TYPES.index(event.signal_type)))
+        self.count += 1
+        if len(self.__pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        把积累的记录写入文件。
+        """
+        if self.__pending:
+            self.__file.write(np.array(self.__pending, dtype=RECORD_DTYPE).tobytes())
+            self.__pending = []
+
+    def close(self):
+        """
+        写入剩余的记录并关闭文件。
+        """
+        if self.__file is not None:
+            self.flush()
+            self.__file.close()
+            self.__file = None
+
+
+def read_journal(path):
+    """
+    读取信号日志。
+
+    Returns:
+    header(dict, 包含symbol_list和fingerprint), records(RECORD_DTYPE的numpy数组)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError("{} is not a signal journal".format(path))
+    size = struct.unpack('<I', data[4:8])[0]
+    header = json.loads(data[8:8+size].decode('utf-8'))
+    if header['version'] != VERSION:
+        raise ValueError("Unsupported signal journal version {}".format(header['version']))
+    body = data[8+size:]
+    count = len(body) // RECORD_DTYPE.itemsize
+    records = np.frombuffer(body, dtype=RECORD_DTYPE, count=count)
+    return header, records
+
+
+class JournalReplayStrategy(Strategy):
+    """
+    JournalReplayStrategy 在记录信号的bar上重新发出信号日志中的信号，
+    信号的顺序与记录时相同，不运行任何策略的计算。
+    """
+
+    def __init__(self, bars, backtester, path, check_data=True):
+        """
+        Parameters:
+        bars - The DataHandler object that provides bar information
+        backtester - The Backtester object.
+        path - 信号日志文件。
+        check_data - 是否检查回放的数据与记录时的数据相同(数据组件提供fingerprint()时)。
+        """
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.backtester = backtester
+        self.path = path
+
+        header, records = read_journal(path)
+        if list(header['symbol_list']) != list(self.symbol_list):
+            raise ValueError("The journal was recorded for symbols {}".format(header['symbol_list']))
+        if (check_data and header['fingerprint'] is not None and
+                hasattr(bars, 'fingerprint') and bars.fingerprint() != header['fingerprint']):
+            raise ValueError("The bar data differs from the data the journal was recorded on")
+        # 日志内容的指纹，回测结果缓存以此区分不同的日志
+        self.digest = hashlib.sha1(records.tobytes()).hexdigest()
+
+        symbols = self.symbol_list
+        self.__cursors = records['cursor'].tolist()
+        self.__signals = [(symbols[sid], t, SIGNAL_TYPES[kind], strength)
+                          for sid, t, kind, strength in zip(records['symbol_id'].tolist(),
+                                                            records['time'].tolist(),
+                                                            records['signal_type'].tolist(),
+                                                            records['strength'].tolist())]
+        self.__next = 0
+
+    def calculate_signals(self, event):
+        """
+        发出记录在当前bar上的信号。
+
+        Parameters
+        event - A MarketEvent object.
+        """
+        if event.kind == 'MARKET':
+            cursor = self.bars.cursor
+            cursors = self.__cursors
+            i = self.__next
+            n = len(cursors)
+            # 跳过不在回测区间内的bar上的信号
+            while i < n and cursors[i] < cursor:
+                i += 1
+            while i < n and cursors[i] == cursor:
+                symbol, t, signal_type, strength = self.__signals[i]
+                self.backtester.send_event(
+                    SignalEvent(symbol, to_datetime(t), signal_type, strength))
+                i += 1
+            self.__next = i
@@ -12,8 +12,11 @@ date: 201-1-5
 # strategy.py
 
 import datetime
-import numpy as np
-import pandas as pd
+
+from lazyimport import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 from abc import ABCMeta, abstractmethod
 
@@ -104,3 +107,151 @@ class BuyAndHoldStrategy(Strategy):
                         signal = SignalEvent(bars[0].symbol, bars[0].dt, 'LONG')
                         self.backtester.send_event(signal)
                         self.bought[s] = True
+
+
+def cross_sectional_rank(x):
+    """
+    Ranks each row of x across symbols, scaled to [0, 1].
+    NaN values stay NaN and are excluded from the ranking.
+
+    Parameters:
+    x - A 1-d array (one bar) or 2-d array (bars x symbols).
+    """
+    x = np.asarray(x, dtype='float64')
+    valid = ~np.isnan(x)
+    ranks = np.argsort(np.argsort(np.where(valid, x, np.inf), axis=-1), axis=-1)
+    count = valid.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scaled = ranks / np.maximum(count - 1, 1).astype('float64')
+    return np.where(valid, scaled, np.nan)
+
+
+def cross_sectional_zscore(x):
+    """
+    Standardises each row of x across symbols to zero mean and unit
+    standard deviation, ignoring NaN values.
+
+    Parameters:
+    x - A 1-d array (one bar) or 2-d array (bars x symbols).
+    """
+    x = np.asarray(x, dtype='float64')
+    mean = np.nanmean(x, axis=-1, keepdims=True)
+    std = np.nanstd(x, axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(std > 0, (x - mean) / std, 0.0)
+
+
+class PanelStrategy(Strategy):
+    """
+    PanelStrategy is an abstract base class for cross-sectional
+    strategies. Instead of calling get_latest_bars once per symbol,
+    it receives the lookback window of the whole universe as aligned
+    NumPy matrices (bars x symbols, columns in symbol_list order) and
+    returns one value per symbol.
+
+    A positive value is a LONG signal, a negative value a SHORT signal
+    and zero an EXIT, the absolute value is passed on as the signal
+    strength, so target weights can be returned directly. A SignalEvent
+    is only sent for the symbols whose value changed since the last bar.
+    Weights are meant for RiskSizedPortfolio; NaivePortfolio reads the
+    strength as a multiple of 100 units and ignores entries below 0.01.
+
+    It requires a data handler with get_latest_panel(), such as the
+    DataFrameDataHandler.
+    """
+
+    def __init__(self, bars, backtester, lookback=1):
+        """
+        Initialises the panel strategy.
+
+        Parameters:
+        bars - The DataHandler object that provides bar information
+        backtester - The Backtester object.
+        lookback - The number of bars in the window passed to
+            calculate_panel.
+        """
+        self.bars = bars
+        self.symbol_list = self.bars.symbol_list
+        self.backtester = backtester
+        self.lookback = lookback
+
+        self.current = np.zeros(len(self.symbol_list))
+
+
+    @abstractmethod
+    def calculate_panel(self, window):
+        """
+        Calculates the signals or target weights of all symbols.
+
+        Parameters:
+        window - dict, field -> matrix of the last (up to) lookback bars,
+            see DataHandler.get_latest_panel.
+
+        Returns:
+        An array of one value per symbol, or None to keep the current
+        signals.
+        """
+        raise NotImplementedError("Should implement calculate_panel()")
+
+
+    def calculate_signals(self, event):
+        """
+        Passes the lookback window to calculate_panel and sends a
+        SignalEvent for every symbol whose value changed.
+
+        Parameters
+        event - A MarketEvent object. 
+        """
+        if event.kind == 'MARKET':
+            window = self.bars.get_latest_panel(N=self.lookback)
+            if len(window['close']) == 0:
+                return
+            values = self.calculate_panel(window)
+            if values is None:
+                return
+
+            values = np.nan_to_num(np.asarray(values, dtype='float64'))
+            changed = np.flatnonzero(values != self.current)
+            if len(changed) == 0:
+                return
+
+            dt = self.bars.get_latest_bars(self.symbol_list[0])[0].dt
+            for i in changed:
+                if values[i] > 0:
+                    signal_type = 'LONG'
+                elif values[i] < 0:
+                    signal_type = 'SHORT'
+                else:
+                    signal_type = 'EXIT'
+                signal = SignalEvent(self.symbol_list[i], dt, signal_type, abs(values[i]))
+                self.backtester.send_event(signal)
+            self.current = values
+
+
+class MomentumRankStrategy(PanelStrategy):
+    """
+    A cross-sectional momentum strategy. Every bar it ranks the
+    universe by the return over the lookback window and goes LONG the
+    top fraction of symbols with equal strength.
+    """
+
+    def __init__(self, bars, backtester, lookback=20, top=0.1):
+        """
+        Parameters:
+        bars - The DataHandler object that provides bar information
+        backtester - The Backtester object.
+        lookback - The number of bars of the momentum window.
+        top - The fraction of the universe to hold.
+        """
+        PanelStrategy.__init__(self, bars, backtester, lookback)
+        self.top = top
+
+
+    def calculate_panel(self, window):
+        close = window['close']
+        if len(close) < self.lookback:
+            return None
+        with np.errstate(invalid='ignore', divide='ignore'):
+            momentum = close[-1] / close[0] - 1.0
+        ranks = cross_sectional_rank(momentum)
+        return np.where(ranks >= 1.0 - self.top, 1.0, 0.0)
@@ -0,0 +1,37 @@
+#encoding=utf-8
+
+"""
+测试的公共设置: 把仓库根目录加入sys.path，并提供合成的bar数据。
+
+author: lvbj
+date: 2019-4-8
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_symbol_data(symbols, n_bars=200, freq='1min', seed=0):
+    """
+    生成已对齐的随机游走bar数据，dict, symbol -> DataFrame。
+    """
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2017-01-02', periods=n_bars, freq=freq)
+    data = {}
+    for s in symbols:
+        close = 100.0 * np.exp(np.cumsum(0.001 * rng.randn(n_bars)))
+        data[s] = pd.DataFrame({'datetime': index, 'open': close, 'high': close * 1.001,
+                                'low': close * 0.999, 'close': close,
+                                'volume': np.full(n_bars, 10.0)})
+    return data
+
+
+@pytest.fixture
+def symbol_data():
+    return make_symbol_data(['S0', 'S1', 'S2'])
@@ -0,0 +1,67 @@
+#encoding=utf-8
+
+import numpy as np
+import pytest
+
+from conftest import make_symbol_data
+from data import DataFrameDataHandler
+from event import FillEvent, SignalEvent, ib_commission
+from main import Backtester
+from portfolio import RiskSizedPortfolio
+from strategy import Strategy
+
+
+class RotatingStrategy(Strategy):
+    """
+    每period个bar轮换做多、做空和平仓的标的。
+    """
+
+    def __init__(self, bars, backtester, period=25):
+        self.bars = bars
+        self.backtester = backtester
+        self.period = period
+
+    def calculate_signals(self, event):
+        if self.bars.cursor % self.period != 0:
+            return
+        k = self.bars.cursor // self.period
+        for j, s in enumerate(self.bars.symbol_list):
+            signal_type = ('LONG', 'SHORT', 'EXIT')[(j + k) % 3]
+            self.backtester.send_event(SignalEvent(s, None, signal_type))
+
+
+def run(symbol_data, basket_orders):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: RotatingStrategy(bt.bars, bt),
+                        port=lambda bt: RiskSizedPortfolio(bt.bars, bt, start, halflife=20,
+                                                           basket_orders=basket_orders))
+    tester.run()
+    return tester.port
+
+
+def test_basket_orders_match_single_orders():
+    data = make_symbol_data(['S{}'.format(i) for i in range(5)], n_bars=500)
+    basket = run(data, True)
+    single = run(data, False)
+    assert len(basket.fill_ledger) == len(single.fill_ledger) > 20
+    assert np.array_equal(basket.equity_curve['total'].values,
+                          single.equity_curve['total'].values)
+    assert basket.current_positions == single.current_positions
+    for field in ('symbol_id', 'side', 'quantity', 'price', 'commission'):
+        assert np.array_equal(getattr(basket.fill_ledger, field),
+                              getattr(single.fill_ledger, field))
+
+
+@pytest.mark.parametrize('quantity', [1, 99, 100, 499, 500, 501, 999, 10000])
+@pytest.mark.parametrize('fill_cost', [0.01, 0.2, 2.6, 50.0])
+def test_ib_commission_matches_fill_event(quantity, fill_cost):
+    fill = FillEvent(None, 'S0', 'ARCA', quantity, 'BUY', fill_cost)
+    assert ib_commission([quantity], [fill_cost])[0] == fill.calculate_ib_commission()
+
+
+def test_ib_commission_bounds():
+    quantity = np.array([500, 501, 1000, 100, 10])
+    fill_cost = np.array([100.0, 100.0, 100.0, 0.1, 100.0])
+    expected = [6.5, 501 * 0.008, 8.0, 0.05, 1.3]
+    np.testing.assert_allclose(ib_commission(quantity, fill_cost), expected)
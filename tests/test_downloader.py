@@ -0,0 +1,139 @@
+#encoding=utf-8
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from data import HistoricCSVDataHandler
+from downloader import BAR_COLUMNS, BulkDownloader, DownloadError, RateLimiter, write_csv
+
+
+DAILY_CSV = (u"日期,股票代码,名称,收盘价,最高价,最低价,开盘价,成交量\n"
+             u"2018-01-04,'600000,浦发银行,12.8,12.9,12.6,12.7,1000\n"
+             u"2018-01-03,'600000,浦发银行,12.6,12.7,12.4,12.5,1200\n"
+             u"2018-01-02,'600000,浦发银行,0,0,0,0,0\n").encode('gbk')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    /bars/<ticker>返回日线数据，/flaky/<ticker>在前两次请求时返回503，
+    /missing/<ticker>返回404。每个请求的路径和时间记录在server.requests中。
+    """
+
+    def do_GET(self):
+        self.server.requests.append((self.path, time.monotonic()))
+        kind, ticker = self.path.strip('/').split('/')[:2]
+        if kind == 'missing':
+            self.send_response(404)
+            self.end_headers()
+            return
+        if kind == 'flaky' and sum(p == self.path for p, _ in self.server.requests) <= 2:
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(DAILY_CSV)))
+        self.end_headers()
+        self.wfile.write(DAILY_CSV)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def downloader(server, tmp_path, **kwargs):
+    url = "http://127.0.0.1:{}".format(server.server_address[1]) + "/{exchange_id}/{ticker}"
+    kwargs.setdefault('rate', None)
+    return BulkDownloader(data_dir=str(tmp_path / 'datas' / 'daily'), bars_url=url, **kwargs)
+
+
+def test_retries_503_with_backoff(server, tmp_path):
+    d = downloader(server, tmp_path, backoff=0.1)
+    report = d.download_bars([('600000', 'flaky')], '2018-01-01', '2018-01-31')
+    assert report == {'written': {'600000': 2}, 'failed': {}}
+    times = [t for _, t in server.requests]
+    assert len(times) == 3
+    # 两次重试之前分别等待0.1秒和0.2秒
+    assert times[1] - times[0] >= 0.1
+    assert times[2] - times[1] >= 0.2
+
+
+def test_gives_up_after_retries(server, tmp_path):
+    d = downloader(server, tmp_path, retries=1, backoff=0.0)
+    with pytest.raises(DownloadError, match="2 attempts"):
+        d.fetch(d.bars_url_for('600000', 'flaky', pd.Timestamp('2018-01-01'),
+                               pd.Timestamp('2018-01-31')))
+
+
+def test_404_fails_without_retry(server, tmp_path):
+    d = downloader(server, tmp_path, backoff=0.0)
+    report = d.download_bars([('600000', 'bars'), ('600001', 'missing')],
+                             '2018-01-01', '2018-01-31')
+    assert list(report['written']) == ['600000']
+    assert list(report['failed']) == ['600001']
+    assert "HTTP 404" in report['failed']['600001']
+    assert sum(p.startswith('/missing/') for p, _ in server.requests) == 1
+
+
+def test_rate_limiter_spaces_requests(server, tmp_path):
+    d = downloader(server, tmp_path, rate=20.0, max_workers=1)
+    d.download_bars([('60000{}'.format(i), 'bars') for i in range(6)],
+                    '2018-01-01', '2018-01-31')
+    times = sorted(t for _, t in server.requests)
+    assert len(times) == 6
+    # 令牌桶容量为1，第一个请求之后每0.05秒一个
+    assert times[-1] - times[0] >= 5 * 0.05 * 0.9
+
+    limiter = RateLimiter(50.0, burst=5)
+    start = time.monotonic()
+    for _ in range(10):
+        limiter.acquire()
+    assert time.monotonic() - start >= 5 / 50.0 * 0.9
+
+
+def test_download_bars_writes_handler_files(server, tmp_path):
+    d = downloader(server, tmp_path)
+    report = d.download_bars(pd.DataFrame({'ticker': ['600000'], 'exchange_id': ['bars']}),
+                             '2018-01-01', '2018-01-31')
+    assert report['written'] == {'600000': 2}
+    directory = tmp_path / 'datas' / 'daily'
+    assert os.listdir(str(directory)) == ['600000.csv']
+
+    df = pd.read_csv(str(directory / '600000.csv'))
+    assert list(df.columns) == BAR_COLUMNS
+    # 停牌日(价格为0)被删除，按日期升序
+    assert df['datetime'].tolist() == ['2018-01-03', '2018-01-04']
+
+    bars = HistoricCSVDataHandler(None, str(directory), ['600000'])
+    assert bars.panel['close'][:, 0].tolist() == [12.6, 12.8]
+    assert bars.panel['low'][:, 0].tolist() == [12.4, 12.6]
+    assert bars.panel['high'][:, 0].tolist() == [12.7, 12.9]
+
+
+def test_write_csv_keeps_the_old_file_on_error(tmp_path):
+    path = str(tmp_path / '600000.csv')
+    write_csv(pd.DataFrame({'a': [1]}), path)
+
+    class Broken(object):
+        def to_csv(self, f, index=False):
+            f.write('partial')
+            raise IOError("disk full")
+
+    with pytest.raises(IOError):
+        write_csv(Broken(), path)
+    assert open(path).read() == 'a\n1\n'
+    assert os.listdir(str(tmp_path)) == ['600000.csv']
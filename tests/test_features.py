@@ -0,0 +1,94 @@
+#encoding=utf-8
+
+import importlib
+import sys
+
+import numpy as np
+
+from conftest import make_symbol_data
+from data import DataFrameDataHandler
+from features import FEATURES, FeatureStore, _definition_digest
+
+
+class EventSink(object):
+    """
+    代替Backtester接收数据组件发出的事件。
+    """
+
+    def send_event(self, event):
+        pass
+
+
+def row_number(panel):
+    """
+    每个值等于它所在的行号，读取到的值必须小于游标。
+    """
+    x = panel['close']
+    return np.repeat(np.arange(len(x), dtype='float64')[:, None], x.shape[1], axis=1)
+
+
+def test_reads_are_point_in_time(symbol_data, tmp_path, monkeypatch):
+    monkeypatch.setitem(FEATURES, 'row', row_number)
+    bars = DataFrameDataHandler(EventSink(), symbol_data)
+    store = FeatureStore(str(tmp_path))
+    store.attach(bars, 'row', 'row')
+    store.attach(bars, 'sma5', 'sma', window=5)
+
+    while True:
+        bars.update_bars()
+        if not bars.continue_backtest:
+            break
+        cursor = bars.cursor
+        for s in bars.symbol_list:
+            rows = bars.get_latest_feature(s, 'row', N=10)
+            assert len(rows) == min(10, cursor)
+            assert rows[-1] == cursor - 1
+        panel = bars.get_latest_panel(N=10, fields=['close', 'row', 'sma5'])
+        assert (panel['row'] < cursor).all() and panel['row'][-1, 0] == cursor - 1
+        np.testing.assert_array_equal(panel['close'][-1], bars.get_latest_prices())
+        np.testing.assert_array_equal(panel['sma5'], bars.features['sma5'][max(cursor - 10, 0):cursor])
+
+
+def test_second_attach_is_a_cache_hit(tmp_path):
+    data = make_symbol_data(['S0', 'S1', 'S2'])
+    first = FeatureStore(str(tmp_path))
+    expected = first.attach(DataFrameDataHandler(None, data), 'vol', 'volatility', window=10)
+    assert (first.hits, first.misses) == (0, 3)
+
+    store = FeatureStore(str(tmp_path))
+    values = store.attach(DataFrameDataHandler(None, data), 'vol', 'volatility', window=10)
+    assert (store.hits, store.misses) == (3, 0)
+    np.testing.assert_array_equal(values, expected)
+
+    # 只有数据改变的标的重新计算
+    changed = dict(data)
+    changed['S1'] = data['S1'].copy()
+    changed['S1']['close'] *= 1.01
+    store = FeatureStore(str(tmp_path))
+    values = store.attach(DataFrameDataHandler(None, changed), 'vol', 'volatility', window=10)
+    assert (store.hits, store.misses) == (2, 1)
+    np.testing.assert_array_equal(values[:, [0, 2]], expected[:, [0, 2]])
+
+
+FEATURE_MODULE = '''
+def helper(x):
+    return x * {scale}
+
+
+def feature(panel):
+    return helper(panel['close'])
+'''
+
+
+def test_definition_digest_follows_called_functions(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    digests = []
+    for i, scale in enumerate([1.0, 2.0]):
+        name = 'feature_module_{}'.format(i)
+        (tmp_path / (name + '.py')).write_text(FEATURE_MODULE.format(scale=scale))
+        try:
+            digests.append(_definition_digest(importlib.import_module(name).feature))
+        finally:
+            sys.modules.pop(name, None)
+    # feature的源代码相同，它调用的helper不同
+    assert digests[0] != digests[1]
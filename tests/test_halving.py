@@ -0,0 +1,45 @@
+#encoding=utf-8
+
+import pytest
+
+from conftest import make_symbol_data
+from data import DataFrameDataHandler
+from halving import SuccessiveHalvingOptimizer, halving_schedule
+from main import Backtester
+from portfolio import NaivePortfolio
+from resultsink import ResultSink
+from strategy import MomentumRankStrategy
+from walkforward import total_return
+
+
+GRID = {'lookback': [5, 10, 20, 40], 'top': [0.2, 0.4]}
+
+
+def full_run(symbol_data, params):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: MomentumRankStrategy(bt.bars, bt, **params),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start))
+    tester.run()
+    return total_return(tester.port.equity_curve)
+
+
+def test_halving_schedule():
+    assert halving_schedule(800, 8) == [(100, 8), (200, 4), (400, 2), (800, 1)]
+    assert halving_schedule(800, 8, min_bars=150) == [(200, 8), (400, 4), (800, 2)]
+
+
+def test_survivor_resumes_to_the_full_run_score():
+    symbol_data = make_symbol_data(['S%d' % i for i in range(10)], n_bars=400, seed=3)
+    opt = SuccessiveHalvingOptimizer(symbol_data, MomentumRankStrategy, GRID, min_bars=50)
+    best = opt.run()
+    assert opt.best_score == pytest.approx(full_run(symbol_data, best), abs=1e-12)
+    assert opt.compute_fraction < 0.6
+    assert len(opt.history) == sum(n for _, n in opt.schedule)
+
+
+def test_result_sink_is_rejected(tmp_path):
+    symbol_data = make_symbol_data(['S0', 'S1'], n_bars=50)
+    with pytest.raises(ValueError):
+        SuccessiveHalvingOptimizer(symbol_data, MomentumRankStrategy, GRID, portfolio_kwargs={
+            'result_sink': ResultSink(str(tmp_path / 'result'), ['S0', 'S1'])})
@@ -0,0 +1,31 @@
+#encoding=utf-8
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ('numpy', 'pandas', 'requests')
+
+
+def loaded_modules(statement):
+    """
+    在新的进程中执行import语句，返回已载入的重型依赖。
+    """
+    code = ("import sys; {}; "
+            "print(','.join(m for m in {!r} if m in sys.modules))").format(statement, HEAVY)
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return [m for m in out.decode('utf-8').strip().split(',') if m]
+
+
+@pytest.mark.parametrize('statement', ['import main', 'import event, execution'])
+def test_import_does_not_load_heavy_dependencies(statement):
+    assert loaded_modules(statement) == []
+
+
+def test_check_sees_loaded_modules():
+    assert loaded_modules('import pandas') == ['numpy', 'pandas']
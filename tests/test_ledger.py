@@ -0,0 +1,44 @@
+#encoding=utf-8
+
+import numpy as np
+
+from data import DataFrameDataHandler
+from ledger import FillLedger, round_trips, trade_stats
+from main import Backtester
+from portfolio import NaivePortfolio
+from strategy import BuyAndHoldStrategy
+
+
+def test_round_trips_only_opening_fills():
+    ledger = FillLedger(['A', 'B'])
+    ledger.append(0, 1, 1, 100.0, 10.0, 1.0)
+    ledger.append(1, 2, -1, 50.0, 20.0, 1.0)
+    trips = round_trips(ledger)
+    assert all(len(v) == 0 for v in trips.values())
+    stats = trade_stats(ledger)
+    assert stats['trades'] == 0
+    assert stats['pnl_by_symbol'] == {'A': 0.0, 'B': 0.0}
+
+
+def test_round_trips_empty_ledger():
+    assert trade_stats(FillLedger(['A']))['trades'] == 0
+
+
+def test_round_trips_fifo():
+    ledger = FillLedger(['A'])
+    ledger.append(0, 1, 1, 100.0, 10.0, 0.0)
+    ledger.append(0, 2, 1, 100.0, 12.0, 0.0)
+    ledger.append(0, 3, -1, 150.0, 15.0, 0.0)
+    trips = round_trips(ledger)
+    np.testing.assert_allclose(trips['quantity'], [100.0, 50.0])
+    np.testing.assert_allclose(trips['pnl'], [500.0, 150.0])
+
+
+def test_buy_and_hold_trade_stats(symbol_data):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: BuyAndHoldStrategy(bt.bars, bt),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start))
+    tester.run()
+    assert len(tester.port.fill_ledger) == 3
+    assert trade_stats(tester.port.fill_ledger)['trades'] == 0
@@ -0,0 +1,89 @@
+#encoding=utf-8
+
+import warnings
+
+import numpy as np
+import pytest
+
+from data import DataFrameDataHandler
+from main import Backtester
+from memory import SUBSYSTEMS, MemoryBudgetExceeded, MemoryBudgetWarning, MemoryMonitor
+from portfolio import NaivePortfolio
+from strategy import BuyAndHoldStrategy
+
+
+def run(symbol_data, monitor):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: BuyAndHoldStrategy(bt.bars, bt),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start),
+                        memory_monitor=monitor)
+    tester.run()
+    return monitor
+
+
+def final_holdings(symbol_data):
+    return run(symbol_data, MemoryMonitor(interval=20)).samples[-1]['all_holdings']
+
+
+def test_peaks_are_monotonic(symbol_data):
+    monitor = run(symbol_data, MemoryMonitor(interval=20))
+    assert len(monitor.samples) == 11
+    assert monitor.samples[-1]['cursor'] == 200
+
+    # 持仓记录只增不减
+    holdings = [s['all_holdings'] for s in monitor.samples]
+    assert np.all(np.diff(holdings) >= 0) and holdings[-1] > holdings[0]
+
+    report = monitor.report().set_index('subsystem')
+    for name in SUBSYSTEMS + ['total']:
+        values = [s[name] for s in monitor.samples if s[name] is not None]
+        if not values:
+            continue
+        peak, cursor = monitor.peaks[name]
+        assert peak == max(values) == report.loc[name, 'peak']
+        # 峰值是第一次达到最大值时的bar
+        assert cursor == next(s['cursor'] for s in monitor.samples if s[name] == peak)
+        running = np.maximum.accumulate(values)
+        assert np.all(np.diff(running) >= 0)
+
+
+def test_warn_once_per_subsystem(symbol_data):
+    monitor = MemoryMonitor(interval=20, budgets={'all_holdings': 1, 'total': 1},
+                            action='warn')
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        run(symbol_data, monitor)
+    messages = [str(w.message) for w in caught if issubclass(w.category, MemoryBudgetWarning)]
+    assert sorted(m.split()[0] for m in messages) == ['all_holdings', 'total']
+    # 回测仍然运行到最后
+    assert monitor.samples[-1]['cursor'] == 200
+
+
+def test_raise_when_over_budget(symbol_data):
+    budget = int(final_holdings(symbol_data) * 0.7)
+    monitor = MemoryMonitor(interval=20, budgets={'all_holdings': budget},
+                            action='raise', project=False)
+    with pytest.raises(MemoryBudgetExceeded, match="over its budget") as info:
+        run(symbol_data, monitor)
+    assert 'projected' not in str(info.value)
+    assert monitor.samples[-1]['all_holdings'] > budget
+    assert all(s['all_holdings'] <= budget for s in monitor.samples[:-1])
+    assert monitor.samples[-1]['cursor'] < 200
+
+
+def test_raise_on_projected_budget(symbol_data):
+    budget = int(final_holdings(symbol_data) * 0.9)
+    monitor = MemoryMonitor(interval=20, budgets={'all_holdings': budget}, action='raise')
+    with pytest.raises(MemoryBudgetExceeded, match="projected"):
+        run(symbol_data, monitor)
+    # 在真正超过预算之前停止
+    assert monitor.samples[-1]['all_holdings'] <= budget
+    assert monitor.samples[-1]['cursor'] < 200
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        MemoryMonitor(action='ignore')
+    with pytest.raises(ValueError, match="Unknown subsystem"):
+        MemoryMonitor(budgets={'heap': 1})
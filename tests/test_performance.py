@@ -0,0 +1,87 @@
+#encoding=utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import DataFrameDataHandler
+from main import Backtester
+from performance import (align_benchmark, create_benchmark_stats,
+                         create_rolling_benchmark_stats)
+from portfolio import NaivePortfolio, add_benchmark
+from strategy import BuyAndHoldStrategy
+
+
+def random_returns(n=1000, seed=0):
+    rng = np.random.RandomState(seed)
+    index = pd.date_range('2017-01-02', periods=n, freq='1D')
+    b = pd.Series(0.01 * rng.randn(n) + 0.0003, index=index)
+    r = pd.Series(0.8 * b.values + 0.005 * rng.randn(n) + 0.0002, index=index)
+    return r, b
+
+
+def test_rolling_benchmark_stats_match_pandas():
+    r, b = random_returns()
+    w = 250
+    stats = create_rolling_benchmark_stats(r, b, w)
+
+    beta = r.rolling(w).cov(b) / b.rolling(w).var()
+    alpha = (r.rolling(w).mean() - beta * b.rolling(w).mean()) * 252
+    active = r - b
+    te = active.rolling(w).std() * np.sqrt(252)
+    ir = np.sqrt(252) * active.rolling(w).mean() / active.rolling(w).std()
+
+    assert stats['beta'].isnull().sum() == w - 1
+    np.testing.assert_allclose(stats['beta'], beta, rtol=1e-9)
+    np.testing.assert_allclose(stats['alpha'], alpha, rtol=1e-7)
+    np.testing.assert_allclose(stats['tracking_error'], te, rtol=1e-9)
+    np.testing.assert_allclose(stats['information_ratio'], ir, rtol=1e-7)
+
+
+def test_benchmark_stats_match_pandas():
+    r, b = random_returns(500, seed=1)
+    r.iloc[10] = np.nan
+    alpha, beta, te, ir = create_benchmark_stats(r, b)
+    valid = r.notnull()
+    r, b = r[valid], b[valid]
+    assert beta == pytest.approx(r.cov(b) / b.var(), rel=1e-10)
+    assert alpha == pytest.approx((r.mean() - beta * b.mean()) * 252, rel=1e-9)
+    assert te == pytest.approx((r - b).std() * np.sqrt(252), rel=1e-10)
+    assert ir == pytest.approx(np.sqrt(252) * (r - b).mean() / (r - b).std(), rel=1e-9)
+
+
+def test_align_benchmark_forward_fills_gaps():
+    index = pd.date_range('2019-04-01 09:30', periods=8, freq='1min')
+    prices = pd.Series([10.0, 11.0, 12.0, 13.0, 14.0, 15.0, 16.0, 17.0], index=index)
+    # 基准在09:33和09:34没有数据，09:35的数据重复
+    benchmark = prices.drop(index[[3, 4]])
+    benchmark = pd.concat([benchmark, pd.Series([99.0], index=[index[5]])])
+    returns = align_benchmark(index, benchmark)
+    assert np.isnan(returns.iloc[0])
+    np.testing.assert_allclose(returns.values[1:],
+                               [0.1, 1.0 / 11.0, 0.0, 0.0, 99.0 / 12.0 - 1.0,
+                                16.0 / 99.0 - 1.0, 1.0 / 16.0])
+
+    curve = add_benchmark(pd.DataFrame({'total': np.ones(8)}, index=index), benchmark)
+    np.testing.assert_allclose(curve['benchmark_curve'].values,
+                               [1.0, 1.1, 1.2, 1.2, 1.2, 9.9, 1.6, 1.7])
+
+
+def test_portfolio_reports_benchmark_stats(symbol_data):
+    start = symbol_data['S0']['datetime'].iloc[0]
+
+    def bars(bt):
+        handler = DataFrameDataHandler(bt, symbol_data)
+        handler.benchmark_symbol = 'S1'
+        return handler
+
+    tester = Backtester(bars=bars, strategy=lambda bt: BuyAndHoldStrategy(bt.bars, bt),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start))
+    stats = dict(tester.run())
+    assert 'Beta' in stats and 'Information Ratio' in stats
+
+    curve = tester.port.equity_curve
+    rolling = tester.port.rolling_benchmark_stats(50)
+    expected = create_rolling_benchmark_stats(curve['returns'], curve['benchmark_returns'], 50)
+    pd.testing.assert_frame_equal(rolling, expected)
+    assert rolling['beta'].iloc[49:].notnull().all()
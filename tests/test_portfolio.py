@@ -0,0 +1,102 @@
+#encoding=utf-8
+
+import numpy as np
+
+from data import DataFrameDataHandler
+from event import BasketOrderEvent, SignalEvent
+from main import Backtester
+from portfolio import NaivePortfolio, SparsePortfolio
+from resultsink import ResultSink
+from strategy import Strategy
+
+
+class ToggleStrategy(Strategy):
+    """
+    每period个bar在做多和平仓之间切换第一个标的。
+    """
+
+    def __init__(self, bars, backtester, period=20):
+        self.bars = bars
+        self.backtester = backtester
+        self.period = period
+        self.long = False
+
+    def calculate_signals(self, event):
+        if self.bars.cursor % self.period == 0:
+            self.long = not self.long
+            self.backtester.send_event(SignalEvent(self.bars.symbol_list[0], None,
+                                                   'LONG' if self.long else 'EXIT'))
+
+
+def run(symbol_data, portfolio_cls, result_sink=None):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: ToggleStrategy(bt.bars, bt),
+                        port=lambda bt: portfolio_cls(bt.bars, bt, start,
+                                                      result_sink=result_sink))
+    tester.run()
+    return tester.port
+
+
+def test_sparse_portfolio_matches_naive(symbol_data):
+    naive = run(symbol_data, NaivePortfolio).equity_curve
+    sparse = run(symbol_data, SparsePortfolio).equity_curve
+    np.testing.assert_allclose(sparse['total'].values, naive['total'].values, rtol=1e-12)
+    np.testing.assert_allclose(sparse['S0'].values, naive['S0'].values, rtol=1e-12)
+
+
+def test_sparse_portfolio_with_result_sink(symbol_data, tmp_path):
+    sink = ResultSink(str(tmp_path / 'result'), list(symbol_data.keys()))
+    port = run(symbol_data, SparsePortfolio, sink)
+    naive = run(symbol_data, NaivePortfolio).equity_curve
+    np.testing.assert_allclose(port.equity_curve['total'].values, naive['total'].values,
+                               rtol=1e-12)
+    positions = sink.read_positions()
+    assert set(positions['S1']) == {0}
+    assert port.all_holdings == []
+
+
+def test_naive_portfolio_skips_zero_quantity_entries(symbol_data):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start))
+    port = tester.port
+    assert port.generate_naive_order(SignalEvent('S0', None, 'LONG', 0.005)) is None
+    assert port.generate_naive_order(SignalEvent('S0', None, 'SHORT', 0.0)) is None
+    assert port.generate_naive_order(SignalEvent('S0', None, 'LONG', 0.5)).quantity == 50
+
+
+class BasketStrategy(Strategy):
+    """
+    在第10个bar以一个篮子买入S1、卖空S2，在第30个bar卖出全部的S1、买回一半的S2。
+    """
+
+    def __init__(self, bars, backtester):
+        self.bars = bars
+        self.backtester = backtester
+
+    def calculate_signals(self, event):
+        if self.bars.cursor == 10:
+            self.backtester.send_event(BasketOrderEvent(['S1', 'S2'], 'MKT', [100, 50], [1, -1]))
+        elif self.bars.cursor == 30:
+            self.backtester.send_event(BasketOrderEvent(['S1', 'S2'], 'MKT', [100, 25], [-1, 1]))
+
+
+def test_sparse_portfolio_basket_fills_match_naive(symbol_data):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    ports = []
+    for portfolio_cls in (NaivePortfolio, SparsePortfolio):
+        tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                            strategy=lambda bt: BasketStrategy(bt.bars, bt),
+                            port=lambda bt: portfolio_cls(bt.bars, bt, start))
+        tester.run()
+        ports.append(tester.port)
+    naive, sparse = ports
+
+    for column in ('total', 'cash', 'commission', 'S1', 'S2'):
+        np.testing.assert_array_equal(sparse.equity_curve[column].values,
+                                      naive.equity_curve[column].values)
+    assert (sparse.equity_curve['S1'].iloc[12:31] != 0).all()
+    assert sparse.current_positions == {'S2': -25}
+    assert 'S1' not in sparse.current_holdings
+    assert sparse.current_holdings['S2'] == naive.current_holdings['S2']
@@ -0,0 +1,44 @@
+#encoding=utf-8
+
+import numpy as np
+
+from data import DataFrameDataHandler
+from main import Backtester
+from portfolio import NaivePortfolio, RiskSizedPortfolio
+from resultcache import ResultCache
+from strategy import BuyAndHoldStrategy
+
+
+class WeightedBuyAndHold(BuyAndHoldStrategy):
+    """
+    以数组参数配置的策略，数组的内容是缓存键的一部分。
+    """
+
+    def __init__(self, bars, backtester, weights):
+        BuyAndHoldStrategy.__init__(self, bars, backtester)
+        self.weights = np.asarray(weights, dtype='float64')
+
+
+def run(symbol_data, cache, weights, portfolio_cls=NaivePortfolio):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: WeightedBuyAndHold(bt.bars, bt, weights),
+                        port=lambda bt: portfolio_cls(bt.bars, bt, start),
+                        result_cache=cache)
+    return tester.run()
+
+
+def test_array_parameters_are_part_of_the_key(symbol_data, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    run(symbol_data, cache, [0.5, 0.3, 0.2])
+    run(symbol_data, cache, [0.5, 0.3, 0.2])
+    assert (cache.hits, cache.misses) == (1, 1)
+    run(symbol_data, cache, [0.5, 0.2, 0.3])
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_fresh_portfolios_have_stable_keys(symbol_data, tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    for _ in range(2):
+        run(symbol_data, cache, [1.0], RiskSizedPortfolio)
+    assert cache.hits == 1
@@ -0,0 +1,59 @@
+#encoding=utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from risk import EWCovariance, min_variance_weights, volatility_target_weights
+
+
+def random_cov(n, seed):
+    rng = np.random.RandomState(seed)
+    a = rng.randn(n, n) * 0.01
+    return a.dot(a.T) + np.eye(n) * 1e-5
+
+
+def test_ew_covariance_matches_pandas():
+    rng = np.random.RandomState(0)
+    returns = rng.randn(300, 4) * 0.01
+    returns[50, 2] = np.nan
+    cov = EWCovariance(4, halflife=20)
+
+    # 递推从均值和协方差为0开始，相当于在第一个收益率之前有一个全为0的观测
+    observed = np.vstack([np.zeros(4), np.nan_to_num(returns)])
+    expected = pd.DataFrame(observed).ewm(halflife=20, adjust=False).cov(bias=True)
+    means = pd.DataFrame(observed).ewm(halflife=20, adjust=False).mean().values
+    for t, r in enumerate(returns, 1):
+        cov.update(r)
+        np.testing.assert_allclose(cov.cov, expected.loc[t].values, rtol=1e-10, atol=1e-18)
+        np.testing.assert_allclose(cov.mean, means[t], rtol=1e-10, atol=1e-18)
+        assert cov.ready == (t >= 20)
+    np.testing.assert_allclose(cov.volatility(), np.sqrt(np.diag(expected.loc[300].values)))
+
+
+@pytest.mark.parametrize('weights_fn', [volatility_target_weights, min_variance_weights])
+@pytest.mark.parametrize('seed', range(5))
+def test_weights_respect_leverage_and_signs(weights_fn, seed):
+    n = 8
+    cov = random_cov(n, seed)
+    rng = np.random.RandomState(100 + seed)
+    signals = rng.choice([-1.0, 0.0, 1.0], n)
+    signals[0] = 1.0
+
+    # 目标波动率很高时由杠杆上限约束
+    w = weights_fn(signals, cov, target_vol=1.0, max_leverage=0.5)
+    assert np.abs(w).sum() == pytest.approx(0.5)
+    assert (w[signals == 0] == 0).all()
+    assert (np.sign(w[w != 0]) == signals[w != 0]).all()
+
+    # 杠杆上限足够大时组合波动率等于目标
+    w = weights_fn(signals, cov, target_vol=0.001, max_leverage=100.0)
+    assert np.sqrt(w.dot(cov).dot(w)) == pytest.approx(0.001)
+    assert np.abs(w).sum() <= 100.0
+    assert (np.sign(w[w != 0]) == signals[w != 0]).all()
+
+
+def test_weights_without_signals_are_zero():
+    cov = random_cov(3, 0)
+    for weights_fn in (volatility_target_weights, min_variance_weights):
+        assert (weights_fn(np.zeros(3), cov, 0.01) == 0).all()
@@ -0,0 +1,66 @@
+#encoding=utf-8
+
+import numpy as np
+import pytest
+
+from ledger import FillLedger
+from performance import create_sharpe_ratio
+from robustness import (MAX_CUM, MIN_CUM, INTRA_DD, SUM, SUM_LOG, SUM_SQ, _block_stats,
+                        monte_carlo, output_robustness_stats, shuffle_trades)
+
+
+def random_returns(n, seed=0):
+    return 0.01 * np.random.RandomState(seed).randn(n)
+
+
+@pytest.mark.parametrize('length', [1, 2, 5, 37])
+def test_block_stats_match_brute_force(length):
+    r = random_returns(37)
+    starts = np.arange(len(r))
+    stats = _block_stats(r, starts, length, max_chunk_elements=16)
+    for s in starts:
+        block = np.array([r[(s + k) % len(r)] for k in range(length)])
+        cum = np.cumsum(np.log1p(block))
+        drawdown = max(max(cum[:k + 1]) - cum[k] for k in range(length))
+        np.testing.assert_allclose(stats[s, [SUM, SUM_SQ, SUM_LOG]],
+                                   [block.sum(), (block ** 2).sum(), np.log1p(block).sum()],
+                                   rtol=1e-12, atol=1e-15)
+        np.testing.assert_allclose(stats[s, [MAX_CUM, MIN_CUM, INTRA_DD]],
+                                   [cum.max(), cum.min(), drawdown], rtol=1e-12, atol=1e-15)
+
+
+@pytest.mark.parametrize('block_size', [1, 4, 7])
+def test_shuffle_keeps_the_total_return(block_size):
+    r = random_returns(50, seed=1)
+    dist = monte_carlo(r, n_paths=200, method='shuffle', block_size=block_size, seed=0)
+    np.testing.assert_allclose(dist['total_return'], np.prod(1.0 + r) - 1.0, rtol=1e-10)
+    assert dist['max_drawdown'].nunique() > 1
+    assert (dist['max_drawdown'] >= 0).all()
+
+
+def test_single_block_path_matches_the_backtest_statistics():
+    r = random_returns(60, seed=2)
+    dist = monte_carlo(r, n_paths=3, method='shuffle', block_size=60, seed=0)
+    equity = np.r_[1.0, np.cumprod(1.0 + r)]
+    peak = np.maximum.accumulate(equity)
+    np.testing.assert_allclose(dist['sharpe'], create_sharpe_ratio(r), rtol=1e-10)
+    np.testing.assert_allclose(dist['max_drawdown'], ((peak - equity) / peak).max(), rtol=1e-10)
+
+
+def test_shuffle_trades():
+    ledger = FillLedger(['A'])
+    # 一笔亏损10，一笔盈利10(不计手续费)
+    ledger.append(0, 1, 1, 1, 100.0, 0.0)
+    ledger.append(0, 2, -1, 1, 90.0, 0.0)
+    ledger.append(0, 3, 1, 1, 100.0, 0.0)
+    ledger.append(0, 4, -1, 1, 110.0, 0.0)
+    dist = shuffle_trades(ledger, 1000.0, n_paths=200, seed=0)
+    assert (dist['total_return'] == 0.0).all()
+    assert set(np.round(dist['max_drawdown'], 12)) == {round(10.0 / 1000.0, 12),
+                                                       round(10.0 / 1010.0, 12)}
+
+    stats = dict(output_robustness_stats(dist))
+    assert "Max Drawdown 50%" in stats and "Sharpe Ratio 50%" not in stats
+
+    with pytest.raises(ValueError):
+        shuffle_trades(FillLedger(['A']), 1000.0)
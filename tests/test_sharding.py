@@ -0,0 +1,63 @@
+#encoding=utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_symbol_data
+from data import DataFrameDataHandler
+from event import SignalEvent
+from main import Backtester
+from portfolio import NaivePortfolio
+from sharding import ShardedBacktester, partition_symbols
+from strategy import Strategy
+
+
+class ToggleEachStrategy(Strategy):
+    """
+    每个标的以自己的周期在做多和平仓之间切换，只依赖标的自己的数据。
+    """
+
+    def __init__(self, bars, backtester):
+        self.bars = bars
+        self.backtester = backtester
+        self.long = dict((s, False) for s in bars.symbol_list)
+
+    def calculate_signals(self, event):
+        for s in self.bars.symbol_list:
+            # 周期由标的代码决定，与标的所在的分片无关
+            period = 7 + 3 * int(s[1:])
+            if self.bars.cursor % period == 0:
+                self.long[s] = not self.long[s]
+                self.backtester.send_event(SignalEvent(s, None,
+                                                       'LONG' if self.long[s] else 'EXIT'))
+
+
+def single_process(symbol_data):
+    start = pd.Timestamp(symbol_data['S0']['datetime'].values[0])
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: ToggleEachStrategy(bt.bars, bt),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start))
+    tester.run()
+    return tester.port
+
+
+def test_partition_symbols():
+    shards = partition_symbols(['S{}'.format(i) for i in range(7)], 3)
+    assert [len(s) for s in shards] == [3, 2, 2]
+    assert sum(shards, []) == ['S{}'.format(i) for i in range(7)]
+    assert partition_symbols(['S0', 'S1'], 5) == [['S0'], ['S1']]
+
+
+@pytest.mark.parametrize('n_symbols, n_shards', [(7, 3), (6, 2)])
+def test_merged_shards_equal_single_process(n_symbols, n_shards):
+    data = make_symbol_data(['S{}'.format(i) for i in range(n_symbols)], n_bars=300)
+    port = single_process(data)
+    assert len(port.fill_ledger) > 50
+
+    sharded = ShardedBacktester(data, ToggleEachStrategy, n_shards=n_shards)
+    sharded.run()
+    expected = port.equity_curve
+    merged = sharded.equity_curve
+    for column in ['cash', 'commission', 'total'] + list(data):
+        assert np.array_equal(merged[column].values, expected[column].values), column
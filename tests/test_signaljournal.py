@@ -0,0 +1,58 @@
+#encoding=utf-8
+
+import numpy as np
+import pytest
+
+from conftest import make_symbol_data
+from data import DataFrameDataHandler
+from main import Backtester
+from portfolio import NaivePortfolio
+from signaljournal import JournalReplayStrategy, SignalJournal, read_journal
+from strategy import MomentumRankStrategy
+
+
+def run(symbol_data, strategy, journal=None):
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=strategy,
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start),
+                        signal_journal=journal)
+    tester.run()
+    return tester.port
+
+
+def test_replay_reproduces_equity_curve(tmp_path):
+    path = str(tmp_path / 'signals.bin')
+    data = make_symbol_data(['S{}'.format(i) for i in range(5)], n_bars=300)
+    journal = SignalJournal(path, batch_size=16)
+    recorded = run(data, lambda bt: MomentumRankStrategy(bt.bars, bt, lookback=10, top=0.4),
+                   journal)
+
+    header, records = read_journal(path)
+    assert header['symbol_list'] == ['S{}'.format(i) for i in range(5)]
+    assert len(records) == journal.count > 16
+    assert len(recorded.fill_ledger) > 20
+
+    replayed = run(data, lambda bt: JournalReplayStrategy(bt.bars, bt, path))
+    assert len(replayed.fill_ledger) == len(recorded.fill_ledger)
+    for column in ['cash', 'commission', 'total']:
+        assert np.array_equal(replayed.equity_curve[column].values,
+                              recorded.equity_curve[column].values), column
+
+
+def test_replay_refuses_different_data(tmp_path):
+    path = str(tmp_path / 'signals.bin')
+    data = make_symbol_data(['S0', 'S1', 'S2'], n_bars=100)
+    run(data, lambda bt: MomentumRankStrategy(bt.bars, bt, lookback=10, top=0.4),
+        SignalJournal(path))
+
+    changed = dict((s, df.copy()) for s, df in data.items())
+    changed['S1'].loc[50, 'close'] += 0.01
+    with pytest.raises(ValueError, match="differs from the data"):
+        run(changed, lambda bt: JournalReplayStrategy(bt.bars, bt, path))
+    # 不检查数据时仍然可以回放
+    run(changed, lambda bt: JournalReplayStrategy(bt.bars, bt, path, check_data=False))
+
+    with pytest.raises(ValueError, match="recorded for symbols"):
+        run(make_symbol_data(['S0', 'S1'], n_bars=100),
+            lambda bt: JournalReplayStrategy(bt.bars, bt, path))
@@ -0,0 +1,42 @@
+#encoding=utf-8
+
+import numpy as np
+import pandas as pd
+
+from tickarchive import TickArchive
+
+
+def write_csv(path, timestamps, prices):
+    pd.DataFrame({'timestamp': timestamps, 'price': prices,
+                  'volume': np.ones(len(timestamps))}).to_csv(path, index=False)
+
+
+def test_ingest_round_trip(tmp_path):
+    archive = TickArchive(str(tmp_path / 'ticks'))
+    ts = 1483228800 + np.arange(0, 3 * 86400, 600)
+    prices = np.round(1000.0 + np.arange(len(ts)) * 0.01, 2)
+    write_csv(str(tmp_path / 'a.csv'), ts, prices)
+    assert archive.ingest_csv('A', str(tmp_path / 'a.csv'), chunksize=100) == len(ts)
+    time, price, volume = archive.read('A')
+    np.testing.assert_array_equal(time, ts * 10**9)
+    np.testing.assert_array_equal(price, prices)
+    assert len(archive.days('A')) == 3
+
+
+def test_reingest_keeps_ticks_with_the_last_timestamp(tmp_path):
+    archive = TickArchive(str(tmp_path / 'ticks'))
+    csv = str(tmp_path / 'a.csv')
+    ts = [1483228800, 1483228801, 1483228801, 1483228801, 1483228802]
+    prices = [1.0, 2.0, 3.0, 4.0, 5.0]
+
+    # 存档在第一个...01的tick处结束，之后csv又增长了
+    write_csv(csv, ts[:2], prices[:2])
+    assert archive.ingest_csv('A', csv) == 2
+    assert archive.last_time_count('A') == (ts[1] * 10**9, 1)
+    write_csv(csv, ts, prices)
+    assert archive.ingest_csv('A', csv, chunksize=2) == 3
+    assert archive.ingest_csv('A', csv) == 0
+
+    time, price, _ = archive.read('A')
+    np.testing.assert_array_equal(time, np.array(ts) * 10**9)
+    np.testing.assert_array_equal(price, prices)
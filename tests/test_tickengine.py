@@ -0,0 +1,36 @@
+#encoding=utf-8
+
+import numpy as np
+
+from portfolio import NaivePortfolio
+from tickengine import TickBacktester, TickDataHandler, TickStrategy
+
+
+class CursorCheckStrategy(TickStrategy):
+    """
+    记录on_tick中看到的游标和最新的tick。
+    """
+
+    def __init__(self, bars, backtester):
+        self.bars = bars
+        self.backtester = backtester
+        self.seen = []
+
+    def on_tick(self, symbol_id, time, price, volume):
+        symbol = self.bars.symbol_list[symbol_id]
+        self.seen.append((self.bars.cursor, self.bars.get_latest_tick(symbol)[1] == price))
+
+
+def test_cursor_follows_the_tick_stream():
+    ns = 10**9
+    ticks = {'A': (np.arange(0, 50, 2) * ns, np.arange(25, dtype='float64') + 1.0, np.ones(25)),
+             'B': (np.arange(1, 50, 2) * ns, np.arange(25, dtype='float64') + 100.0, np.ones(25))}
+    bars = TickDataHandler(None, ticks)
+    tester = TickBacktester(bars, lambda bt: CursorCheckStrategy(bt.bars, bt),
+                            lambda bt: NaivePortfolio(bt.bars, bt, 0),
+                            mark_every=7, chunk_size=4)
+    tester.run()
+    seen = tester.strategy.seen
+    assert [c for c, _ in seen] == list(range(1, 51))
+    assert all(ok for _, ok in seen)
+    assert bars.cursor == 50
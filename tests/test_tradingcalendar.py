@@ -0,0 +1,129 @@
+#encoding=utf-8
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import DataFrameDataHandler, MissingBarWarning
+from event import SignalEvent
+from main import Backtester
+from portfolio import NaivePortfolio
+from strategy import Strategy
+from tradingcalendar import CHINA_A, CRYPTO, OffSessionBarWarning
+
+
+def minute_bars(index):
+    close = np.arange(1.0, len(index) + 1.0)
+    return pd.DataFrame({'datetime': index, 'open': close, 'high': close, 'low': close,
+                         'close': close, 'volume': np.ones(len(index))})
+
+
+def session_minutes(day):
+    return (pd.date_range(day + ' 09:30', day + ' 11:29', freq='1min')
+            .append(pd.date_range(day + ' 13:00', day + ' 14:59', freq='1min')))
+
+
+def test_default_fill_does_not_cross_the_weekend():
+    # 2019-03-29是星期五，2019-04-01是星期一，星期一缺少09:30-09:33
+    index = session_minutes('2019-03-29').append(session_minutes('2019-04-01')[4:])
+    data = {'A': minute_bars(index), 'B': minute_bars(session_minutes('2019-03-29').append(
+        session_minutes('2019-04-01')))}
+    aligned = CHINA_A.align(data)
+    a = aligned['A'].set_index('datetime')
+    monday = a.loc['2019-04-01 09:30':'2019-04-01 09:33']
+    assert len(monday) == 4 and monday['close'].isnull().all()
+    assert a.loc['2019-04-01 09:34', 'close'] == 241.0
+
+    padded = CHINA_A.align(data, fill='pad')['A'].set_index('datetime')
+    assert (padded.loc['2019-04-01 09:30':'2019-04-01 09:33', 'close'] == 240.0).all()
+
+
+def test_end_labelled_bars():
+    index = session_minutes('2019-04-01') + pd.Timedelta('1min')
+    data = {'A': minute_bars(index)}
+    with pytest.warns(OffSessionBarWarning, match="2 bars"):
+        assert len(CHINA_A.align(data)['A']) == 239
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        aligned = CHINA_A.align(data, label='end')['A']
+    assert len(aligned) == 240
+    assert aligned['datetime'].iloc[0] == pd.Timestamp('2019-04-01 09:30')
+
+
+class BuyAtStrategy(Strategy):
+    """
+    在第k个bar买入第一个标的。
+    """
+
+    def __init__(self, bars, backtester, k):
+        self.bars = bars
+        self.backtester = backtester
+        self.k = k
+
+    def calculate_signals(self, event):
+        if self.bars.cursor == self.k:
+            self.backtester.send_event(SignalEvent(self.bars.symbol_list[0], None, 'LONG'))
+
+
+def run(symbol_data, k):
+    start = symbol_data['A']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: BuyAtStrategy(bt.bars, bt, k),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start))
+    tester.run()
+    return tester.port
+
+
+def test_crypto_fills_midnight():
+    index = pd.date_range('2019-04-01 23:50', '2019-04-02 00:10', freq='1min')
+    data = {'A': minute_bars(index[(index != '2019-04-02 00:00') & (index != '2019-04-02 00:01')]),
+            'B': minute_bars(index)}
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        aligned = CRYPTO.align(data)
+    a = aligned['A'].set_index('datetime')
+    assert len(a) == len(index)
+    assert (a.loc['2019-04-02 00:00':'2019-04-02 00:01', 'close'] == 10.0).all()
+    assert (a.loc['2019-04-02 00:00':'2019-04-02 00:01', 'volume'] == 0.0).all()
+
+    # 在0点的填充bar上买入
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        port = run(aligned, 11)
+    assert np.isfinite(port.equity_curve['total'].values).all()
+    assert port.current_positions['A'] == 100
+    # 00:01仍是填充的bar，持仓以23:59的收盘价10.0计价
+    assert port.all_holdings[12]['A'] == 1000.0
+
+
+def test_suspended_daily_bar_keeps_last_close():
+    # 2019-04-03 A停牌
+    days = pd.DatetimeIndex(['2019-04-01', '2019-04-02', '2019-04-03', '2019-04-04'])
+    data = {'A': minute_bars(days.delete(2)), 'B': minute_bars(days)}
+    aligned = CHINA_A.align(data, freq='1D')
+    assert aligned['A']['close'].tolist() == [1.0, 2.0, 2.0, 3.0]
+    assert aligned['A']['volume'].tolist() == [1.0, 1.0, 0.0, 1.0]
+
+    port = run(aligned, 3)
+    assert np.isfinite(port.current_holdings['cash'])
+    assert np.isfinite(port.equity_curve['total'].values).all()
+
+
+def test_handler_skips_nan_bars():
+    # 星期一的09:30-09:33缺失，按交易时段填充时为NaN
+    index = session_minutes('2019-03-29').append(session_minutes('2019-04-01')[4:])
+    data = {'A': minute_bars(index), 'B': minute_bars(session_minutes('2019-03-29').append(
+        session_minutes('2019-04-01')))}
+    aligned = CHINA_A.align(data)
+    with pytest.warns(MissingBarWarning, match="4 of 480 bars"):
+        bars = DataFrameDataHandler(None, aligned)
+    assert bars.n_bars == 476
+    assert not np.isnan(bars.panel['close']).any()
+    assert len(bars.symbol_data['A']) == 476
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', MissingBarWarning)
+        port = run(aligned, 240)
+    assert np.isfinite(port.equity_curve['total'].values).all()
@@ -0,0 +1,153 @@
+#encoding=utf-8
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data import DataFrameDataHandler, HistoricCSVDataHandler
+from validation import ISSUES, DataValidationError, DataValidator
+
+
+def bars(n=8):
+    close = np.arange(10.0, 10.0 + n)
+    return pd.DataFrame({'datetime': pd.date_range('2019-04-01 09:30', periods=n, freq='1min'),
+                         'open': close, 'high': close + 0.5, 'low': close - 0.5,
+                         'close': close, 'volume': np.full(n, 100.0)})
+
+
+def with_issue(issue):
+    """
+    只在第3个bar(下标2)有一种问题的数据。
+    """
+    df = bars()
+    if issue == 'missing':
+        df.loc[2, 'close'] = np.nan
+    elif issue == 'non_positive':
+        df.loc[2, ['open', 'low']] = [0.0, -1.0]
+    elif issue == 'high_low':
+        df.loc[2, ['high', 'low']] = [11.0, 13.0]
+    elif issue == 'duplicate':
+        df.loc[2, 'datetime'] = df.loc[1, 'datetime']
+    elif issue == 'non_monotonic':
+        df.loc[[1, 2], 'datetime'] = df.loc[[2, 1], 'datetime'].values
+    return df
+
+
+ISSUES_TESTED = ['missing', 'non_positive', 'high_low', 'duplicate', 'non_monotonic']
+
+
+def only(issue, action):
+    policies = dict((i, 'ignore') for i in ISSUES)
+    policies[issue] = action
+    return DataValidator(policies)
+
+
+@pytest.mark.parametrize('issue', ISSUES_TESTED)
+def test_raise(issue):
+    validator = only(issue, 'raise')
+    with pytest.raises(DataValidationError, match=issue):
+        validator.validate(with_issue(issue), 'A')
+    assert validator.report.summary()[['issue', 'count', 'action']].values.tolist() == \
+        [[issue, 1, 'raise']]
+
+
+@pytest.mark.parametrize('issue', ISSUES_TESTED)
+def test_drop(issue):
+    validator = only(issue, 'drop')
+    df = validator.validate(with_issue(issue), 'A')
+    assert len(df) == 7
+    assert validator.report.summary()['issue'].tolist() == [issue]
+    assert df['datetime'].is_monotonic_increasing and df['datetime'].is_unique
+    assert (df[['open', 'high', 'low', 'close']] > 0).all().all()
+    assert not df.isnull().any().any()
+
+
+def test_repair_missing_and_non_positive():
+    df = only('missing', 'repair').validate(with_issue('missing'), 'A')
+    assert len(df) == 8
+    # 沿用前一个bar的收盘价
+    assert df.loc[2, 'close'] == 11.0
+
+    # 开盘价和最低价以同一个bar的收盘价代替
+    df = only('non_positive', 'repair').validate(with_issue('non_positive'), 'A')
+    assert df.loc[2, ['open', 'high', 'low', 'close', 'volume']].tolist() == \
+        [12.0, 12.5, 12.0, 12.0, 100.0]
+
+    # 停牌(价格都为0)的bar沿用前一个bar的收盘价，成交量为0；开头的bar无法修复被删除
+    suspended = bars()
+    suspended.loc[[0, 2], ['open', 'high', 'low', 'close', 'volume']] = 0.0
+    df = only('non_positive', 'repair').validate(suspended, 'A')
+    assert len(df) == 7
+    assert df.loc[1, ['open', 'high', 'low', 'close', 'volume']].tolist() == \
+        [11.0, 11.0, 11.0, 11.0, 0.0]
+
+
+def test_repair_high_low_duplicate_and_order():
+    df = only('high_low', 'repair').validate(with_issue('high_low'), 'A')
+    assert df.loc[2, 'high'] == 13.0 and df.loc[2, 'low'] == 11.0
+
+    df = only('duplicate', 'repair').validate(with_issue('duplicate'), 'A')
+    assert len(df) == 7
+    # 重复的两个bar合并成一个
+    assert df.loc[1, ['open', 'high', 'low', 'close', 'volume']].tolist() == \
+        [11.0, 12.5, 10.5, 12.0, 200.0]
+
+    df = only('non_monotonic', 'repair').validate(with_issue('non_monotonic'), 'A')
+    assert df['datetime'].is_monotonic_increasing
+    assert df['close'].tolist()[:3] == [10.0, 12.0, 11.0]
+
+
+def test_default_policies_clean_every_issue():
+    df = bars(12)
+    df.loc[2, 'close'] = np.nan
+    df.loc[4, 'low'] = 0.0
+    df.loc[6, ['high', 'low']] = [15.0, 17.0]
+    df.loc[9, 'datetime'] = df.loc[8, 'datetime']
+    validator = DataValidator()
+    out = validator.validate(df, 'A')
+    assert set(validator.report.summary()['issue']) == {'missing', 'non_positive',
+                                                        'high_low', 'duplicate'}
+    assert len(out) == 11
+    assert not out.isnull().any().any()
+    assert ((out['high'] >= out[['open', 'close', 'low']].max(axis=1)) &
+            (out['low'] <= out[['open', 'close', 'high']].min(axis=1))).all()
+
+
+class EventSink(object):
+
+    def send_event(self, event):
+        pass
+
+
+def write_csv(df, path):
+    # HistoricCSVDataHandler的列顺序
+    df[['datetime', 'open', 'low', 'high', 'close', 'volume']].assign(oi=0).to_csv(
+        path, index=False)
+
+
+def test_checks_bars_turns_off_the_bar_check(tmp_path):
+    write_csv(with_issue('high_low'), str(tmp_path / 'A.csv'))
+
+    assert DataValidator().checks_bars
+    handler = HistoricCSVDataHandler(EventSink(), str(tmp_path), ['A'], validator=DataValidator())
+    assert handler.check_bars is False
+    for _ in range(8):
+        handler.update_bars()
+    assert handler.get_latest_bars('A', 8)[2].high == 13.0
+
+    # high_low为'ignore'时数据没有修复，Bar仍然逐个检查
+    validator = only('high_low', 'ignore')
+    assert not validator.checks_bars
+    handler = HistoricCSVDataHandler(EventSink(), str(tmp_path), ['A'], validator=validator)
+    assert handler.check_bars is True
+    handler.update_bars()
+    handler.update_bars()
+    with pytest.raises(ValueError, match="high should be the maximum"):
+        handler.update_bars()
+
+    # 关闭检查后不一致的bar不再在主循环中检查
+    bad = {'A': with_issue('high_low')}
+    handler = DataFrameDataHandler(EventSink(), bad, check_bars=False)
+    for _ in range(8):
+        handler.update_bars()
+    assert handler.get_latest_bars('A', 8)[2].low == 13.0
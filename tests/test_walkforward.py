@@ -0,0 +1,46 @@
+#encoding=utf-8
+
+import importlib
+import sys
+
+from walkforward import WalkForwardOptimizer
+
+
+STRATEGY_SOURCE = '''
+from strategy import BuyAndHoldStrategy
+
+
+class CachedStrategy(BuyAndHoldStrategy):
+    def __init__(self, bars, backtester, window=1):
+        BuyAndHoldStrategy.__init__(self, bars, backtester)
+        self.window = window
+'''
+
+
+def load_strategy(directory, source):
+    (directory / 'wf_cached_strategy.py').write_text(source)
+    sys.modules.pop('wf_cached_strategy', None)
+    sys.path.insert(0, str(directory))
+    try:
+        return importlib.import_module('wf_cached_strategy').CachedStrategy
+    finally:
+        sys.path.remove(str(directory))
+
+
+def run(symbol_data, strategy_cls, cache_dir):
+    wf = WalkForwardOptimizer(symbol_data, strategy_cls, {'window': [1, 2]}, 60, 20,
+                              cache_dir=cache_dir)
+    wf.run()
+    return wf
+
+
+def test_disk_cache_is_invalidated_by_strategy_edits(symbol_data, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    strategy_cls = load_strategy(tmp_path, STRATEGY_SOURCE)
+    first = run(symbol_data, strategy_cls, cache_dir)
+    assert first.hits == 0
+
+    assert run(symbol_data, strategy_cls, cache_dir).misses == 0
+
+    edited = load_strategy(tmp_path, STRATEGY_SOURCE + '\n# edited\n')
+    assert run(symbol_data, edited, cache_dir).hits == 0
@@ -0,0 +1,105 @@
+#encoding=utf-8
+
+import os
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+
+import numpy as np
+import pytest
+
+from data import DataFrameDataHandler
+from main import Backtester
+from portfolio import NaivePortfolio
+from strategy import BuyAndHoldStrategy
+from worker import BacktestClient, BacktestWorker
+
+
+STRATEGY_SOURCE = '''
+from event import SignalEvent
+from strategy import Strategy
+
+
+class EditedStrategy(Strategy):
+
+    def __init__(self, bars, backtester):
+        self.bars = bars
+        self.backtester = backtester
+
+    def calculate_signals(self, event):
+        if self.bars.cursor == {k}:
+            self.backtester.send_event(SignalEvent(self.bars.symbol_list[0], None, 'LONG'))
+'''
+
+
+@pytest.fixture
+def worker(symbol_data, tmp_path):
+    worker = BacktestWorker(symbol_data, address=str(tmp_path / 'worker.sock'),
+                            key_file=str(tmp_path / 'keys' / 'worker.key'))
+    thread = threading.Thread(target=worker.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(500):
+        if os.path.exists(worker.key_file):
+            break
+        time.sleep(0.01)
+    yield worker
+    if thread.is_alive():
+        BacktestClient(worker.address, key_file=worker.key_file).shutdown()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert not os.path.exists(worker.key_file)
+
+
+def client_for(worker):
+    return BacktestClient(worker.address, key_file=worker.key_file)
+
+
+def test_round_trip_with_generated_key(worker, symbol_data):
+    assert oct(os.stat(worker.key_file).st_mode & 0o777) == oct(0o600)
+    assert oct(os.stat(worker.address).st_mode & 0o777) == oct(0o600)
+
+    result = client_for(worker).run('strategy.BuyAndHoldStrategy')
+    start = symbol_data['S0']['datetime'].iloc[0]
+    tester = Backtester(bars=lambda bt: DataFrameDataHandler(bt, symbol_data),
+                        strategy=lambda bt: BuyAndHoldStrategy(bt.bars, bt),
+                        port=lambda bt: NaivePortfolio(bt.bars, bt, start))
+    stats = tester.run()
+    assert np.array_equal(result['equity_curve']['total'].values,
+                          tester.port.equity_curve['total'].values)
+    assert result['stats'] == stats
+
+
+def test_bad_key_is_rejected_and_worker_survives(worker):
+    with pytest.raises(AuthenticationError):
+        BacktestClient(worker.address, authkey=b'wrong key').run('strategy.BuyAndHoldStrategy')
+    assert 'equity_curve' in client_for(worker).run('strategy.BuyAndHoldStrategy')
+
+
+def test_job_error_is_reported(worker):
+    client = client_for(worker)
+    with pytest.raises(RuntimeError, match="NoSuchStrategy"):
+        client.run('strategy.NoSuchStrategy')
+    with pytest.raises(RuntimeError, match="No bars"):
+        client.run('strategy.BuyAndHoldStrategy', start_date='2030-01-01')
+    assert 'equity_curve' in client.run('strategy.BuyAndHoldStrategy')
+
+
+def test_edited_strategy_is_reloaded(worker, tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    path = tmp_path / 'edited_strategy.py'
+    path.write_text(STRATEGY_SOURCE.format(k=10))
+    client = client_for(worker)
+    try:
+        first = client.run('edited_strategy.EditedStrategy')['equity_curve']
+
+        path.write_text(STRATEGY_SOURCE.format(k=100))
+        mtime = os.stat(str(path)).st_mtime + 10
+        os.utime(str(path), (mtime, mtime))
+        second = client.run('edited_strategy.EditedStrategy')['equity_curve']
+    finally:
+        sys.modules.pop('edited_strategy', None)
+
+    # 第10个bar买入与第100个bar买入的持仓时间不同
+    assert (first['S0'] != 0).sum() != (second['S0'] != 0).sum()
+    assert (second['S0'].iloc[:100] == 0).all()
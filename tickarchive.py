@@ -0,0 +1,394 @@
+#encoding=utf-8
+
+"""
+按标的和交易日分区的压缩tick数据存档。
+每个标的一个数据文件<symbol>.ticks和一个索引文件<symbol>.idx。
+数据文件由按时间顺序追加的数据块组成，每个数据块保存一天(UTC)的tick，
+时间(epoch纳秒)做差分编码，价格转换成整数后做差分编码，成交量转换成整数，
+每一列再转换成最窄的整数类型，按字节重排(byte shuffle)后用zlib压缩。
+索引文件的每条记录对应一个数据块，记录日期、tick数量、各列的字节偏移和长度，
+读取时只需要解压回测用到的那些天的数据块。
+
+写入只会追加：新的tick不能早于已存档的最后一个tick，
+已有的数据块和索引记录不会被修改。
+
+把datas/<symbol>.csv转换成存档:
+    python tickarchive.py okcoinUSD btcCNY
+
+author: lvbj
+date: 2019-3-11
+"""
+
+import os
+import sys
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from timeutil import to_epoch_ns
+
+
+NS_PER_DAY = 86400 * 10**9
+
+# 最多尝试的小数位数，超过时按原始的float64保存
+MAX_DECIMALS = 8
+
+# zlib的压缩级别，更高的级别压缩率提高得不多，写入却慢得多
+COMPRESS_LEVEL = 1
+
+INDEX_DTYPE = np.dtype([('day', 'int32'),
+                        ('n', 'int64'),
+                        ('offset', 'int64'),
+                        ('time_len', 'int64'),
+                        ('price_len', 'int64'),
+                        ('volume_len', 'int64'),
+                        ('time_exp', 'int8'),
+                        ('time_width', 'int8'),
+                        ('price_decimals', 'int8'),
+                        ('price_width', 'int8'),
+                        ('volume_decimals', 'int8'),
+                        ('volume_width', 'int8'),
+                        ('price_base', 'int64'),
+                        ('first_time', 'int64'),
+                        ('last_time', 'int64')])
+
+INT_TYPES = {1: np.int8, 2: np.int16, 4: np.int32, 8: np.int64}
+
+
+def _decimals(values):
+    """
+    返回能无损地把values转换成整数的最少小数位数，无法转换时返回-1。
+    """
+    if not np.all(np.isfinite(values)):
+        return -1
+    for d in range(MAX_DECIMALS + 1):
+        scale = 10.0 ** d
+        scaled = np.round(values * scale)
+        if len(values) > 0 and np.abs(scaled).max() >= 2**53:
+            return -1
+        if np.array_equal(scaled / scale, values):
+            return d
+    return -1
+
+
+def _pack(ints):
+    """
+    把int64数组转换成能容纳所有值的最窄的整数类型，按字节重排后用zlib压缩。
+    同一个字节位置的数据放在一起，差分后的小整数的高位字节几乎全是0或0xff，很容易压缩。
+
+    Returns:
+    压缩后的bytes, 整数的字节数。
+    """
+    for width in (1, 2, 4):
+        info = np.iinfo(INT_TYPES[width])
+        if len(ints) == 0 or (ints.min() >= info.min and ints.max() <= info.max):
+            ints = ints.astype(INT_TYPES[width])
+            break
+    width = ints.dtype.itemsize
+    shuffled = np.ascontiguousarray(ints).view(np.uint8).reshape(-1, width).T
+    return zlib.compress(shuffled.tobytes(), COMPRESS_LEVEL), width
+
+
+def _unpack(buf, n, width):
+    """
+    _pack的逆变换，返回width字节的整数数组。
+    """
+    shuffled = np.frombuffer(zlib.decompress(buf), dtype=np.uint8).reshape(width, n)
+    return np.ascontiguousarray(shuffled.T).view(INT_TYPES[width]).ravel()
+
+
+def _encode_time(time):
+    """
+    时间做差分编码，差分再除以能整除所有差分的最大的10的幂(如整秒的时间为10**9)。
+
+    Returns:
+    压缩后的bytes, 10的幂次, 整数的字节数。
+    """
+    delta = np.diff(time)
+    exp = 0
+    while exp < 9 and np.all(delta % 10 ** (exp + 1) == 0):
+        exp += 1
+    buf, width = _pack(delta // 10 ** exp)
+    return buf, exp, width
+
+
+def _decode_time(buf, n, first, exp, width, out):
+    """
+    _encode_time的逆变换，结果写入out。
+    """
+    out[0] = first
+    if n > 1:
+        np.cumsum(_unpack(buf, n - 1, width), dtype=np.int64, out=out[1:])
+        if exp > 0:
+            out[1:] *= 10 ** exp
+        out[1:] += first
+
+
+def _encode_values(values, delta):
+    """
+    把float64数组无损地转换成整数后压缩，delta为True时对整数做差分编码，
+    差分以第一个值为基数。没有办法转换成整数时按原始的float64保存。
+
+    Returns:
+    压缩后的bytes, 小数位数(-1表示原始的float64), 整数的字节数, 基数。
+    """
+    d = _decimals(values)
+    if d < 0:
+        buf, width = _pack(values.view(np.int64))
+        return buf, d, width, 0
+    ints = np.round(values * 10.0 ** d).astype(np.int64)
+    base = 0
+    if delta and len(ints) > 0:
+        base = int(ints[0])
+        ints = np.diff(ints, prepend=ints[0])
+    buf, width = _pack(ints)
+    return buf, d, width, base
+
+
+def _decode_values(buf, n, decimals, width, base, delta, out):
+    """
+    _encode_values的逆变换，结果写入out。
+    """
+    ints = _unpack(buf, n, width)
+    if decimals < 0:
+        out[:] = ints.astype(np.int64).view(np.float64)
+        return
+    if delta:
+        ints = np.cumsum(ints, dtype=np.int64)
+        ints += base
+    np.divide(ints, 10.0 ** decimals, out=out)
+
+
+class TickArchive(object):
+    """
+    TickArchive 管理一个目录下所有标的的tick存档。
+    """
+
+    def __init__(self, root="datas/ticks"):
+        """
+        Parameter:
+        root - 存档所在的目录，不存在时在第一次写入时创建。
+        """
+        self.root = root
+
+    def _data_path(self, symbol):
+        return os.path.join(self.root, "{}.ticks".format(symbol))
+
+    def _index_path(self, symbol):
+        return os.path.join(self.root, "{}.idx".format(symbol))
+
+    def symbols(self):
+        """
+        返回已存档的标的列表。
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(f[:-len(".idx")] for f in os.listdir(self.root) if f.endswith(".idx"))
+
+    def index(self, symbol):
+        """
+        返回标的的索引，INDEX_DTYPE类型的numpy结构化数组，每个元素对应一个数据块。
+        """
+        path = self._index_path(symbol)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=INDEX_DTYPE)
+        # 忽略写到一半的记录
+        count = os.path.getsize(path) // INDEX_DTYPE.itemsize
+        return np.fromfile(path, dtype=INDEX_DTYPE, count=count)
+
+    def days(self, symbol):
+        """
+        返回已存档的日期，datetime64[D]类型的数组。
+        """
+        return np.unique(self.index(symbol)['day']).astype('datetime64[D]')
+
+    def last_time(self, symbol):
+        """
+        返回已存档的最后一个tick的时间(epoch纳秒)，没有数据时返回None。
+        """
+        idx = self.index(symbol)
+        if len(idx) == 0:
+            return None
+        return int(idx['last_time'][-1])
+
+    def _read_time(self, symbol, rec):
+        """
+        只解压一个数据块的时间列。
+        """
+        n = int(rec['n'])
+        with open(self._data_path(symbol), 'rb') as f:
+            f.seek(int(rec['offset']))
+            buf = f.read(int(rec['time_len']))
+        time = np.empty(n, dtype=np.int64)
+        _decode_time(buf, n, rec['first_time'], rec['time_exp'], rec['time_width'], time)
+        return time
+
+    def last_time_count(self, symbol):
+        """
+        返回已存档的最后一个tick的时间(epoch纳秒)和存档中该时间的tick数量，
+        没有数据时返回(None, 0)。只解压以该时间结束的数据块的时间列。
+        """
+        idx = self.index(symbol)
+        if len(idx) == 0:
+            return None, 0
+        last = int(idx['last_time'][-1])
+        count = 0
+        # 同一时间的tick可能分在多个数据块中(同一天分多次追加)
+        for rec in idx[::-1]:
+            if int(rec['last_time']) != last:
+                break
+            count += int(np.count_nonzero(self._read_time(symbol, rec) == last))
+            if int(rec['first_time']) < last:
+                break
+        return last, count
+
+    def append(self, symbol, time, price, volume):
+        """
+        追加一段按时间排序的tick，每一天写成一个数据块。
+
+        Parameters:
+        symbol - 标的代码。
+        time - int64的epoch纳秒数组。
+        price, volume - float64数组。
+        """
+        time = np.asarray(time, dtype=np.int64)
+        price = np.asarray(price, dtype=np.float64)
+        volume = np.asarray(volume, dtype=np.float64)
+        if len(time) == 0:
+            return
+        if np.any(np.diff(time) < 0):
+            raise ValueError("Ticks of {} are not sorted by time".format(symbol))
+        last = self.last_time(symbol)
+        if last is not None and time[0] < last:
+            raise ValueError("Ticks of {} start before the end of the archive, "
+                             "only appending is supported".format(symbol))
+
+        day = time // NS_PER_DAY
+        starts = np.r_[0, np.flatnonzero(np.diff(day)) + 1]
+        ends = np.r_[starts[1:], len(time)]
+
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        records = np.zeros(len(starts), dtype=INDEX_DTYPE)
+        with open(self._data_path(symbol), 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            for i, (a, b) in enumerate(zip(starts, ends)):
+                time_buf, time_exp, time_width = _encode_time(time[a:b])
+                price_buf, price_decimals, price_width, price_base = \
+                    _encode_values(price[a:b], True)
+                volume_buf, volume_decimals, volume_width, _ = \
+                    _encode_values(volume[a:b], False)
+                f.write(time_buf)
+                f.write(price_buf)
+                f.write(volume_buf)
+                records[i] = (day[a], b - a, offset,
+                              len(time_buf), len(price_buf), len(volume_buf),
+                              time_exp, time_width, price_decimals, price_width,
+                              volume_decimals, volume_width, price_base,
+                              time[a], time[b-1])
+                offset += len(time_buf) + len(price_buf) + len(volume_buf)
+            f.flush()
+            os.fsync(f.fileno())
+        # 数据块写完之后才写索引，中断时数据文件末尾多出的字节不会被引用
+        with open(self._index_path(symbol), 'ab') as f:
+            f.write(records.tobytes())
+
+    def ingest_csv(self, symbol, filename, chunksize=1000000):
+        """
+        把(timestamp, price, volume)格式的tick csv文件追加到存档中，
+        timestamp为UTC的epoch秒。跳过已存档的tick(早于存档的最后一个tick的，
+        以及与最后一个tick同一时间的前若干个)，所以对不断增长的csv文件重复调用只会写入新的tick。
+
+        Parameters:
+        symbol - 标的代码。
+        filename - csv文件。
+        chunksize - 每次读取的行数。
+
+        Returns:
+        追加的tick数量。
+        """
+        last, skip = self.last_time_count(symbol)
+        added = 0
+        pending = None
+        reader = pd.read_csv(filename, names=['timestamp', 'price', 'volume'],
+                             header=0, chunksize=chunksize)
+        for chunk in reader:
+            time = np.round(chunk['timestamp'].values.astype('float64') * 1e9).astype(np.int64)
+            price = chunk['price'].values.astype('float64')
+            volume = chunk['volume'].values.astype('float64')
+            if last is not None:
+                # 时间是整秒，很多tick的时间与存档的最后一个tick相同，
+                # 跳过存档中已有的skip个，之后同一时间的tick仍然追加
+                keep = time > last
+                same = np.flatnonzero(time == last)
+                keep[same[skip:]] = True
+                skip -= min(skip, len(same))
+                time, price, volume = time[keep], price[keep], volume[keep]
+            if pending is not None:
+                time = np.r_[pending[0], time]
+                price = np.r_[pending[1], price]
+                volume = np.r_[pending[2], volume]
+            if len(time) == 0:
+                continue
+            # 最后一天可能还没有读完，留到下一次一起写入
+            split = np.searchsorted(time, (time[-1] // NS_PER_DAY) * NS_PER_DAY)
+            self.append(symbol, time[:split], price[:split], volume[:split])
+            added += split
+            pending = (time[split:], price[split:], volume[split:])
+        if pending is not None:
+            self.append(symbol, *pending)
+            added += len(pending[0])
+        return added
+
+    def read(self, symbol, start_date=None, end_date=None):
+        """
+        读取日期区间内的tick，只解压区间内的数据块。
+
+        Parameters:
+        symbol - 标的代码。
+        start_date, end_date - 包含两端的日期，可以是字符串、datetime或epoch纳秒，
+            None表示不限制。
+
+        Returns:
+        time(int64的epoch纳秒), price, volume三个numpy数组。
+        """
+        idx = self.index(symbol)
+        if len(idx) == 0:
+            raise IOError("No ticks of {} in archive {}".format(symbol, self.root))
+        mask = np.ones(len(idx), dtype=bool)
+        if start_date is not None:
+            mask &= idx['day'] >= to_epoch_ns(start_date) // NS_PER_DAY
+        if end_date is not None:
+            mask &= idx['day'] <= to_epoch_ns(end_date) // NS_PER_DAY
+        idx = idx[mask]
+
+        total = int(idx['n'].sum())
+        time = np.empty(total, dtype=np.int64)
+        price = np.empty(total, dtype=np.float64)
+        volume = np.empty(total, dtype=np.float64)
+        pos = 0
+        with open(self._data_path(symbol), 'rb') as f:
+            for rec in idx:
+                n = int(rec['n'])
+                f.seek(int(rec['offset']))
+                buf = f.read(int(rec['time_len'] + rec['price_len'] + rec['volume_len']))
+                view = memoryview(buf)
+                a = int(rec['time_len'])
+                b = a + int(rec['price_len'])
+                _decode_time(view[:a], n, rec['first_time'], rec['time_exp'],
+                             rec['time_width'], time[pos:pos+n])
+                _decode_values(view[a:b], n, rec['price_decimals'], rec['price_width'],
+                               rec['price_base'], True, price[pos:pos+n])
+                _decode_values(view[b:], n, rec['volume_decimals'], rec['volume_width'],
+                               0, False, volume[pos:pos+n])
+                pos += n
+        return time, price, volume
+
+
+if __name__ == '__main__':
+    archive = TickArchive()
+    for s in sys.argv[1:] or ['okcoinUSD']:
+        added = archive.ingest_csv(s, "datas/{}.csv".format(s))
+        print("{}: {} ticks appended, {} days in archive.".format(
+            s, added, len(archive.days(s))))
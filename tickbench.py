@@ -0,0 +1,96 @@
+#encoding=utf-8
+
+"""
+逐tick回测(tickengine.TickBacktester)的吞吐量基准测试。
+生成两个标的的随机tick，分别用空策略和TickMovingAverageStrategy运行完整的回测
+(包括记录持仓和计算统计结果)，报告每秒处理的tick数，每种配置取最快的一次。
+
+使用:
+    python tickbench.py                     # 3M ticks
+    python tickbench.py -n 5000000 -r 5
+
+author: lvbj
+date: 2019-4-8
+"""
+
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+from portfolio import NaivePortfolio
+from tickengine import TickBacktester, TickDataHandler, TickMovingAverageStrategy, TickStrategy
+
+
+class EmptyTickStrategy(TickStrategy):
+    """
+    不做任何事的策略，测量引擎本身的开销。
+    """
+
+    def __init__(self, bars, backtester):
+        self.bars = bars
+        self.backtester = backtester
+
+    def on_tick(self, symbol_id, time, price, volume):
+        pass
+
+
+def synthetic_ticks(n_ticks, symbols=('A', 'B'), days=30, seed=0):
+    """
+    生成整秒时间戳的随机游走tick，dict, symbol -> (time, price, volume)。
+    """
+    rng = np.random.RandomState(seed)
+    start = np.datetime64('2017-01-01', 'ns').astype('int64')
+    n = n_ticks // len(symbols)
+    ticks = {}
+    for s in symbols:
+        seconds = np.sort(rng.randint(0, days * 86400, n)).astype('int64')
+        price = np.round(1000.0 * np.exp(np.cumsum(1e-4 * rng.randn(n))), 2)
+        ticks[s] = (start + seconds * 10**9, price, np.round(rng.rand(n), 4))
+    return ticks
+
+
+def measure(ticks, strategy, mark_every=1000, repeat=3):
+    """
+    运行repeat次完整的回测。
+
+    Returns:
+    (最快一次的每秒tick数, 事件数)
+    """
+    best = None
+    for _ in range(repeat):
+        bars = TickDataHandler(None, ticks)
+        tester = TickBacktester(bars, strategy,
+                                lambda bt: NaivePortfolio(bt.bars, bt, int(bt.bars.times[0])),
+                                mark_every=mark_every)
+        t = time.perf_counter()
+        tester.run()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return bars.n_bars / best, tester.events
+
+
+def run(n_ticks=3000000, repeat=3):
+    ticks = synthetic_ticks(n_ticks)
+    configs = [
+        ("empty strategy, mark every 1000", lambda bt: EmptyTickStrategy(bt.bars, bt), 1000),
+        ("empty strategy, no marks", lambda bt: EmptyTickStrategy(bt.bars, bt), 10**12),
+        ("moving average, mark every 1000",
+         lambda bt: TickMovingAverageStrategy(bt.bars, bt), 1000)]
+    rows = []
+    for name, strategy, mark_every in configs:
+        rate, events = measure(ticks, strategy, mark_every, repeat)
+        rows.append((name, rate, events))
+        print("{:<34} {:>6.2f}M ticks/s  {:>7} events".format(name, rate / 1e6, events))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure tick backtest throughput.")
+    parser.add_argument('-n', '--ticks', type=int, default=3000000)
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        run(args.ticks, args.repeat)
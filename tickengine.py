@@ -0,0 +1,354 @@
+#encoding=utf-8
+
+"""
+逐tick的高吞吐回测。
+CoinDataHandler把tick合成分钟bar之后再回测，高频策略需要对每一笔成交做出反应。
+TickDataHandler直接保存(时间, 价格, 成交量)的numpy数组，多个标的按时间合并成一个tick流。
+TickBacktester逐个tick地调用策略的on_tick，不创建Bar对象，也不经过事件队列:
+策略发出的事件立即同步地交给portfolio和执行组件处理。
+
+只有在需要时(下单、成交、记录持仓)才为最新的tick创建Bar对象，
+所以NaivePortfolio和SimulatedExecutionHandler可以直接使用，成交价为最新的tick价格。
+持仓和市值每mark_every个tick记录一次，而不是每个tick记录一次。
+循环中每个tick只调用一次on_tick，游标(bars.cursor)在读取时才计算。
+tickbench.py 测量吞吐量。
+
+使用:
+    bars = TickDataHandler.from_archive(None, "datas/ticks", ['okcoinUSD'], '2017-1-1', '2017-1-31')
+    tester = TickBacktester(bars=bars,
+                            strategy=lambda bt: TickMovingAverageStrategy(bt.bars, bt),
+                            port=lambda bt: NaivePortfolio(bt.bars, bt, bt.bars.times[0]))
+    stats = tester.run()
+
+author: lvbj
+date: 2019-3-29
+"""
+
+from operator import length_hint
+
+import numpy as np
+
+from bar import Bar
+from data import CoinDataHandler
+from event import MarketEvent, SignalEvent
+from execution import SimulatedExecutionHandler
+from strategy import Strategy
+from tickarchive import TickArchive
+from timeutil import to_epoch_ns, to_datetime
+
+
+class TickDataHandler(object):
+    """
+    TickDataHandler 保存按时间排序的tick数组，游标(cursor)为已推送的tick数。
+    提供与DataFrameDataHandler相同的get_latest_bars接口，
+    最新的tick以开高低收都等于成交价的Bar返回。
+    """
+
+    def __init__(self, backtester, symbol_ticks):
+        """
+        Parameter:
+        backtester - TickBacktester object，可以为None，由TickBacktester设置。
+        symbol_ticks - dict, symbol -> (time, price, volume)，
+            time为int64的epoch纳秒，各个数组按时间排序。
+        """
+        self.backtester = backtester
+        self.symbol_list = list(symbol_ticks.keys())
+        self.symbol_index = dict((s, j) for j, s in enumerate(self.symbol_list))
+
+        times = [np.asarray(symbol_ticks[s][0], dtype='int64') for s in self.symbol_list]
+        ids = [np.full(len(t), j, dtype='int32') for j, t in enumerate(times)]
+        time = np.concatenate(times)
+        # 稳定排序，同一时间的tick保持symbol_list的顺序
+        order = np.argsort(time, kind='mergesort')
+        self.time = time[order]
+        self.price = np.concatenate([np.asarray(symbol_ticks[s][1], dtype='float64')
+                                     for s in self.symbol_list])[order]
+        self.volume = np.concatenate([np.asarray(symbol_ticks[s][2], dtype='float64')
+                                      for s in self.symbol_list])[order]
+        self.symbol_id = np.concatenate(ids)[order]
+        for arr in (self.time, self.price, self.volume, self.symbol_id):
+            arr.flags.writeable = False
+
+        # 每个标的的tick在合并后的流中的位置
+        self.positions = [np.flatnonzero(self.symbol_id == j)
+                          for j in range(len(self.symbol_list))]
+        self.n_bars = len(self.time)
+        self.cursor = 0
+        self.continue_backtest = True
+
+    @property
+    def cursor(self):
+        """
+        已推送的tick数。TickBacktester不在每个tick上设置游标，
+        而是在读取时由正在遍历的tick列表的迭代器剩余的长度算出。
+        """
+        if self._ticks is not None:
+            return self._stop - length_hint(self._ticks)
+        return self._cursor
+
+    @cursor.setter
+    def cursor(self, value):
+        self._cursor = value
+        self._ticks = None
+
+    def _track(self, stop, ticks):
+        """
+        游标跟随ticks迭代器: 迭代器取出的最后一个tick是最新的tick，stop为这一块的结束位置。
+        """
+        self._stop = stop
+        self._ticks = ticks
+
+    @classmethod
+    def from_archive(cls, backtester, archive, symbol_list, start_date=None, end_date=None):
+        """
+        从tick存档读取日期区间内的tick。
+
+        Parameter:
+        archive - tickarchive.TickArchive或存档目录。
+        """
+        if isinstance(archive, str):
+            archive = TickArchive(archive)
+        return cls(backtester, dict((s, archive.read(s, start_date, end_date))
+                                    for s in symbol_list))
+
+    @classmethod
+    def from_csv(cls, backtester, symbol_list):
+        """
+        读取datas/<symbol>.csv中的tick，与CoinDataHandler读取的数据相同。
+        """
+        return cls(backtester, dict((s, CoinDataHandler._read_csv_ticks(s))
+                                    for s in symbol_list))
+
+    @property
+    def times(self):
+        return self.time
+
+    def first_ready(self):
+        """
+        所有标的都至少有一个tick时的游标。
+        """
+        if any(len(p) == 0 for p in self.positions):
+            return self.n_bars + 1
+        return max(int(p[0]) for p in self.positions) + 1
+
+    def latest_index(self, symbol):
+        """
+        标的最新的tick在tick流中的位置，还没有tick时返回None。
+        """
+        p = self.positions[self.symbol_index[symbol]]
+        k = np.searchsorted(p, self.cursor, side='left') - 1
+        if k < 0:
+            return None
+        return int(p[k])
+
+    def get_latest_tick(self, symbol):
+        """
+        返回标的最新的tick (time, price, volume)，还没有tick时返回None。
+        """
+        i = self.latest_index(symbol)
+        if i is None:
+            return None
+        return int(self.time[i]), float(self.price[i]), float(self.volume[i])
+
+    def get_latest_bars(self, symbol, N=1):
+        """
+        以Bar的形式返回标的最新的tick，只支持N=1，还没有tick时返回空列表。
+        """
+        i = self.latest_index(symbol)
+        if i is None:
+            return []
+        price = float(self.price[i])
+        return [Bar(symbol, int(self.time[i]), price, price, price, price,
+                    float(self.volume[i]), False)]
+
+    def update_bars(self):
+        """
+        TickBacktester直接移动游标，不通过update_bars推送数据。
+        """
+        raise NotImplementedError("TickDataHandler is driven by TickBacktester")
+
+
+class TickStrategy(Strategy):
+    """
+    TickStrategy 是逐tick策略的基类，TickBacktester对每个tick调用on_tick，
+    参数都是Python的int和float。
+    """
+
+    def on_tick(self, symbol_id, time, price, volume):
+        """
+        处理一个tick。
+
+        Parameters:
+        symbol_id - 标的在symbol_list中的下标。
+        time - epoch纳秒。
+        price - 成交价。
+        volume - 成交量。
+        """
+        raise NotImplementedError("Should implement on_tick()")
+
+    def calculate_signals(self, event):
+        pass
+
+
+class TickMovingAverageStrategy(TickStrategy):
+    """
+    TickMovingAverageStrategy 对每个标的维护逐tick的快、慢两条指数移动平均，
+    快线上穿慢线时做多，下穿时平仓。
+    """
+
+    def __init__(self, bars, backtester, fast=100, slow=1000):
+        """
+        Parameters:
+        bars - TickDataHandler object
+        backtester - TickBacktester object
+        fast, slow - 快线和慢线的跨度(tick数)。
+        """
+        self.bars = bars
+        self.backtester = backtester
+        self.symbol_list = self.bars.symbol_list
+        self.fast = fast
+        self.slow = slow
+        self.alpha_fast = 2.0 / (fast + 1)
+        self.alpha_slow = 2.0 / (slow + 1)
+        n = len(self.symbol_list)
+        self.ema_fast = [None] * n
+        self.ema_slow = [None] * n
+        self.long = [False] * n
+
+    def on_tick(self, symbol_id, time, price, volume):
+        f = self.ema_fast[symbol_id]
+        if f is None:
+            self.ema_fast[symbol_id] = price
+            self.ema_slow[symbol_id] = price
+            return
+        f += self.alpha_fast * (price - f)
+        s = self.ema_slow[symbol_id]
+        s += self.alpha_slow * (price - s)
+        self.ema_fast[symbol_id] = f
+        self.ema_slow[symbol_id] = s
+
+        if (f > s) != self.long[symbol_id]:
+            self.long[symbol_id] = f > s
+            signal_type = 'LONG' if f > s else 'EXIT'
+            self.backtester.send_event(SignalEvent(self.symbol_list[symbol_id],
+                                                   to_datetime(time), signal_type))
+
+
+class TickBacktester(object):
+    """
+    TickBacktester 以最少的分配逐个tick地运行回测。
+    tick数组按块转换成Python列表后逐个交给策略，事件不经过队列，发出时立即处理。
+    """
+
+    def __init__(self, bars, strategy, port, broker=None, start_date=None, end_date=None,
+                 mark_every=1000, chunk_size=65536, progress=None):
+        """
+        Parameter:
+        bars - TickDataHandler，或接受TickBacktester为参数并返回它的可调用对象。
+        strategy, port, broker - 回测的各个组件，可以是对象，也可以是
+            接受TickBacktester为参数并返回该组件的可调用对象。
+            broker默认为SimulatedExecutionHandler。
+        start_date, end_date - 只回测这个区间内的tick，可以是字符串、datetime或epoch纳秒。
+        mark_every - 每多少个tick记录一次持仓和市值(portfolio.update_timeindex)。
+        chunk_size - 每次转换成Python列表的tick数的上限。
+        progress - progressbar.ProgressReporter, 按tick数报告回测进度。
+        """
+        if callable(bars):
+            bars = bars(self)
+        bars.backtester = self
+        self.bars = bars
+
+        if callable(strategy):
+            strategy = strategy(self)
+        if callable(port):
+            port = port(self)
+        if broker is None:
+            broker = SimulatedExecutionHandler(self)
+        elif callable(broker):
+            broker = broker(self)
+        self.strategy = strategy
+        self.port = port
+        self.broker = broker
+
+        self.mark_every = max(int(mark_every), 1)
+        self.chunk_size = max(int(chunk_size), 1)
+        self.progress = progress
+        self.events = 0
+
+        self.__handlers = {
+            'SIGNAL': port.update_signal,
+            'ORDER': broker.execute_order,
+            'FILL': port.update_fill,
+            'BASKET_ORDER': broker.execute_basket,
+            'BASKET_FILL': port.update_basket_fill}
+
+        time = bars.time
+        self.__start = 0
+        self.__stop = len(time)
+        if start_date is not None:
+            self.__start = int(np.searchsorted(time, to_epoch_ns(start_date), side='left'))
+        if end_date is not None:
+            self.__stop = int(np.searchsorted(time, to_epoch_ns(end_date), side='right'))
+
+    def send_event(self, event):
+        """
+        立即处理事件。处理中发出的事件(如订单、成交)也立即处理。
+        """
+        self.events += 1
+        handler = self.__handlers.get(event.kind)
+        if handler is not None:
+            handler(event)
+
+    def pending_events(self):
+        """
+        事件不经过队列，没有等待处理的事件。
+        """
+        return []
+
+    def _mark(self, cursor):
+        """
+        在游标处记录持仓和市值。
+        """
+        self.bars.cursor = cursor
+        self.port.update_timeindex(MarketEvent())
+
+    def run(self):
+        """
+        运行回测，返回output_summary_stats的统计结果。
+        """
+        bars = self.bars
+        on_tick = self.strategy.on_tick
+        ready = bars.first_ready()
+        progress = self.progress
+        if progress is not None:
+            progress.start(self.__stop - self.__start)
+
+        start = self.__start
+        while start < self.__stop:
+            # 每一块在记录持仓的位置结束，块内没有任何判断
+            stop = min(start + self.chunk_size, self.__stop,
+                       (start // self.mark_every + 1) * self.mark_every)
+            ids = iter(bars.symbol_id[start:stop].tolist())
+            times = bars.time[start:stop].tolist()
+            prices = bars.price[start:stop].tolist()
+            volumes = bars.volume[start:stop].tolist()
+
+            # 循环中不设置游标，bars.cursor由ids中剩余的tick数算出
+            bars._track(stop, ids)
+            for sid, t, p, v in zip(ids, times, prices, volumes):
+                on_tick(sid, t, p, v)
+            bars.cursor = stop
+
+            if stop % self.mark_every == 0 and stop >= ready:
+                self._mark(stop)
+            if progress is not None:
+                progress.update(stop - self.__start, self.events)
+            start = stop
+
+        if start >= ready and (start % self.mark_every != 0):
+            self._mark(start)
+        bars.continue_backtest = False
+        if progress is not None:
+            progress.finish(start - self.__start, self.events)
+        self.port.create_equity_curve_dataframe()
+        return self.port.output_summary_stats()
@@ -0,0 +1,65 @@
+#encoding=utf-8
+
+"""
+时间的表示和转换。
+回测系统内部统一用int64的epoch纳秒(UTC)表示时间，载入数据时一次性向量化地解析，
+只有在需要的时候(如显示、策略读取Bar.dt)才创建datetime.datetime对象。
+
+author: lvbj
+date: 2019-3-8
+"""
+
+import datetime
+
+from lazyimport import is_loaded, lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_epoch_ns(value):
+    """
+    把单个时间转换成int64的epoch纳秒。
+
+    Parameter:
+    value - int(已经是epoch纳秒), str, datetime.datetime, pd.Timestamp 或 np.datetime64。
+        没有时区的时间按UTC处理。
+    """
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, str):
+        value = pd.Timestamp(value)
+    # numpy和pandas的类型只会在它们已经导入时出现，不为了检查类型而导入它们
+    if is_loaded('numpy'):
+        if isinstance(value, np.integer):
+            return int(value)
+        if isinstance(value, np.datetime64):
+            return int(value.astype('datetime64[ns]').astype('int64'))
+    if is_loaded('pandas') and isinstance(value, pd.Timestamp):
+        if value.tzinfo is not None:
+            value = value.tz_convert('UTC').tz_localize(None)
+        return int(value.value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return ((value - EPOCH) // datetime.timedelta(microseconds=1)) * 1000
+    raise TypeError("Can't convert {!r} to epoch nanoseconds".format(value))
+
+
+def to_datetime(ns):
+    """
+    把epoch纳秒转换成datetime.datetime(精确到微秒)。
+    """
+    return EPOCH + datetime.timedelta(microseconds=int(ns) // 1000)
+
+
+def parse_epoch_ns(values):
+    """
+    向量化地把一列时间(字符串、datetime或datetime64)解析成int64的epoch纳秒数组。
+    """
+    if isinstance(values, (pd.Series, pd.Index)) and values.dtype.kind == 'M':
+        return values.values.astype('datetime64[ns]').view('int64')
+    return pd.to_datetime(values).values.astype('datetime64[ns]').view('int64')
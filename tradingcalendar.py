@@ -0,0 +1,356 @@
+#encoding=utf-8
+
+"""
+交易日历和交易时段索引。
+TradingCalendar 描述一个交易所的交易日(工作日除去节假日)和每天的交易时段，
+如上交所(SHH)和深交所(SHE)的9:30-11:30、13:00-15:00，数字货币则是全天24小时、每天交易。
+SessionIndex 是日历在一段日期内按bar周期展开的所有bar位置(slot)，
+时间到slot的定位、交易时段的边界和缺失bar的检测都是向量化的数组计算。
+
+多个标的的对齐不再是合并索引再reindex(pad)：每个bar的时间直接计算出它所在的slot，
+只在交易时段内的slot之间向前填充，不会把填充延续到夜间、周末和节假日。
+
+所有的时间都是交易所当地的时钟时间(与数据文件中的时间相同)，以int64的epoch纳秒表示。
+
+使用:
+    calendar = calendar_for(['600000', '000001'])     # 按symbol.csv中的exchange_id
+    symbol_data = calendar.align(symbol_data, freq='1D')
+    missing = calendar.session_index(start, end, '1min').gaps(times)
+
+author: lvbj
+date: 2019-4-1
+"""
+
+import warnings
+
+import pandas as pd
+import numpy as np
+
+from timeutil import to_epoch_ns, parse_epoch_ns
+
+
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_DAY = 24 * 60 * NS_PER_MINUTE
+
+
+class OffSessionBarWarning(UserWarning):
+    """
+    对齐时有bar的时间不是交易时段内的slot的起始时间，这些bar被丢弃。
+    """
+    pass
+
+
+def _minutes(hhmm):
+    """
+    '09:30' -> 570
+    """
+    h, m = hhmm.split(':')
+    return int(h) * 60 + int(m)
+
+
+def _to_ns(freq):
+    return int(pd.Timedelta(freq).value)
+
+
+class SessionIndex(object):
+    """
+    SessionIndex 是一段日期内所有交易时段的bar位置(slot)。
+
+    slots - 每个bar的起始时间(epoch纳秒)，按时间排序。
+    session - 每个slot所属的交易日(交易时段)的序号。
+    days - 各个交易日(自1970-01-01起的天数)。
+    freq - bar的周期(纳秒)，不小于一天时每个交易日一个slot，时间为当天的0点。
+    continuous - 交易时段之间没有休市，每个交易日只有一个slot(日线)或全天交易(如CRYPTO)时为True，
+        这时按交易时段填充与'pad'相同。
+    """
+
+    def __init__(self, days, offsets, freq):
+        """
+        Parameters:
+        days - 交易日的数组(自1970-01-01起的天数)。
+        offsets - 每个交易日内各个slot相对于0点的纳秒数。
+        freq - bar的周期(纳秒)。
+        """
+        self.days = np.asarray(days, dtype='int64')
+        self.offsets = np.asarray(offsets, dtype='int64')
+        self.freq = freq
+        self.per_session = len(self.offsets)
+        self.slots = (self.days[:, None] * NS_PER_DAY + self.offsets[None, :]).ravel()
+        self.session = np.repeat(np.arange(len(self.days), dtype='int32'), self.per_session)
+        self.continuous = bool(self.per_session == 1 or
+                               (self.offsets[0] == 0 and
+                                self.offsets[-1] + freq >= NS_PER_DAY))
+        for arr in (self.days, self.offsets, self.slots, self.session):
+            arr.flags.writeable = False
+
+    def __len__(self):
+        return len(self.slots)
+
+    def session_bounds(self):
+        """
+        各个交易时段的第一个bar的起始时间和最后一个bar的结束时间。
+
+        Returns:
+        open, close - 两个epoch纳秒的数组。
+        """
+        opens = self.days * NS_PER_DAY + self.offsets[0]
+        closes = self.days * NS_PER_DAY + self.offsets[-1] + min(self.freq, NS_PER_DAY)
+        return opens, closes
+
+    def locate(self, times, label='start'):
+        """
+        计算每个时间所在的slot的位置，不在交易时段的bar上的时间为-1。
+        周期不小于一天时只按日期定位。
+
+        Parameters:
+        times - epoch纳秒的数组。
+        label - 'start'表示时间是bar的起始时间，'end'表示时间是bar的结束时间
+            (如分钟bar标记为11:30、15:00)。
+        """
+        if label not in ('start', 'end'):
+            raise ValueError("label should be 'start' or 'end'")
+        times = np.asarray(times, dtype='int64')
+        if label == 'end' and self.freq < NS_PER_DAY:
+            times = times - self.freq
+        day = times // NS_PER_DAY
+        di = np.searchsorted(self.days, day)
+        di_safe = np.minimum(di, len(self.days) - 1)
+        valid = (di < len(self.days)) & (self.days[di_safe] == day)
+        if self.freq >= NS_PER_DAY:
+            k = np.zeros(len(times), dtype='int64')
+        else:
+            off = times - day * NS_PER_DAY
+            k = np.searchsorted(self.offsets, off)
+            k_safe = np.minimum(k, self.per_session - 1)
+            valid &= (k < self.per_session) & (self.offsets[k_safe] == off)
+            k = k_safe
+        return np.where(valid, di_safe * self.per_session + k, -1)
+
+    def is_open(self, times, label='start'):
+        """
+        每个时间是否是一个交易时段内的bar的起始(label='end'时为结束)时间。
+        """
+        return self.locate(times, label) >= 0
+
+    def gaps(self, times, label='start'):
+        """
+        在times的第一个和最后一个bar之间，交易时段内没有数据的slot。
+
+        Returns:
+        缺失的bar的起始时间(epoch纳秒)的数组。
+        """
+        pos = self.locate(times, label)
+        pos = pos[pos >= 0]
+        if len(pos) == 0:
+            return np.empty(0, dtype='int64')
+        have = np.zeros(len(self.slots), dtype=bool)
+        have[pos] = True
+        first, last = pos.min(), pos.max()
+        return self.slots[first:last + 1][~have[first:last + 1]]
+
+    def gaps_per_session(self, times, label='start'):
+        """
+        每个交易时段内缺失的bar数，以交易日的日期为索引。
+        """
+        missing = self.locate(self.gaps(times, label))
+        counts = np.bincount(self.session[missing], minlength=len(self.days))
+        return pd.Series(counts, index=(self.days * NS_PER_DAY).view('datetime64[ns]'))
+
+    def align(self, symbol_data, fill='session', label='start'):
+        """
+        把各个标的的bar数据放到slot上。不在交易时段的bar被丢弃并以OffSessionBarWarning报告数量，
+        缺失的bar以上一个bar的收盘价填充(开高低收都等于收盘价，成交量为0)。
+        所有标的都有数据之前的slot和所有标的的最后一个bar之后的slot被去掉。
+
+        Parameters:
+        symbol_data - dict, symbol -> 包含datetime, open, high, low, close, volume列的DataFrame。
+        fill - 'session'只在同一个交易时段内填充，交易时段开始时缺失的bar为NaN，
+            日线和全天交易的日历(continuous)没有休市，与'pad'相同，停牌日和0点的缺失bar
+            以上一个bar的收盘价填充；
+            'pad'在所有slot之间向前填充，会把前一个交易日的收盘价延续到下一个交易日；
+            None不填充(缺失的bar为NaN)。
+            NaN的bar在DataFrameDataHandler中被跳过，不会推送给组合。
+        label - bar的时间是起始时间('start')还是结束时间('end')，见locate。
+
+        Returns:
+        dict, symbol -> 以slot为datetime的DataFrame，各个标的的行数相同。
+        """
+        if fill not in ('pad', 'session', None):
+            raise ValueError("fill should be 'pad', 'session' or None")
+        if fill == 'session' and self.continuous:
+            fill = 'pad'
+        n = len(self.slots)
+        arange = np.arange(n)
+        session_start = np.searchsorted(self.session, self.session, side='left')
+
+        aligned = {}
+        dropped = {}
+        first, last = 0, -1
+        for s, df in symbol_data.items():
+            pos = self.locate(parse_epoch_ns(df['datetime']), label)
+            keep = pos >= 0
+            if not keep.all():
+                dropped[s] = int(len(keep) - keep.sum())
+            pos = pos[keep]
+            have = np.zeros(n, dtype=bool)
+            have[pos] = True
+            if len(pos) > 0:
+                last = max(last, int(pos.max()))
+
+            src = np.where(have, arange, -1)
+            if fill is not None:
+                src = np.maximum.accumulate(src)
+                if fill == 'session':
+                    src[src < session_start] = -1
+            valid = src >= 0
+            if valid.any():
+                first = max(first, int(np.argmax(valid)))
+            else:
+                first = n
+
+            columns = {}
+            for c in df.columns:
+                if c == 'datetime' or not np.issubdtype(df[c].dtype, np.number):
+                    continue
+                raw = np.full(n, np.nan)
+                raw[pos] = df[c].values[keep]
+                columns[c] = raw
+
+            close = np.where(valid, columns['close'][np.maximum(src, 0)], np.nan)
+            out = {'datetime': self.slots.view('datetime64[ns]')}
+            for c, raw in columns.items():
+                if c in ('open', 'high', 'low'):
+                    out[c] = np.where(have, raw, close)
+                elif c == 'close':
+                    out[c] = close
+                elif c == 'volume':
+                    out[c] = np.where(have, raw, np.where(valid, 0.0, np.nan))
+                else:
+                    out[c] = np.where(valid, raw[np.maximum(src, 0)], np.nan)
+            aligned[s] = out
+
+        if dropped:
+            warnings.warn("{} bars are not at the start of a session slot and were dropped: {}. "
+                          "Check the calendar, freq and label ('end' for bars labelled by "
+                          "their end time).".format(sum(dropped.values()), dropped),
+                          OffSessionBarWarning)
+
+        return dict((s, pd.DataFrame(dict((c, v[first:last + 1]) for c, v in out.items()),
+                                     columns=list(out.keys())))
+                    for s, out in aligned.items())
+
+
+class TradingCalendar(object):
+    """
+    TradingCalendar 描述一个交易所的交易日和交易时段，
+    同一段日期和周期的SessionIndex只计算一次。
+    """
+
+    def __init__(self, name, sessions, weekdays=(0, 1, 2, 3, 4), holidays=()):
+        """
+        Parameters:
+        name - 日历的名字。
+        sessions - 每天的交易时段，[('09:30', '11:30'), ('13:00', '15:00')]，
+            ('00:00', '24:00')表示全天。
+        weekdays - 交易的星期，0为星期一。
+        holidays - 不交易的日期(字符串、datetime或epoch纳秒)。
+        """
+        self.name = name
+        self.sessions = [(_minutes(a), _minutes(b)) for a, b in sessions]
+        self.weekdays = tuple(weekdays)
+        self.holidays = np.unique(np.array([to_epoch_ns(d) // NS_PER_DAY for d in holidays],
+                                           dtype='int64'))
+        self.__cache = {}
+
+    def add_holidays(self, holidays):
+        """
+        增加不交易的日期，清空已经计算的SessionIndex。
+        """
+        days = [to_epoch_ns(d) // NS_PER_DAY for d in holidays]
+        self.holidays = np.unique(np.r_[self.holidays, np.array(days, dtype='int64')])
+        self.__cache = {}
+
+    def trading_days(self, start_date, end_date):
+        """
+        区间内(包含两端)的交易日，自1970-01-01起的天数。
+        """
+        first = to_epoch_ns(start_date) // NS_PER_DAY
+        last = to_epoch_ns(end_date) // NS_PER_DAY
+        days = np.arange(first, last + 1, dtype='int64')
+        # 1970-01-01是星期四
+        weekday = (days + 3) % 7
+        mask = np.isin(weekday, self.weekdays) & ~np.isin(days, self.holidays)
+        return days[mask]
+
+    def intraday_offsets(self, freq):
+        """
+        一个交易日内各个bar的起始时间相对于0点的纳秒数。
+        """
+        if freq >= NS_PER_DAY:
+            return np.zeros(1, dtype='int64')
+        return np.concatenate([np.arange(a * NS_PER_MINUTE, b * NS_PER_MINUTE, freq, dtype='int64')
+                               for a, b in self.sessions])
+
+    def session_index(self, start_date, end_date, freq='1min'):
+        """
+        返回区间内按freq展开的SessionIndex。
+
+        Parameters:
+        start_date, end_date - 包含两端的日期，可以是字符串、datetime或epoch纳秒。
+        freq - bar的周期，pandas的时间间隔字符串(如'1min', '5min', '1D')或纳秒数。
+        """
+        if not isinstance(freq, (int, np.integer)):
+            freq = _to_ns(freq)
+        first = to_epoch_ns(start_date) // NS_PER_DAY
+        last = to_epoch_ns(end_date) // NS_PER_DAY
+        key = (first, last, freq)
+        if key not in self.__cache:
+            self.__cache[key] = SessionIndex(self.trading_days(first * NS_PER_DAY, last * NS_PER_DAY),
+                                             self.intraday_offsets(freq), freq)
+        return self.__cache[key]
+
+    def align(self, symbol_data, freq='1min', fill='session', label='start'):
+        """
+        在覆盖所有数据的SessionIndex上对齐各个标的的bar数据，见SessionIndex.align。
+        """
+        times = [parse_epoch_ns(df['datetime']) for df in symbol_data.values()]
+        times = [t for t in times if len(t) > 0]
+        if not times:
+            raise ValueError("No bars to align")
+        start = min(int(t.min()) for t in times)
+        end = max(int(t.max()) for t in times)
+        return self.session_index(start, end, freq).align(symbol_data, fill, label)
+
+
+CHINA_A = TradingCalendar('China A', [('09:30', '11:30'), ('13:00', '15:00')])
+CRYPTO = TradingCalendar('Crypto', [('00:00', '24:00')], weekdays=range(7))
+
+# symbol.csv中的exchange_id -> 日历
+EXCHANGE_CALENDARS = {'SHH': CHINA_A, 'SHE': CHINA_A, 'CRYPTO': CRYPTO}
+
+
+def load_exchanges(path="datas/securities_master/symbol.csv"):
+    """
+    读取证券主数据，返回dict, ticker -> exchange_id。
+    """
+    master = pd.read_csv(path, dtype={'ticker': str}, encoding='utf-8')
+    tickers = master['ticker'].str.pad(6, side='left', fillchar='0')
+    return dict(zip(tickers, master['exchange_id']))
+
+
+def calendar_for(symbol_list, path="datas/securities_master/symbol.csv"):
+    """
+    按证券主数据中的exchange_id返回symbol_list的交易日历，
+    不在证券主数据中的标的(如数字货币)使用CRYPTO。
+    所有标的必须使用同一个日历。
+    """
+    try:
+        exchanges = load_exchanges(path)
+    except IOError:
+        exchanges = {}
+    calendars = set(EXCHANGE_CALENDARS.get(exchanges.get(s, 'CRYPTO'), CRYPTO)
+                    for s in symbol_list)
+    if len(calendars) != 1:
+        raise ValueError("Symbols {} trade on different calendars: {}".format(
+            symbol_list, sorted(c.name for c in calendars)))
+    return calendars.pop()
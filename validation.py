@@ -0,0 +1,234 @@
+#encoding=utf-8
+
+"""
+载入数据时的数据质量检查。
+DataValidator 以向量化的方式一次检查整列bar数据，包括缺失值、非正的价格、时间不单调、重复的时间、
+最高/最低价不一致、零成交量和时间缺口。每一种问题可以分别配置处理方式：
+    'drop'   - 删除有问题的bar
+    'repair' - 修复有问题的bar
+    'raise'  - 抛出DataValidationError
+    'ignore' - 只记录在报告中
+所有的检查结果都记录在ValidationReport中。
+
+通过检查的数据在回测的主循环中不需要再逐个bar地检查，参见Bar的check参数。
+
+author: lvbj
+date: 2019-3-5
+"""
+
+import numpy as np
+import pandas as pd
+
+
+PRICE_FIELDS = ['open', 'high', 'low', 'close']
+
+# 每一种问题可以使用的处理方式及默认的处理方式
+ISSUES = {
+    'missing':       (('drop', 'repair', 'raise', 'ignore'), 'repair'),
+    'non_positive':  (('drop', 'repair', 'raise', 'ignore'), 'repair'),
+    'non_monotonic': (('drop', 'repair', 'raise', 'ignore'), 'repair'),
+    'duplicate':     (('drop', 'repair', 'raise', 'ignore'), 'repair'),
+    'high_low':      (('drop', 'repair', 'raise', 'ignore'), 'repair'),
+    'zero_volume':   (('drop', 'repair', 'raise', 'ignore'), 'ignore'),
+    'gap':           (('repair', 'raise', 'ignore'), 'ignore'),
+}
+
+
+class DataValidationError(ValueError):
+    """
+    数据检查发现问题，且该问题的处理方式为'raise'。
+    """
+    pass
+
+
+class ValidationReport(object):
+    """
+    ValidationReport 记录每个标的每一种问题的数量和处理方式。
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, symbol, issue, count, action):
+        self.records.append({'symbol': symbol, 'issue': issue,
+                             'count': int(count), 'action': action})
+
+    def summary(self):
+        """
+        返回所有发现的问题，每行是一个(symbol, issue)。
+        """
+        return pd.DataFrame(self.records, columns=['symbol', 'issue', 'count', 'action'])
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        if len(self.records) == 0:
+            return "ValidationReport: no issues found."
+        return "ValidationReport:\n{}".format(self.summary().to_string(index=False))
+
+
+class DataValidator(object):
+    """
+    DataValidator 检查并清洗一个标的的bar数据DataFrame，
+    DataFrame包含datetime, open, high, low, close, volume列。
+    """
+
+    def __init__(self, policies=None, freq=None):
+        """
+        Parameters:
+        policies - dict, 问题 -> 处理方式，未指定的问题使用ISSUES中的默认处理方式。
+        freq - bar的周期，如'1min'。给定时检查时间缺口，'repair'以前一个bar的收盘价
+            和零成交量补齐缺失的bar。
+        """
+        self.policies = dict((issue, default) for issue, (_, default) in ISSUES.items())
+        for issue, action in (policies or {}).items():
+            if issue not in ISSUES:
+                raise ValueError("Unknown data issue: {}".format(issue))
+            if action not in ISSUES[issue][0]:
+                raise ValueError("{} can't be handled by '{}'".format(issue, action))
+            self.policies[issue] = action
+        self.freq = None if freq is None else pd.Timedelta(freq)
+        self.report = ValidationReport()
+
+    @property
+    def checks_bars(self):
+        """
+        通过检查的bar是否保证价格完整且最高/最低价一致，
+        此时Bar不需要再逐个检查。
+        """
+        return (self.policies['missing'] != 'ignore' and
+                self.policies['non_positive'] != 'ignore' and
+                self.policies['high_low'] != 'ignore')
+
+    def _handle(self, symbol, issue, mask):
+        """
+        记录问题并返回处理方式，没有发现问题时返回None。
+        """
+        count = int(np.count_nonzero(mask))
+        if count == 0:
+            return None
+        action = self.policies[issue]
+        self.report.add(symbol, issue, count, action)
+        if action == 'raise':
+            raise DataValidationError("{}: {} bars with {} issue".format(symbol, count, issue))
+        return action
+
+    def validate(self, df, symbol):
+        """
+        检查一个标的的bar数据，返回清洗后的DataFrame(索引重新编号)。
+
+        Parameters:
+        df - bar数据DataFrame。
+        symbol - 标的代码，用于报告。
+        """
+        df = df.reset_index(drop=True)
+        times = pd.to_datetime(df['datetime'])
+        str_times = df['datetime'].dtype == object
+
+        # 缺失值
+        missing = df[PRICE_FIELDS + ['volume']].isnull().any(axis=1).values
+        missing |= times.isnull().values
+        action = self._handle(symbol, 'missing', missing)
+        if action == 'drop':
+            df, times = df[~missing], times[~missing]
+        elif action == 'repair':
+            # 价格沿用前一个bar的收盘价，无法修复的(时间缺失或开头的)bar被删除
+            df = df.copy()
+            df['volume'] = df['volume'].fillna(0.0)
+            df['close'] = df['close'].ffill()
+            for f in ['open', 'high', 'low']:
+                df[f] = df[f].fillna(df['close'])
+            keep = df['close'].notnull().values & times.notnull().values
+            df, times = df[keep], times[keep]
+
+        # 非正的价格(如停牌日的0)
+        prices = df[PRICE_FIELDS]
+        non_positive = (prices <= 0).any(axis=1).values
+        action = self._handle(symbol, 'non_positive', non_positive)
+        if action == 'drop':
+            df, times = df[~non_positive], times[~non_positive]
+        elif action == 'repair':
+            # 收盘价不是正数时与缺失相同，沿用前一个bar的收盘价且成交量为0，开头的bar被删除；
+            # 其余的价格以同一个bar的收盘价代替
+            df = df.copy()
+            df.loc[df['close'].values <= 0, 'volume'] = 0.0
+            df['close'] = df['close'].where(df['close'] > 0).ffill()
+            for f in ['open', 'high', 'low']:
+                df[f] = df[f].where(df[f] > 0).fillna(df['close'])
+            keep = df['close'].notnull().values
+            df, times = df[keep], times[keep]
+
+        # 时间不单调
+        t = times.values
+        non_monotonic = np.r_[False, t[1:] < np.maximum.accumulate(t)[:-1]]
+        action = self._handle(symbol, 'non_monotonic', non_monotonic)
+        if action == 'drop':
+            df, times = df[~non_monotonic], times[~non_monotonic]
+        elif action == 'repair':
+            order = np.argsort(t, kind='mergesort')
+            df, times = df.iloc[order], times.iloc[order]
+
+        # 重复的时间
+        t = times.values
+        duplicate = np.r_[False, t[1:] == t[:-1]]
+        action = self._handle(symbol, 'duplicate', duplicate)
+        if action == 'drop':
+            df, times = df[~duplicate], times[~duplicate]
+        elif action == 'repair':
+            # 合并成一个bar
+            group = np.cumsum(~duplicate) - 1
+            g = df.groupby(group, sort=False)
+            merged = g.first()
+            merged['high'] = g['high'].max()
+            merged['low'] = g['low'].min()
+            merged['close'] = g['close'].last()
+            merged['volume'] = g['volume'].sum()
+            df, times = merged, times[~duplicate]
+
+        # 最高/最低价不一致
+        prices = df[PRICE_FIELDS].values
+        hi, lo = prices.max(axis=1), prices.min(axis=1)
+        high_low = (df['high'].values < hi) | (df['low'].values > lo)
+        action = self._handle(symbol, 'high_low', high_low)
+        if action == 'drop':
+            df, times = df[~high_low], times[~high_low]
+        elif action == 'repair':
+            df = df.copy()
+            df['high'] = hi
+            df['low'] = lo
+
+        # 零成交量
+        zero_volume = df['volume'].values == 0
+        action = self._handle(symbol, 'zero_volume', zero_volume)
+        if action == 'drop':
+            df, times = df[~zero_volume], times[~zero_volume]
+        elif action == 'repair':
+            # 没有成交的bar价格不变，沿用前一个有成交的bar的收盘价
+            df = df.copy()
+            prev = df['close'].where(~zero_volume).ffill().fillna(df['close']).values
+            for f in PRICE_FIELDS:
+                df[f] = np.where(zero_volume, prev, df[f].values)
+
+        # 时间缺口
+        if self.freq is not None and len(df) > 1:
+            t = times.values
+            gap = np.r_[False, np.diff(t) > self.freq.to_timedelta64()]
+            action = self._handle(symbol, 'gap', gap)
+            if action == 'repair':
+                if not times.is_unique:
+                    raise ValueError("Repairing gaps requires unique and sorted datetimes")
+                full = pd.date_range(t[0], t[-1], freq=self.freq)
+                df = df.set_index(times.values).reindex(full)
+                df['volume'] = df['volume'].fillna(0.0)
+                df['close'] = df['close'].ffill()
+                for f in ['open', 'high', 'low']:
+                    df[f] = df[f].fillna(df['close'])
+                times = pd.Series(full)
+                if str_times:
+                    filled = df['datetime'].isnull().values
+                    df.loc[filled, 'datetime'] = full[filled].strftime("%Y-%m-%d %H:%M:%S")
+                else:
+                    df['datetime'] = full
+
+        return df.reset_index(drop=True)
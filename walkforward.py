@@ -0,0 +1,229 @@
+#encoding=utf-8
+
+"""
+Walk-forward optimisation.
+把bar数据划分成滚动的训练/测试窗口，在每个训练窗口上优化策略参数，
+用选出的参数在紧随其后的测试窗口上做样本外回测，最后把各个样本外的资金曲线拼接起来。
+
+每个窗口上的回测结果按(策略及回测组件的源代码, 参数, 窗口数据)缓存。
+只有窗口的数据完全相同时才复用缓存的结果，如重复运行、或者不同的窗口划分中出现的同一个窗口；
+部分重叠的窗口从头回测，不复用共同的前缀。
+
+author: lvbj
+date: 2019-2-20
+"""
+
+import hashlib
+import itertools
+import os, os.path
+import pickle
+
+import pandas as pd
+
+from data import DataFrameDataHandler
+from execution import SimulatedExecutionHandler
+from main import Backtester
+from portfolio import NaivePortfolio
+from resultcache import source_digest
+
+
+def rolling_windows(n_bars, train_size, test_size, step=None):
+    """
+    把长度为n_bars的bar序列划分成滚动的训练/测试窗口。
+
+    Parameters:
+    n_bars - bar的总数。
+    train_size - 每个训练窗口的bar数。
+    test_size - 每个测试窗口的bar数。
+    step - 相邻窗口起点之间的bar数，默认等于test_size，
+        此时各个测试窗口首尾相接、互不重叠。
+
+    Returns:
+    list of (train_slice, test_slice)
+    """
+    if step is None:
+        step = test_size
+    if train_size <= 0 or test_size <= 0 or step <= 0:
+        raise ValueError("train_size, test_size and step should be positive")
+
+    windows = []
+    start = 0
+    while start + train_size + test_size <= n_bars:
+        train = slice(start, start + train_size)
+        test = slice(start + train_size, start + train_size + test_size)
+        windows.append((train, test))
+        start += step
+    return windows
+
+
+def expand_param_grid(param_grid):
+    """
+    把{参数名: 候选值列表}展开成参数字典的列表。
+    """
+    keys = sorted(param_grid.keys())
+    return [dict(zip(keys, values))
+            for values in itertools.product(*[param_grid[k] for k in keys])]
+
+
+def total_return(equity_curve):
+    """
+    默认的优化目标：资金曲线的总收益率。
+    """
+    return equity_curve['equity_curve'].iloc[-1] - 1.0
+
+
+class WalkForwardOptimizer(object):
+    """
+    WalkForwardOptimizer 在一份已载入内存的bar数据上做walk-forward优化。
+    所有的回测共用同一份数据，不会重新读取csv文件。
+    """
+
+    def __init__(self, symbol_data, strategy_cls, param_grid,
+                 train_size, test_size, step=None, objective=total_return,
+                 initial_capital=1000000.0, cache_dir=None):
+        """
+        Parameters:
+        symbol_data - dict, symbol -> 已对齐的bar数据DataFrame,
+            如CoinDataHandler.load_symbol_data()的返回值。
+        strategy_cls - 策略类，以strategy_cls(bars, backtester, **params)的方式构造。
+        param_grid - dict, 参数名 -> 候选值列表。
+        train_size, test_size, step - 窗口划分，参见rolling_windows()。
+        objective - 以资金曲线DataFrame为参数、返回得分的函数，得分越高越好。
+        initial_capital - 每个窗口回测的初始资金。
+        cache_dir - 缓存回测结果的目录，为None时只在内存中缓存。
+        """
+        self.symbol_data = symbol_data
+        self.symbol_list = list(symbol_data.keys())
+        self.strategy_cls = strategy_cls
+        self.param_sets = expand_param_grid(param_grid)
+        self.objective = objective
+        self.initial_capital = initial_capital
+        self.cache_dir = cache_dir
+
+        n_bars = len(symbol_data[self.symbol_list[0]])
+        self.windows = rolling_windows(n_bars, train_size, test_size, step)
+
+        # 策略和回测组件所在模块的源代码，代码改变时磁盘上的缓存失效
+        self.code_digest = hashlib.sha1(repr([source_digest(c) for c in (
+            strategy_cls, NaivePortfolio, SimulatedExecutionHandler,
+            DataFrameDataHandler, Backtester)]).encode('utf-8')).hexdigest()
+
+        self.__cache = {}
+        self.__fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _window_data(self, window):
+        """
+        返回窗口内的bar数据。
+        """
+        return dict((s, self.symbol_data[s].iloc[window])
+                    for s in self.symbol_list)
+
+    def _fingerprint(self, window):
+        """
+        窗口内bar数据的指纹，数据改变时缓存自动失效。
+        """
+        key = (window.start, window.stop)
+        if key not in self.__fingerprints:
+            h = hashlib.sha1()
+            for s, df in sorted(self._window_data(window).items()):
+                h.update(s.encode('utf-8'))
+                h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+            self.__fingerprints[key] = h.hexdigest()
+        return self.__fingerprints[key]
+
+    def _cache_key(self, params, window):
+        """
+        由策略及其源代码、参数和窗口数据计算缓存的键。
+        """
+        items = (self.strategy_cls.__module__, self.strategy_cls.__name__, self.code_digest,
+                 sorted(params.items()), self.initial_capital,
+                 self._fingerprint(window))
+        return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+    def _backtest(self, params, window):
+        """
+        在窗口内的数据上用给定参数运行一次回测，返回资金曲线。
+        """
+        window_data = self._window_data(window)
+        start_date = window_data[self.symbol_list[0]]['datetime'].iloc[0]
+        tester = Backtester(
+            bars=lambda bt: DataFrameDataHandler(bt, window_data),
+            strategy=lambda bt: self.strategy_cls(bt.bars, bt, **params),
+            port=lambda bt: NaivePortfolio(bt.bars, bt, start_date, self.initial_capital),
+            broker=lambda bt: SimulatedExecutionHandler(bt))
+        tester.run()
+        return tester.port.equity_curve
+
+    def evaluate(self, params, window):
+        """
+        返回参数在窗口上的资金曲线，优先从缓存中读取。
+        """
+        key = self._cache_key(params, window)
+        if key in self.__cache:
+            self.hits += 1
+            return self.__cache[key]
+
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, "{}.pkl".format(key))
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    curve = pickle.load(f)
+                self.__cache[key] = curve
+                self.hits += 1
+                return curve
+
+        self.misses += 1
+        curve = self._backtest(params, window)
+        self.__cache[key] = curve
+        if path is not None:
+            with open(path, 'wb') as f:
+                pickle.dump(curve, f, pickle.HIGHEST_PROTOCOL)
+        return curve
+
+    def optimize(self, window):
+        """
+        在训练窗口上选出得分最高的参数，返回(params, score)。
+        """
+        best_params, best_score = None, None
+        for params in self.param_sets:
+            score = self.objective(self.evaluate(params, window))
+            if best_score is None or score > best_score:
+                best_params, best_score = params, score
+        return best_params, best_score
+
+    def run(self):
+        """
+        运行walk-forward优化。
+
+        Returns:
+        equity_curve - 拼接后的样本外资金曲线，包含returns, equity_curve, total, window列。
+        results - list of dict, 每个窗口选出的参数、样本内和样本外得分。
+        """
+        curves = []
+        results = []
+        for i, (train, test) in enumerate(self.windows):
+            params, in_score = self.optimize(train)
+            curve = self.evaluate(params, test)
+
+            # 第一行是portfolio的初始状态，不属于样本外区间
+            oos = curve.iloc[1:][['returns']].copy()
+            oos['window'] = i
+            curves.append(oos)
+            results.append({'window': i, 'params': params,
+                            'in_sample': in_score,
+                            'out_of_sample': self.objective(curve)})
+
+        if len(curves) == 0:
+            raise ValueError("Not enough bars for a single train/test window")
+
+        equity_curve = pd.concat(curves)
+        equity_curve['returns'] = equity_curve['returns'].fillna(0.0)
+        equity_curve['equity_curve'] = (1.0 + equity_curve['returns']).cumprod()
+        equity_curve['total'] = self.initial_capital * equity_curve['equity_curve']
+        return equity_curve, results
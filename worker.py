@@ -0,0 +1,282 @@
+#encoding=utf-8
+
+"""
+常驻内存的回测worker。
+worker进程启动时一次性读取并对齐行情数据，之后通过本地socket接收回测任务
+(策略类、参数、日期区间)，每个任务都复用内存中的数据，返回统计结果和资金曲线。
+重复运行回测时不再需要导入pandas、读取csv和转换tick数据。
+
+启动worker:
+    python worker.py okcoinUSD btcCNY
+
+提交任务:
+    client = BacktestClient()
+    result = client.run('strategy.BuyAndHoldStrategy', start_date='2017-8-8')
+
+worker每次启动时用os.urandom生成新的认证密钥，写入只有当前用户可读写(0600)的密钥文件
+~/.qingyun/worker-<port>.key，客户端从该文件读取密钥。
+worker会反序列化请求并导入请求中的策略模块，所以只有能读取密钥文件的用户才能提交任务。
+
+策略模块的源文件修改后，下一个任务会重新载入该模块；其他模块修改后需要重启worker。
+
+author: lvbj
+date: 2019-3-1
+"""
+
+import binascii
+import importlib
+import os
+import sys
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+
+DEFAULT_ADDRESS = ('127.0.0.1', 6060)
+
+KEY_DIR = os.path.join(os.path.expanduser('~'), '.qingyun')
+
+
+def default_key_file(address):
+    """
+    worker在address上监听时的密钥文件。
+    """
+    if isinstance(address, tuple):
+        name = "worker-{}.key".format(address[1])
+    else:
+        name = "worker-{}.key".format(os.path.basename(address))
+    return os.path.join(KEY_DIR, name)
+
+
+def write_key_file(path, authkey):
+    """
+    把密钥写入只有当前用户可读写的文件。
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # 文件已经存在时os.open不改变权限
+    os.chmod(path, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(binascii.hexlify(authkey))
+
+
+def read_key_file(path):
+    """
+    读取worker写入的密钥。
+    """
+    try:
+        with open(path, 'rb') as f:
+            return binascii.unhexlify(f.read().strip())
+    except IOError:
+        raise IOError("Can't read the worker key {}, is the worker running "
+                      "as the same user?".format(path))
+
+
+def _source_mtime(module):
+    """
+    模块源文件的修改时间(纳秒)，没有源文件时为None。
+    """
+    path = getattr(module, '__file__', None)
+    try:
+        return os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        return None
+
+
+class BacktestWorker(object):
+    """
+    BacktestWorker 持有已载入内存的bar数据，在本地socket上依次处理回测任务。
+    """
+
+    def __init__(self, symbol_data, address=DEFAULT_ADDRESS, authkey=None, key_file=None):
+        """
+        Parameters:
+        symbol_data - dict, symbol -> 已对齐的bar数据DataFrame,
+            如CoinDataHandler.load_symbol_data()的返回值。
+        address - 监听的(host, port)，或Unix socket的路径。
+        authkey - 客户端连接时使用的认证密钥，默认每次启动时随机生成。
+        key_file - 写入密钥的文件，默认为default_key_file(address)。
+        """
+        import pandas as pd
+
+        self.symbol_data = symbol_data
+        self.symbol_list = list(symbol_data.keys())
+        self.address = address
+        self.authkey = authkey if authkey is not None else os.urandom(32)
+        self.key_file = key_file or default_key_file(address)
+        # 策略模块 -> 导入时源文件的修改时间
+        self.module_mtimes = {}
+
+        # 所有标的已对齐，用第一个标的的时间确定日期区间对应的行
+        first = symbol_data[self.symbol_list[0]]
+        self.datetimes = pd.to_datetime(first['datetime']).values
+
+    def resolve(self, strategy):
+        """
+        返回策略类，策略可以是类，也可以是形如'module.ClassName'的字符串。
+        策略所在模块的源文件在上次导入之后被修改时重新载入该模块，
+        修改策略文件后不需要重启worker。只重新载入策略所在的模块，
+        策略引用的其他模块(如data, portfolio)修改后仍需重启worker。
+        """
+        if isinstance(strategy, str):
+            module_name, _, cls_name = strategy.rpartition('.')
+        else:
+            module_name, cls_name = strategy.__module__, strategy.__qualname__
+        module = importlib.import_module(module_name)
+        mtime = _source_mtime(module)
+        if module_name in self.module_mtimes and self.module_mtimes[module_name] != mtime:
+            module = importlib.reload(module)
+            mtime = _source_mtime(module)
+        self.module_mtimes[module_name] = mtime
+        return getattr(module, cls_name)
+
+    def _slice(self, start_date, end_date):
+        """
+        返回日期区间[start_date, end_date]内的数据，日期为形如'%Y-%m-%d'的字符串。
+        """
+        import numpy as np
+        import pandas as pd
+
+        start, stop = 0, len(self.datetimes)
+        if start_date is not None:
+            start = np.searchsorted(self.datetimes, pd.Timestamp(start_date).to_datetime64())
+        if end_date is not None:
+            end = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+            stop = np.searchsorted(self.datetimes, end.to_datetime64())
+        return dict((s, df.iloc[start:stop]) for s, df in self.symbol_data.items())
+
+    def run_job(self, job):
+        """
+        运行一个回测任务。
+
+        Parameters:
+        job - dict, 包含strategy(策略类或'module.ClassName'),
+            以及可选的params, start_date, end_date, initial_capital。
+
+        Returns:
+        dict - stats(output_summary_stats的结果), equity_curve(资金曲线DataFrame)
+        """
+        from data import DataFrameDataHandler
+        from execution import SimulatedExecutionHandler
+        from main import Backtester
+        from portfolio import NaivePortfolio
+
+        strategy_cls = self.resolve(job['strategy'])
+        params = job.get('params') or {}
+        initial_capital = job.get('initial_capital', 1000000.0)
+
+        window = self._slice(job.get('start_date'), job.get('end_date'))
+        if len(window[self.symbol_list[0]]) == 0:
+            raise ValueError("No bars between {} and {}".format(
+                job.get('start_date'), job.get('end_date')))
+        start = window[self.symbol_list[0]]['datetime'].iloc[0]
+
+        tester = Backtester(
+            bars=lambda bt: DataFrameDataHandler(bt, window),
+            strategy=lambda bt: strategy_cls(bt.bars, bt, **params),
+            port=lambda bt: NaivePortfolio(bt.bars, bt, start, initial_capital),
+            broker=lambda bt: SimulatedExecutionHandler(bt))
+        stats = tester.run()
+        return {'stats': stats, 'equity_curve': tester.port.equity_curve}
+
+    def serve_forever(self):
+        """
+        依次处理客户端的请求，直到收到'shutdown'。
+        """
+        listener = Listener(self.address, authkey=self.authkey)
+        if not isinstance(self.address, tuple):
+            os.chmod(self.address, 0o600)
+        write_key_file(self.key_file, self.authkey)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    # 密钥错误或连接中断的客户端不影响worker
+                    continue
+                try:
+                    job = conn.recv()
+                    if job == 'shutdown':
+                        conn.send({'ok': True})
+                        break
+                    try:
+                        conn.send({'ok': True, 'result': self.run_job(job)})
+                    except Exception:
+                        conn.send({'ok': False, 'error': traceback.format_exc()})
+                except (EOFError, OSError):
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            listener.close()
+            if os.path.exists(self.key_file):
+                os.remove(self.key_file)
+
+
+class BacktestClient(object):
+    """
+    BacktestClient 向BacktestWorker提交回测任务。
+    客户端本身只导入标准库，但返回的资金曲线是pandas的DataFrame，
+    反序列化结果时会在客户端进程中导入pandas和numpy。
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, key_file=None):
+        """
+        Parameters:
+        address - worker监听的地址。
+        authkey - 认证密钥，默认从worker写入的密钥文件读取。
+        key_file - 密钥文件，默认为default_key_file(address)。
+        """
+        self.address = address
+        self.key_file = key_file or default_key_file(address)
+        self.authkey = authkey
+
+    def _request(self, message):
+        # worker每次启动都生成新的密钥，每次请求时重新读取
+        authkey = self.authkey or read_key_file(self.key_file)
+        conn = Client(self.address, authkey=authkey)
+        try:
+            conn.send(message)
+            return conn.recv()
+        finally:
+            conn.close()
+
+    def run(self, strategy, params=None, start_date=None, end_date=None,
+            initial_capital=1000000.0):
+        """
+        提交一个回测任务并等待结果。
+
+        Parameters:
+        strategy - 策略类，或形如'module.ClassName'的字符串。
+            worker必须能够导入该策略所在的模块。
+        params - 策略的参数。
+        start_date, end_date - 形如'%Y-%m-%d'的字符串。
+        initial_capital - 初始资金。
+
+        Returns:
+        dict - stats, equity_curve(pd.DataFrame)
+        """
+        reply = self._request({'strategy': strategy, 'params': params,
+                               'start_date': start_date, 'end_date': end_date,
+                               'initial_capital': initial_capital})
+        if not reply['ok']:
+            raise RuntimeError("Backtest job failed in worker:\n" + reply['error'])
+        return reply['result']
+
+    def shutdown(self):
+        """
+        关闭worker。
+        """
+        self._request('shutdown')
+
+
+if __name__ == '__main__':
+    from data import CoinDataHandler
+
+    symbol_list = sys.argv[1:] or ['okcoinUSD']
+    worker = BacktestWorker(CoinDataHandler.load_symbol_data(symbol_list))
+    print("Backtest worker is listening on {}:{}, key in {}".format(
+        worker.address[0], worker.address[1], worker.key_file))
+    worker.serve_forever()